@@ -0,0 +1,52 @@
+from app.exchange.exchange_factory import get_public_ccxt_client
+from app.services.candle_store import fetch_ohlcv_range
+import os
+import re
+import numpy as np
+from app.config import load_config
+
+load_config()
+
+# 回測用的歷史 K 線放這裡（一個 symbol / timeframe 一個 .npy）
+BACKTEST_DATA_DIR = os.getenv("BACKTEST_DATA_DIR", "./data/candles")
+
+
+def history_path(exchange_code, symbol, timeframe, data_dir=BACKTEST_DATA_DIR):
+    name = re.sub(r"[^A-Za-z0-9]+", "_", f"{exchange_code}_{symbol}_{timeframe}").strip("_")
+    return os.path.join(data_dir, f"{name}.npy")
+
+
+def load_history(exchange_code, symbol, timeframe, since_ms, data_dir=BACKTEST_DATA_DIR, refresh=True):
+    """
+    回傳 (N, 6) float64 陣列 [ts, open, high, low, close, volume]，由舊到新
+    - 存在 .npy，之後只補抓最後一根之後的 K 線
+    - 回傳的是唯讀 memmap 的切片（還是 memmap），多個 process 讀同一份不會各自複製；完全沒有資料時回空的 ndarray
+    """
+    path = history_path(exchange_code, symbol, timeframe, data_dir)
+    stored = np.load(path) if os.path.exists(path) else np.empty((0, 6))
+
+    if refresh:
+        client = get_public_ccxt_client(exchange_code)
+        if len(stored) and stored[0, 0] <= since_ms:
+            # 最後一根可能還沒收完，一起重抓
+            fetched = fetch_ohlcv_range(client, symbol, timeframe, int(stored[-1, 0]))
+            stored = stored[:-1]
+        else:
+            fetched = fetch_ohlcv_range(client, symbol, timeframe, since_ms)
+            stored = np.empty((0, 6))
+
+        if fetched:
+            stored = np.concatenate((stored, np.asarray(fetched, dtype=float)))
+            _, unique = np.unique(stored[:, 0], return_index=True)
+            stored = stored[unique]
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            np.save(path, stored)
+            print(f"[Backtest] {symbol} {timeframe} 補抓 {len(fetched)} 根，共 {len(stored)} 根")
+
+    if not os.path.exists(path):
+        return stored
+
+    candles = np.load(path, mmap_mode="r")
+    # ts 由舊到新排好了，用 searchsorted 切片；布林索引會把整份複製出來
+    start = np.searchsorted(candles[:, 0], since_ms, side="left")
+    return candles[start:]
@@ -0,0 +1,191 @@
+from app.backtest.data import load_history
+from app.strategies.btcusdt_breakout import BREAKOUT_PARAMS, breakout_signals
+import argparse
+import time
+import numpy as np
+import pandas as pd
+
+# 跟 build_open_order 一樣：開倉時掛 0.9 倍進場價的停損
+STOP_LOSS_RATIO = 0.9
+
+
+def run_backtest(
+    candles,
+    params=None,
+    signals=breakout_signals,
+    default_params=BREAKOUT_PARAMS,
+    base_order_usdt=100,
+    leverage=1,
+    fee_rate=0.0005,
+    stop_loss_ratio=STOP_LOSS_RATIO,
+    trade_from=0,
+):
+    """
+    用整段歷史 K 線回測一個策略（只做多，跟目前實盤一樣）
+    candles：(N, 6) 陣列 [ts, open, high, low, close, volume] 或同欄位的 DataFrame
+    - 每根收盤判斷訊號，用收盤價成交（實盤是整點拿剛開的那根判斷，價格幾乎一樣）
+    - OPEN：signals 的 entries 且空手
+    - SL_CLOSE：持倉中最低價碰到停損價（跳空低開就用開盤價），跟交易所 presetStopLossPrice 一樣盤中觸發
+    - TP_CLOSE：收盤 > 進場價 * take_profit（跟實盤一樣先檢查停利）
+    - CLOSE：signals 的 exits
+    - 損益算法跟 check_order_status 一樣，手續費 = 成交金額 * fee_rate
+    trade_from：前面幾根只拿來暖指標，不進場
+    """
+    started = time.perf_counter()
+    ts, open_, high, low, close = _as_arrays(candles)
+    params = {**default_params, **(params or {})}
+    rules = signals(high, low, close, **params)
+
+    entry_index = np.flatnonzero(rules["entries"])
+    entry_index = entry_index[entry_index >= trade_from]
+    exit_index = np.flatnonzero(rules["exits"])
+    take_profit = rules["take_profit"]
+    n = len(close)
+
+    trades = []
+    cursor = 0
+    while True:
+        # 下一個進場點
+        i = np.searchsorted(entry_index, cursor)
+        if i >= len(entry_index):
+            break
+        entry = int(entry_index[i])
+        entry_price = float(close[entry])
+        qty = base_order_usdt / entry_price
+        stop_price = round(entry_price * stop_loss_ratio)
+
+        # 訊號出場點之前，找第一根停損 / 停利
+        j = np.searchsorted(exit_index, entry + 1)
+        signal_exit = int(exit_index[j]) if j < len(exit_index) else n
+        window = slice(entry + 1, min(signal_exit + 1, n))
+        hit = (low[window] <= stop_price) | (close[window] > entry_price * take_profit)
+
+        if hit.any():
+            exit_ = entry + 1 + int(np.argmax(hit))
+            if low[exit_] <= stop_price:
+                action, exit_price = "SL_CLOSE", min(float(open_[exit_]), stop_price)
+            else:
+                action, exit_price = "TP_CLOSE", float(close[exit_])
+        elif signal_exit < n:
+            exit_ = signal_exit
+            action, exit_price = "CLOSE", float(close[exit_])
+        else:
+            # 回測結束還沒平倉
+            trades.append(_trade(ts, entry, None, entry_price, None, qty, "OPEN", fee_rate, leverage))
+            break
+
+        trades.append(_trade(ts, entry, exit_, entry_price, exit_price, qty, action, fee_rate, leverage))
+        cursor = exit_ + 1
+
+    equity = _equity_curve(close, trades)
+    drawdown = equity - np.maximum.accumulate(equity)
+    closed = [t for t in trades if t["action"] != "OPEN"]
+    wins = [t for t in closed if t["pnl"] > 0]
+    elapsed = time.perf_counter() - started
+
+    return {
+        "params": params,
+        "bars": n - trade_from,
+        "trades": trades,
+        "equity": equity,
+        "drawdown": drawdown,
+        "total_pnl": float(equity[-1]) if n else 0.0,
+        "max_drawdown": float(drawdown.min()) if n else 0.0,
+        "trade_count": len(closed),
+        "win_rate": len(wins) / len(closed) if closed else 0.0,
+        "elapsed": elapsed,
+        "bars_per_second": n / elapsed if elapsed else 0.0,
+    }
+
+
+def _as_arrays(candles):
+    if isinstance(candles, pd.DataFrame):
+        ts = candles["timestamp"]
+        if pd.api.types.is_datetime64_any_dtype(ts):
+            ts = ts.dt.as_unit("ms").astype("int64")
+        return (
+            ts.to_numpy(dtype=float),
+            candles["open"].to_numpy(dtype=float),
+            candles["high"].to_numpy(dtype=float),
+            candles["low"].to_numpy(dtype=float),
+            candles["close"].to_numpy(dtype=float),
+        )
+    candles = np.asarray(candles, dtype=float)
+    return candles[:, 0], candles[:, 1], candles[:, 2], candles[:, 3], candles[:, 4]
+
+
+def _trade(ts, entry, exit_, entry_price, exit_price, qty, action, fee_rate, leverage):
+    open_fee = entry_price * qty * fee_rate
+    trade = {
+        "action": action,
+        "entry_index": entry,
+        "exit_index": exit_,
+        "entry_at": int(ts[entry]),
+        "exit_at": int(ts[exit_]) if exit_ is not None else None,
+        "entry_price": entry_price,
+        "exit_price": exit_price,
+        "quantity": qty,
+        "open_fee": open_fee,
+        "close_fee": None,
+        "pnl": None,
+        "pnl_pct": None,
+    }
+    if exit_price is not None:
+        close_fee = exit_price * qty * fee_rate
+        pnl = (exit_price - entry_price) * qty - open_fee - close_fee
+        trade["close_fee"] = close_fee
+        trade["pnl"] = pnl
+        trade["pnl_pct"] = pnl / (exit_price * qty) * 100 * leverage
+    return trade
+
+
+def _equity_curve(close, trades):
+    """每根收盤時的累積損益（已實現 + 持倉中的未實現）"""
+    realized = np.zeros(len(close))
+    unrealized = np.zeros(len(close))
+
+    for trade in trades:
+        entry = trade["entry_index"]
+        end = trade["exit_index"] if trade["exit_index"] is not None else len(close)
+        unrealized[entry:end] = (close[entry:end] - trade["entry_price"]) * trade["quantity"] - trade["open_fee"]
+        if trade["pnl"] is not None:
+            realized[end] += trade["pnl"]
+
+    return np.cumsum(realized) + unrealized
+
+
+def main():
+    parser = argparse.ArgumentParser(description="breakout_strategy 回測")
+    parser.add_argument("--exchange", default="binanceusdm")
+    parser.add_argument("--symbol", default="BTC/USDT:USDT")
+    parser.add_argument("--timeframe", default="1h")
+    parser.add_argument("--since", default="2021-01-01", help="UTC 日期")
+    parser.add_argument("--base-order-usdt", type=float, default=100)
+    parser.add_argument("--leverage", type=float, default=1)
+    parser.add_argument("--fee-rate", type=float, default=0.0005)
+    args = parser.parse_args()
+
+    since_ms = int(pd.Timestamp(args.since, tz="UTC").timestamp() * 1000)
+    candles = load_history(args.exchange, args.symbol, args.timeframe, since_ms)
+    result = run_backtest(
+        candles,
+        base_order_usdt=args.base_order_usdt,
+        leverage=args.leverage,
+        fee_rate=args.fee_rate,
+    )
+
+    for trade in result["trades"]:
+        print(
+            f"{trade['action']:<9} 進場 {pd.to_datetime(trade['entry_at'], unit='ms')} @ {trade['entry_price']:.2f}"
+            f" 出場 {pd.to_datetime(trade['exit_at'], unit='ms') if trade['exit_at'] else '-'}"
+            f" @ {trade['exit_price'] or 0:.2f} PnL {trade['pnl'] or 0:.2f} ({trade['pnl_pct'] or 0:.2f}%)"
+        )
+    print(
+        f"[Backtest] {result['bars']} 根 K 線，{result['trade_count']} 筆交易，勝率 {result['win_rate']:.1%}，"
+        f"總損益 {result['total_pnl']:.2f} USDT，最大回撤 {result['max_drawdown']:.2f} USDT，"
+        f"{result['bars_per_second']:,.0f} 根/秒"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+from app.backtest.data import load_history
+from app.backtest.engine import run_backtest
+from app.strategies.btcusdt_breakout import BREAKOUT_PARAMS
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import argparse
+import itertools
+import json
+import os
+import random
+import time
+import numpy as np
+import pandas as pd
+from app.config import load_config
+
+load_config()
+
+# 調參結果放這裡（每次一個資料夾）
+OPTIMIZER_OUTPUT_DIR = os.getenv("OPTIMIZER_OUTPUT_DIR", "./data/optimizer")
+
+# 每段回測前面多給幾根 K 線暖指標（不進場）
+OPTIMIZER_WARMUP_BARS = int(os.getenv("OPTIMIZER_WARMUP_BARS", 500))
+
+# breakout_strategy 預設的搜尋範圍
+BREAKOUT_SPACE = {
+    "look_back": list(range(16, 97, 8)),
+    "adx_period": [7, 10, 14, 20, 28],
+    "adx_threshold": list(range(15, 41, 5)),
+    "take_profit": [1.02, 1.03, 1.05, 1.08, 1.1, 1.15],
+}
+
+_candles = None  # worker process 裡的 memmap
+
+
+def grid_params(space):
+    """所有組合"""
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+
+def random_params(space, samples, seed=None):
+    """從所有組合裡不重複抽 samples 組"""
+    total = int(np.prod([len(v) for v in space.values()]))
+    rng = random.Random(seed)
+    if samples >= total:
+        return grid_params(space)
+
+    keys = list(space)
+    picked = set()
+    while len(picked) < samples:
+        picked.add(tuple(rng.randrange(len(space[k])) for k in keys))
+    return [{k: space[k][i] for k, i in zip(keys, combo)} for combo in sorted(picked)]
+
+
+def walk_forward_splits(bars, train_bars, test_bars):
+    """[(train_start, train_end, test_end), ...]，每段往後滑 test_bars"""
+    splits = []
+    start = 0
+    while start + train_bars + test_bars <= bars:
+        splits.append((start, start + train_bars, start + train_bars + test_bars))
+        start += test_bars
+    return splits
+
+
+class Optimizer:
+    """
+    多核心跑參數搜尋
+    - K 線先存成一份 .npy，worker 用 memmap 開同一份，task 只傳參數跟區間，不用 pickle K 線
+    - rank()：某一段資料上所有參數組合的排名
+    - out_of_sample()：前段排名、取前幾名到後段驗證
+    - walk_forward()：每一段訓練期選最好的參數，在下一段測試期驗證
+    """
+
+    def __init__(self, candles, output_dir=None, workers=None, metric="total_pnl", backtest_options=None):
+        self.output_dir = output_dir or os.path.join(
+            OPTIMIZER_OUTPUT_DIR, datetime.now().strftime("%Y%m%d_%H%M%S"))
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        self.candles_path = os.path.join(self.output_dir, "candles.npy")
+        np.save(self.candles_path, np.asarray(candles, dtype=float))
+        self.bars = len(candles)
+
+        self.workers = workers or os.cpu_count()
+        self.metric = metric
+        self.backtest_options = backtest_options or {}
+        self._pool = None
+
+    def __enter__(self):
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker, initargs=(self.candles_path,))
+        return self
+
+    def __exit__(self, *exc):
+        self._pool.shutdown()
+        self._pool = None
+
+    def rank(self, combos, start=0, end=None):
+        """回傳依 metric 排好的 DataFrame（一列一組參數）"""
+        end = self.bars if end is None else end
+        tasks = [(params, start, end, self.backtest_options) for params in combos]
+        chunksize = max(1, len(tasks) // (self.workers * 8))
+
+        started = time.perf_counter()
+        rows = list(self._pool.map(_evaluate, tasks, chunksize=chunksize))
+        elapsed = time.perf_counter() - started
+        print(
+            f"[Optimizer] {len(tasks)} 組參數 x {end - start} 根 K 線，{elapsed:.1f} 秒"
+            f"（{len(tasks) / elapsed:.0f} 組/秒）"
+        )
+
+        df = pd.DataFrame(rows)
+        df["score"] = _score(df, self.metric)
+        return df.sort_values("score", ascending=False).reset_index(drop=True)
+
+    def out_of_sample(self, combos, train_ratio=0.7, top=20):
+        split = int(self.bars * train_ratio)
+        ranking = self.rank(combos, 0, split)
+
+        best = ranking.head(top)
+        oos = self.rank([_params_of(row) for _, row in best.iterrows()], split, self.bars)
+        oos = oos.rename(columns={c: f"oos_{c}" for c in oos.columns if c not in BREAKOUT_PARAMS})
+        ranking = ranking.merge(oos, on=list(BREAKOUT_PARAMS), how="left")
+
+        self._write("ranking.csv", ranking)
+        return ranking
+
+    def walk_forward(self, combos, train_bars, test_bars):
+        folds = []
+        for i, (train_start, train_end, test_end) in enumerate(
+                walk_forward_splits(self.bars, train_bars, test_bars)):
+            ranking = self.rank(combos, train_start, train_end)
+            best = ranking.iloc[0]
+            test = self.rank([_params_of(best)], train_end, test_end).iloc[0]
+            folds.append({
+                "fold": i,
+                "train_start": train_start,
+                "train_end": train_end,
+                "test_end": test_end,
+                **_params_of(best),
+                "train_score": best["score"],
+                "train_pnl": best["total_pnl"],
+                "test_pnl": test["total_pnl"],
+                "test_max_drawdown": test["max_drawdown"],
+                "test_trade_count": test["trade_count"],
+                "test_win_rate": test["win_rate"],
+            })
+            print(f"[Optimizer] walk-forward 第 {i} 段：最佳 {_params_of(best)}，測試期損益 {test['total_pnl']:.2f}")
+
+        df = pd.DataFrame(folds)
+        self._write("walk_forward.csv", df)
+        return df
+
+    def _write(self, name, df):
+        path = os.path.join(self.output_dir, name)
+        df.to_csv(path, index=False)
+        print(f"[Optimizer] 結果寫到 {path}")
+
+
+def _init_worker(candles_path):
+    global _candles
+    _candles = np.load(candles_path, mmap_mode="r")
+
+
+def _evaluate(task):
+    params, start, end, options = task
+    warmup_start = max(0, start - OPTIMIZER_WARMUP_BARS)
+    result = run_backtest(
+        _candles[warmup_start:end], params=params, trade_from=start - warmup_start, **options)
+    return {
+        **result["params"],
+        "total_pnl": result["total_pnl"],
+        "max_drawdown": result["max_drawdown"],
+        "trade_count": result["trade_count"],
+        "win_rate": result["win_rate"],
+    }
+
+
+def _score(df, metric):
+    if metric == "pnl_drawdown":
+        # 損益 / 最大回撤，沒有回撤的當作回撤 1
+        return df["total_pnl"] / df["max_drawdown"].abs().clip(lower=1)
+    return df[metric]
+
+
+def _params_of(row):
+    """DataFrame 的一列轉回參數 dict（iterrows 會把 int 變 float，照預設值的型別轉回來）"""
+    return {key: type(default)(row[key]) for key, default in BREAKOUT_PARAMS.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="breakout_strategy 參數搜尋")
+    parser.add_argument("--exchange", default="binanceusdm")
+    parser.add_argument("--symbol", default="BTC/USDT:USDT")
+    parser.add_argument("--timeframe", default="1h")
+    parser.add_argument("--since", default="2021-01-01", help="UTC 日期")
+    parser.add_argument("--samples", type=int, default=0, help="隨機抽幾組，0 = 全部組合")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--metric", default="total_pnl", choices=["total_pnl", "pnl_drawdown", "win_rate"])
+    parser.add_argument("--train-ratio", type=float, default=0.7, help="樣本外驗證：前面多少比例拿來排名")
+    parser.add_argument("--walk-forward", action="store_true")
+    parser.add_argument("--train-bars", type=int, default=24 * 365)
+    parser.add_argument("--test-bars", type=int, default=24 * 90)
+    args = parser.parse_args()
+
+    since_ms = int(pd.Timestamp(args.since, tz="UTC").timestamp() * 1000)
+    candles = load_history(args.exchange, args.symbol, args.timeframe, since_ms)
+
+    if args.samples:
+        combos = random_params(BREAKOUT_SPACE, args.samples, args.seed)
+    else:
+        combos = grid_params(BREAKOUT_SPACE)
+
+    with Optimizer(candles, workers=args.workers, metric=args.metric) as optimizer:
+        if args.walk_forward:
+            result = optimizer.walk_forward(combos, args.train_bars, args.test_bars)
+            summary = {
+                "folds": len(result),
+                "test_pnl": float(result["test_pnl"].sum()) if len(result) else 0.0,
+            }
+        else:
+            result = optimizer.out_of_sample(combos, args.train_ratio)
+            summary = {"best": _params_of(result.iloc[0]), "train_pnl": float(result.iloc[0]["total_pnl"])}
+
+        with open(os.path.join(optimizer.output_dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "combos": len(combos), **summary}, f, ensure_ascii=False, indent=2)
+
+    print(result.head(20).to_string())
+
+
+if __name__ == "__main__":
+    main()
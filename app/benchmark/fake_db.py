@@ -0,0 +1,141 @@
+from pymysql.constants import SERVER_STATUS
+import sqlite3
+import threading
+
+# tick 會碰到的表（欄位跟 MySQL 一樣，型別交給 sqlite）
+SCHEMA = """
+CREATE TABLE exchanges (id INTEGER PRIMARY KEY, code TEXT);
+CREATE TABLE exchange_accounts (id INTEGER PRIMARY KEY, exchange_id INTEGER, params TEXT);
+CREATE TABLE strategies (
+    id INTEGER PRIMARY KEY, name TEXT, unified_symbol TEXT, is_active INTEGER, timeframe TEXT, code TEXT, params TEXT);
+CREATE TABLE bots (
+    id INTEGER PRIMARY KEY, user_id INTEGER, strategy_id INTEGER, exchange_account_id INTEGER,
+    exchange_symbol TEXT, leverage INTEGER, base_order_usdt REAL, status TEXT);
+CREATE INDEX bots_strategy ON bots (strategy_id, status);
+CREATE TABLE strategy_trades (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, strategy_id INTEGER, position_side TEXT, entry_price REAL, entry_at TEXT,
+    exit_price REAL, exit_at TEXT, status TEXT, pnl_pct REAL, extra TEXT, created_at TEXT, updated_at TEXT);
+CREATE TABLE user_trades (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, strategy_trade_id INTEGER, exchange_account_id INTEGER,
+    bot_id INTEGER, exchange_symbol TEXT, position_side TEXT, quantity REAL, leverage INTEGER, entry_price REAL,
+    opened_at TEXT, status TEXT, created_at TEXT, updated_at TEXT, exit_price REAL, closed_at TEXT,
+    pnl REAL, pnl_pct REAL, error_message TEXT);
+CREATE INDEX user_trades_bot ON user_trades (bot_id, status);
+CREATE TABLE user_trade_orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, user_trade_id INTEGER, exchange_order_id TEXT, client_order_id TEXT,
+    type TEXT, price REAL, requested_qty REAL, filled_qty REAL, fee REAL, status TEXT, raw_response TEXT,
+    created_at TEXT, updated_at TEXT);
+CREATE INDEX user_trade_orders_trade ON user_trade_orders (user_trade_id);
+CREATE TABLE user_trade_order_responses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, user_trade_id INTEGER, type TEXT, exchange_order_id TEXT, codec TEXT,
+    body BLOB, created_at TEXT);
+"""
+
+
+class QueryCounter:
+    """每句 SQL 算一次（executemany 跟 pymysql 一樣合成一句 multi-row INSERT，也算一次）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.by_kind = {}
+
+    def add(self, sql):
+        kind = sql.lstrip().split(None, 1)[0].upper()
+        with self._lock:
+            self.total += 1
+            self.by_kind[kind] = self.by_kind.get(kind, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.total = 0
+            self.by_kind = {}
+
+    def snapshot(self):
+        with self._lock:
+            return {"total": self.total, **self.by_kind}
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self._conn = conn
+        self._cursor = conn.raw.cursor()
+        self.lastrowid = None
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def execute(self, sql, params=None):
+        if params is not None and not isinstance(params, (tuple, list)):
+            params = (params,)  # pymysql 也接受單一值
+        self._conn.counter.add(sql)
+        self._cursor.execute(sql.replace("%s", "?"), params or ())
+        self.lastrowid = self._cursor.lastrowid
+        self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def executemany(self, sql, seq_params):
+        self._conn.counter.add(sql)
+        self._cursor.executemany(sql.replace("%s", "?"), seq_params)
+        self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return self._as_dict(row) if row is not None else None
+
+    def fetchall(self):
+        return [self._as_dict(row) for row in self._cursor.fetchall()]
+
+    def _as_dict(self, row):
+        return dict(zip((d[0] for d in self._cursor.description), row))
+
+
+class FakeConnection:
+    """長得像 pymysql DictCursor 連線的 sqlite 連線，ConnectionPool 可以直接用"""
+
+    def __init__(self, path, counter):
+        self.raw = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.raw.execute("PRAGMA journal_mode=WAL")
+        self.raw.execute("PRAGMA synchronous=NORMAL")
+        self.counter = counter
+        self.open = True
+
+    @property
+    def server_status(self):
+        return SERVER_STATUS.SERVER_STATUS_IN_TRANS if self.raw.in_transaction else 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def begin(self):
+        self.raw.execute("BEGIN IMMEDIATE")
+
+    def commit(self):
+        self.raw.execute("COMMIT")
+
+    def rollback(self):
+        if self.raw.in_transaction:
+            self.raw.execute("ROLLBACK")
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.open = False
+        self.raw.close()
+
+
+def create_database(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.close()
+
+
+def connect_factory(path, counter):
+    """給 ConnectionPool(connect=...) 用"""
+    return lambda: FakeConnection(path, counter)
@@ -0,0 +1,300 @@
+from app.utils.lazy import LazyModule
+import asyncio
+import itertools
+import random
+import threading
+import time
+
+ccxt_errors = LazyModule("ccxt.base.errors")
+
+FAKE_EXCHANGE_CODE = "fakeex"
+
+# 只有一個永續合約，精度 / 限制跟一般交易所的 BTC 合約差不多
+FAKE_MARKETS = {
+    "BTC/USDT:USDT": {
+        "id": "BTCUSDT",
+        "symbol": "BTC/USDT:USDT",
+        "base": "BTC",
+        "quote": "USDT",
+        "settle": "USDT",
+        "type": "swap",
+        "swap": True,
+        "linear": True,
+        "contractSize": 1,
+        "precision": {"amount": 0.001, "price": 0.1},
+        "limits": {"amount": {"min": 0.001}, "cost": {"min": 5}},
+    },
+}
+
+
+class FakeExchangeServer:
+    """
+    假交易所的「伺服器端」，同一個 process 的所有假 client 共用
+    - 每個請求的延遲：latency_ms ± jitter_ms，tail_rate 的機率再多 tail_ms（固定 seed，每次跑分佈一樣）
+    - error_rate 的機率回 ExchangeError（下單被拒）
+    - rate_limit：每秒最多幾個請求（整個 IP 合計，0 = 不限），超過回 RateLimitExceeded，跟真的交易所一樣
+    - 下單請求要等延遲過完才「到」交易所（送出後馬上查單會查不到），跟還在路上的真請求一樣
+    - 同一個 clientOrderId 只在前一張還掛著（open）時才會被擋；市價單馬上成交，再送一次就是第二張單
+      （跟 Binance U 本位一樣），可以用 clientOrderId 查單（查到最新那張）
+    """
+
+    def __init__(self, latency_ms=50, jitter_ms=20, error_rate=0.0, rate_limit=0, seed=0, tail_rate=0.0, tail_ms=1000):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tail_rate = tail_rate
+        self.tail_ms = tail_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = float(rate_limit)
+        self._refilled_at = time.monotonic()
+        self._order_ids = itertools.count(1)
+        self.orders = {}
+        self.client_orders = {}  # clientOrderId -> order id
+        self.requests = 0
+        self.rejected = 0
+        self.rate_limited = 0
+
+    def handle(self, path, params):
+        """
+        回傳 (延遲秒數, 回應 or 例外)，延遲由呼叫端 sleep（sync / async 各自處理）
+        下單的回應是一個函式：延遲過完才呼叫，單才真的下到交易所
+        """
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            if self.tail_rate and self._random.random() < self.tail_rate:
+                delay += self.tail_ms / 1000
+            if not self._take_token():
+                self.rate_limited += 1
+                return delay, ccxt_errors.RateLimitExceeded(f"{FAKE_EXCHANGE_CODE} 429 Too Many Requests")
+            if path == "place-order":
+                return delay, lambda: self._arrive(self._place, params)
+            if path == "batch-orders":
+                return delay, lambda: self._arrive(self._place_batch, params)
+            if path == "order":
+                order_id = params["id"] or self.client_orders.get(params.get("clientOrderId"))
+                order = self.orders.get(order_id)
+                if order is None:
+                    return delay, ccxt_errors.OrderNotFound(
+                        f"{FAKE_EXCHANGE_CODE} order {params['id'] or params.get('clientOrderId')} not found")
+                return delay, dict(order)
+            if path == "orders":
+                return delay, [dict(o) for o in self.orders.values() if o["symbol"] == params["symbol"]]
+            if path == "markets":
+                return delay, {symbol: dict(market) for symbol, market in FAKE_MARKETS.items()}
+            return delay, {}
+
+    def _arrive(self, handler, params):
+        with self._lock:
+            return handler(params)
+
+    def _place_batch(self, params):
+        # 跟交易所的 batch endpoint 一樣：一個請求，每張單各自成功 / 被拒
+        results = []
+        for item in params["orders"]:
+            result = self._place(item)
+            if isinstance(result, Exception):
+                result = {"id": None, "status": "rejected", "info": {"msg": str(result)}}
+            results.append(result)
+        return results
+
+    def _place(self, params):
+        if self._random.random() < self.error_rate:
+            self.rejected += 1
+            return ccxt_errors.ExchangeError(f"{FAKE_EXCHANGE_CODE} order rejected")
+
+        client_order_id = params.get("clientOrderId")
+        previous = self.orders.get(self.client_orders.get(client_order_id))
+        if previous is not None and previous["status"] == "open":
+            return ccxt_errors.DuplicateOrderId(f"{FAKE_EXCHANGE_CODE} duplicate clientOrderId {client_order_id}")
+        order_id = str(next(self._order_ids))
+        if client_order_id:
+            self.client_orders[client_order_id] = order_id
+        self.orders[order_id] = {
+            "id": order_id,
+            "clientOrderId": client_order_id,
+            "symbol": params["symbol"],
+            "type": params["type"],
+            "side": params["side"],
+            "amount": params["amount"],
+            "filled": params["amount"],
+            "average": params.get("price") or 100.0,
+            "price": params.get("price") or 100.0,
+            "status": "closed",
+            "fee": {"cost": 0.01},
+            "timestamp": int(time.time() * 1000),
+        }
+        return dict(self.orders[order_id])
+
+    def _take_token(self):
+        if not self.rate_limit:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled_at) * self.rate_limit)
+        self._refilled_at = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "rejected": self.rejected,
+                "rate_limited": self.rate_limited,
+            }
+
+
+server = FakeExchangeServer()
+
+
+def configure(**options):
+    """換一個新的假交易所（每個 benchmark 情境開始前呼叫）"""
+    global server
+    server = FakeExchangeServer(**options)
+    # ccxt 慣例：rateLimit = 兩個請求之間至少隔幾 ms，共用限流照這個換算每秒額度（不限流就給很小的值）
+    rate_limit = options.get("rate_limit")
+    FakeExchange.rateLimit = FakeAsyncExchange.rateLimit = 1000 / rate_limit if rate_limit else 0.01
+    return server
+
+
+class FakeExchange:
+    """
+    同步版假交易所，介面跟 ccxt 一樣（tick 用到的那幾個方法）
+    每個方法都走 fetch2，所以共用限流（rate_limiter.install）會照常接上
+    """
+
+    id = FAKE_EXCHANGE_CODE
+    rateLimit = 0.01
+    has = {"fetchOrders": True, "watchOrders": False, "createOrders": True}
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.apiKey = config.get("apiKey")
+        self.enableRateLimit = config.get("enableRateLimit", True)
+        self.sandbox = False
+        self.lastRestRequestTimestamp = 0
+        self.markets = None
+        self.markets_by_id = None
+
+    def set_sandbox_mode(self, enabled):
+        self.sandbox = enabled
+
+    def set_markets(self, markets, currencies=None):
+        self.markets = markets
+        self.markets_by_id = {m["id"]: [m] for m in markets.values()}
+        return self.markets
+
+    def load_markets(self, reload=False, params={}):
+        if self.markets and not reload:
+            return self.markets
+        return self.set_markets(self.fetch2("markets"))
+
+    def market(self, symbol):
+        if symbol in self.markets:
+            return self.markets[symbol]
+        if symbol in self.markets_by_id:
+            return self.markets_by_id[symbol][0]
+        raise ccxt_errors.BadSymbol(f"{FAKE_EXCHANGE_CODE} does not have market symbol {symbol}")
+
+    def amount_to_precision(self, symbol, amount):
+        step = self.market(symbol)["precision"]["amount"]
+        result = int(amount / step + 1e-9) * step
+        if result <= 0:
+            raise ccxt_errors.InvalidOrder(f"{FAKE_EXCHANGE_CODE} amount of {symbol} must be greater than {step}")
+        return f"{result:.10f}".rstrip("0").rstrip(".")
+
+    def calculate_rate_limiter_cost(self, api, method, path, params, config={}):
+        return config.get("cost", 1)
+
+    def throttle(self, cost=None):
+        elapsed = time.monotonic() * 1000 - self.lastRestRequestTimestamp
+        wait = self.rateLimit * (cost or 1) - elapsed
+        if wait > 0:
+            time.sleep(wait / 1000)
+
+    def fetch2(self, path, api="public", method="GET", params={}, headers=None, body=None, config={}):
+        if self.enableRateLimit:
+            self.throttle(self.calculate_rate_limiter_cost(api, method, path, params, config))
+        self.lastRestRequestTimestamp = time.monotonic() * 1000
+        delay, response = server.handle(path, params)
+        time.sleep(delay)
+        if callable(response):
+            response = response()
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def set_leverage(self, leverage, symbol=None, params={}):
+        return self.fetch2("set-leverage", "private", "POST", {"leverage": leverage, "symbol": symbol, **params})
+
+    def create_order(self, symbol, type, side, amount, price=None, params={}):
+        return self.fetch2("place-order", "private", "POST", {
+            "symbol": symbol, "type": type, "side": side, "amount": amount, "price": price, **params})
+
+    def create_orders(self, orders, params={}):
+        return self.fetch2("batch-orders", "private", "POST", {"orders": [_flatten_order(o) for o in orders]})
+
+    def fetch_order(self, id, symbol=None, params={}):
+        return self.fetch2("order", "private", "GET", {"id": id, "symbol": symbol, **params})
+
+    def fetch_orders(self, symbol=None, since=None, limit=None, params={}):
+        return self.fetch2("orders", "private", "GET", {"symbol": symbol, "since": since})
+
+
+class FakeAsyncExchange(FakeExchange):
+    """ccxt.async_support 版（async fan-out 用）"""
+
+    async def throttle(self, cost=None):
+        elapsed = time.monotonic() * 1000 - self.lastRestRequestTimestamp
+        wait = self.rateLimit * (cost or 1) - elapsed
+        if wait > 0:
+            await asyncio.sleep(wait / 1000)
+
+    async def fetch2(self, path, api="public", method="GET", params={}, headers=None, body=None, config={}):
+        if self.enableRateLimit:
+            await self.throttle(self.calculate_rate_limiter_cost(api, method, path, params, config))
+        self.lastRestRequestTimestamp = time.monotonic() * 1000
+        delay, response = server.handle(path, params)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            # 請求已經送出去了，取消只是不等回應，單照樣會到交易所
+            if callable(response):
+                response()
+            raise
+        if callable(response):
+            response = response()
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    async def set_leverage(self, leverage, symbol=None, params={}):
+        return await self.fetch2("set-leverage", "private", "POST", {"leverage": leverage, "symbol": symbol, **params})
+
+    async def create_order(self, symbol, type, side, amount, price=None, params={}):
+        return await self.fetch2("place-order", "private", "POST", {
+            "symbol": symbol, "type": type, "side": side, "amount": amount, "price": price, **params})
+
+    async def create_orders(self, orders, params={}):
+        return await self.fetch2("batch-orders", "private", "POST", {"orders": [_flatten_order(o) for o in orders]})
+
+    async def fetch_order(self, id, symbol=None, params={}):
+        return await self.fetch2("order", "private", "GET", {"id": id, "symbol": symbol, **params})
+
+    async def fetch_orders(self, symbol=None, since=None, limit=None, params={}):
+        return await self.fetch2("orders", "private", "GET", {"symbol": symbol, "since": since})
+
+    async def close(self):
+        pass
+
+
+def _flatten_order(order):
+    # ccxt create_orders 的每一張：symbol / type / side / amount / price / params
+    return {
+        "symbol": order["symbol"], "type": order["type"], "side": order["side"],
+        "amount": order["amount"], "price": order.get("price"), **(order.get("params") or {}),
+    }
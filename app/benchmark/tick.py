@@ -0,0 +1,376 @@
+from app.benchmark import fake_db, fake_exchange
+from app.benchmark.fake_exchange import FAKE_EXCHANGE_CODE, FakeAsyncExchange, FakeExchange
+from app.services import order_submitter
+from app.exchange.exchange_factory import register_exchange_class
+from app.utils.db import ConnectionPool, DB_POOL_MAX_SIZE, get_db, install_pool, query_one
+from app.utils.redis_client import redis_conn
+from rq import Queue, SimpleWorker, Worker
+import app.worker_jobs as worker_jobs
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# 跑完存成 baseline，之後的結果跟它比（改了 tick / trade_service / db.py 之後 git diff 就看得到差異）
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "tick.json")
+
+BENCHMARK_QUEUE = "strade-benchmark"
+
+DEFAULT_BOTS = [10, 100, 1000]
+DEFAULT_ACTIONS = ["OPEN", "CLOSE"]
+
+# 比 baseline 差多少 % 算退步：(欄位, 越大越好?)
+COMPARED_FIELDS = [
+    ("throughput", True),
+    ("p50_ms", False),
+    ("p95_ms", False),
+    ("p99_ms", False),
+    ("queries", False),
+    ("peak_rss_mb", False),
+]
+
+
+def run_scenario(scenario):
+    """
+    在目前的 process 跑一次真的 run_strategy_tick_job（假交易所 + sqlite），回傳量測結果
+    RSS 是整個 process 的峰值，所以每個情境都在自己的 subprocess 跑（見 run_isolated）
+    workers > 0 時 tick 會切成 shard 丟給另外開的 RQ worker process 跑，等 finalize 寫完才算結束
+    sqlite 檔 / WAL / worker 結果檔都放在暫存目錄，跑完就刪掉
+    """
+    with tempfile.TemporaryDirectory(prefix="strade-bench-") as workdir:
+        return _run_scenario(scenario, workdir)
+
+
+def _run_scenario(scenario, workdir):
+    bots = scenario["bots"]
+    action = scenario["action"]
+
+    scenario = {**scenario, "db_path": os.path.join(workdir, "bench.db")}
+    fake_db.create_database(scenario["db_path"])
+    counter = _install_fakes(scenario)
+    _clear_order_registry()
+
+    strategy_trade_id = _seed(bots, action, scenario["bots_per_account"])
+    signal = {
+        "action": action,
+        "position_side": "LONG",
+        "price": 100.0 if action == "OPEN" else 105.0,
+        "trade_id": strategy_trade_id,
+    }
+    workers = _start_workers(scenario, workdir)
+
+    counter.reset()
+    signal["emitted_at"] = time.time()
+    started = time.perf_counter()
+    result = worker_jobs.run_strategy_tick_job(1, signal)
+    if result["status"] == "sharded":
+        result = _wait_for_finalize(result["tick_id"], strategy_trade_id)
+    elapsed = time.perf_counter() - started
+    queries = counter.snapshot()
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    for worker in _stop_workers(workers):
+        queries = {k: queries.get(k, 0) + worker["queries"].get(k, 0) for k in {*queries, *worker["queries"]}}
+        peak_rss_mb = max(peak_rss_mb, worker["peak_rss_mb"])
+
+    with get_db() as db:
+        extra = json.loads(query_one(db, "SELECT extra FROM strategy_trades WHERE id=%s", (strategy_trade_id,))["extra"])
+    latency = extra["latency"]["stages"].get("signal_to_order") or {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    _cleanup_reconcile_jobs()
+
+    return {
+        # db_path 每次都不一樣，不放進結果（baseline 才不會每次存都有 diff）
+        **{key: value for key, value in scenario.items() if key != "db_path"},
+        "elapsed_s": round(elapsed, 3),
+        "throughput": round(bots / elapsed, 1),
+        "success": result.get("success_count", 0),
+        "fail": result.get("fail_count", 0),
+        "p50_ms": latency["p50"],
+        "p95_ms": latency["p95"],
+        "p99_ms": latency["p99"],
+        "stages": extra["latency"]["stages"],
+        "queries": queries["total"],
+        "queries_by_kind": queries,
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "exchange": fake_exchange.server.stats(),
+    }
+
+
+def _install_fakes(scenario):
+    """sqlite 連線池、假交易所、benchmark 專用的 queue 換上去，回傳這個 process 的 QueryCounter"""
+    counter = fake_db.QueryCounter()
+    install_pool(ConnectionPool(connect=fake_db.connect_factory(scenario["db_path"], counter), max_size=DB_POOL_MAX_SIZE))
+
+    fake_exchange.configure(
+        latency_ms=scenario["latency_ms"],
+        jitter_ms=scenario["jitter_ms"],
+        error_rate=scenario["error_rate"],
+        rate_limit=scenario["rate_limit"],
+        seed=scenario["seed"],
+        tail_rate=scenario["tail_rate"],
+        tail_ms=scenario["tail_ms"],
+    )
+    register_exchange_class(FAKE_EXCHANGE_CODE, FakeExchange, "sync")
+    register_exchange_class(FAKE_EXCHANGE_CODE, FakeAsyncExchange, "async")
+
+    # shard / finalize / 對帳都丟到 benchmark 專用的 queue，不要讓真的 worker 拿去跑
+    worker_jobs.queue = Queue(BENCHMARK_QUEUE, connection=redis_conn)
+    return counter
+
+
+def _start_workers(scenario, workdir):
+    """開 workers 個 RQ worker process（跟 tick 同一個 sqlite 檔），等它們都連上 Redis 才開始計時"""
+    if not scenario["workers"]:
+        return []
+
+    workers = []
+    for i in range(scenario["workers"]):
+        result_path = os.path.join(workdir, f"worker-{i}.json")
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "app.benchmark.tick", "--worker", json.dumps(scenario), "--result", result_path],
+            stdout=subprocess.DEVNULL,
+        )
+        workers.append((proc, result_path))
+
+    queue = worker_jobs.queue
+    while Worker.count(queue=queue) < len(workers):
+        if any(proc.poll() is not None for proc, _ in workers):
+            raise Exception("benchmark worker 啟動失敗")
+        time.sleep(0.05)
+    return workers
+
+
+def _wait_for_finalize(tick_id, strategy_trade_id):
+    """finalize_tick_job 寫完 summary 會刪掉 Redis 的 tick key，刪掉就代表整個 tick 跑完"""
+    while redis_conn.exists(worker_jobs._tick_key(tick_id)):
+        time.sleep(0.01)
+    with get_db() as db:
+        extra = json.loads(query_one(db, "SELECT extra FROM strategy_trades WHERE id=%s", (strategy_trade_id,))["extra"])
+    return {
+        "success_count": extra.get("bots_open_count", extra.get("bots_close_count", 0)),
+        "fail_count": extra.get("bots_open_failed_count", extra.get("bots_close_failed_count", 0)),
+    }
+
+
+def _stop_workers(workers):
+    """送 SIGTERM 讓 worker 跑完手上的 job 後結束，回傳各 worker 的查詢數 / 峰值 RSS"""
+    for proc, _ in workers:
+        proc.terminate()
+    stats = []
+    for proc, result_path in workers:
+        proc.wait()
+        with open(result_path, encoding="utf-8") as f:
+            stats.append(json.load(f))
+    return stats
+
+
+def run_worker(scenario, result_path):
+    """
+    benchmark 用的 RQ worker：跟 tick 用同一份假交易所設定 / sqlite 檔
+    用 SimpleWorker 在自己的 process 跑 job，查詢數跟 RSS 才算得到
+    """
+    counter = _install_fakes(scenario)
+    worker = SimpleWorker([worker_jobs.queue], connection=redis_conn)
+    try:
+        worker.work(logging_level="WARNING")
+    finally:
+        with open(result_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "queries": counter.snapshot(),
+                "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            }, f)
+
+
+def _seed(bots, action, bots_per_account):
+    """建策略 / 帳號 / bots；CLOSE 情境另外先放好每個 bot 的 OPEN 部位。回傳 strategy_trade_id"""
+    accounts = (bots + bots_per_account - 1) // bots_per_account
+    with get_db() as db:
+        cursor = db.cursor()
+        cursor.execute("INSERT INTO exchanges (id, code) VALUES (1, %s)", (FAKE_EXCHANGE_CODE,))
+        cursor.execute(
+            "INSERT INTO strategies (id, name, unified_symbol, is_active, timeframe) "
+            "VALUES (1, 'benchmark', 'BTC/USDT:USDT', 1, '1h')")
+        cursor.executemany(
+            "INSERT INTO exchange_accounts (id, exchange_id, params) VALUES (%s, 1, %s)",
+            [(i, json.dumps({"api_key": f"key-{i}", "secret_key": "secret"})) for i in range(1, accounts + 1)])
+        cursor.executemany(
+            "INSERT INTO bots (id, user_id, strategy_id, exchange_account_id, exchange_symbol, leverage, "
+            "base_order_usdt, status) VALUES (%s, %s, 1, %s, 'BTCUSDT', 2, 100, 'RUNNING')",
+            [(i, i, (i - 1) // bots_per_account + 1) for i in range(1, bots + 1)])
+        cursor.execute(
+            "INSERT INTO strategy_trades (strategy_id, position_side, entry_price, status, created_at) "
+            "VALUES (1, 'LONG', 100, 'OPEN', '2025-01-01 00:00:00')")
+        strategy_trade_id = cursor.lastrowid
+
+        if action != "OPEN":
+            cursor.executemany(
+                "INSERT INTO user_trades (user_id, strategy_trade_id, exchange_account_id, bot_id, exchange_symbol, "
+                "position_side, quantity, leverage, entry_price, status) "
+                "VALUES (%s, %s, %s, %s, 'BTCUSDT', 'LONG', 1, 2, 100, 'OPEN')",
+                [(i, strategy_trade_id, (i - 1) // bots_per_account + 1, i) for i in range(1, bots + 1)])
+    return strategy_trade_id
+
+
+def _clear_order_registry():
+    # 每個情境的 sqlite 都是新的，strategy_trade_id 會重複，上一輪佔著的 clientOrderId 要先清掉
+    keys = list(redis_conn.scan_iter(f"{order_submitter.KEY_PREFIX}:*"))
+    if keys:
+        redis_conn.delete(*keys)
+
+
+def _cleanup_reconcile_jobs():
+    registry = worker_jobs.queue.scheduled_job_registry
+    for job_id in registry.get_job_ids():
+        registry.remove(job_id, delete_job=True)
+
+
+def run_isolated(scenario, verbose=False):
+    """每個情境開一個新的 process 跑（峰值 RSS、快取、連線池互不影響）"""
+    with tempfile.TemporaryDirectory(prefix="strade-bench-") as tmp:
+        result_path = os.path.join(tmp, "result.json")
+        env = {
+            **os.environ,
+            "WORKER_EXECUTION_MODE": scenario["mode"],
+            "WORKER_MAX_THREADS": str(scenario["threads"]),
+            "RATE_LIMIT_BACKEND": scenario["rate_limiter"],
+            "TICK_SHARD_SIZE": str(scenario["shard_size"] if scenario["workers"] else 0),
+            "LOG_DIR": os.path.join(tmp, "logs"),
+        }
+        proc = subprocess.run(
+            [sys.executable, "-m", "app.benchmark.tick", "--child", json.dumps(scenario), "--result", result_path],
+            env=env,
+            capture_output=not verbose,
+            text=True,
+        )
+        if proc.returncode != 0 or not os.path.exists(result_path):
+            raise Exception(f"benchmark {scenario_key(scenario)} 失敗：\n{(proc.stdout or '')[-3000:]}{(proc.stderr or '')[-3000:]}")
+        with open(result_path, encoding="utf-8") as f:
+            return json.load(f)
+
+
+def scenario_key(scenario):
+    key = f"{scenario['action']}-{scenario['bots']}-{scenario['mode']}"
+    return f"{key}-w{scenario['workers']}" if scenario["workers"] else key
+
+
+def compare(results, baseline):
+    """印出跟 baseline 的差異，回傳 [(key, 欄位, 變化 %)]，正的 = 變差"""
+    diffs = []
+    for key, result in results.items():
+        base = baseline.get("results", {}).get(key)
+        if not base:
+            print(f"[Benchmark] {key}：baseline 沒有這個情境")
+            continue
+
+        parts = []
+        for field, higher_is_better in COMPARED_FIELDS:
+            old, new = base.get(field), result.get(field)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            worse = -change if higher_is_better else change
+            diffs.append((key, field, worse))
+            parts.append(f"{field} {old} → {new}（{change:+.1f}%）")
+        print(f"[Benchmark] {key} vs baseline：" + "，".join(parts))
+    return diffs
+
+
+def print_table(results):
+    header = f"{'scenario':<22}{'bots/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}{'RSS MB':>9}{'ok/fail':>12}"
+    print(header)
+    for key, r in results.items():
+        print(
+            f"{key:<22}{r['throughput']:>10.1f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+            f"{r['queries']:>9}{r['peak_rss_mb']:>9.1f}{str(r['success']) + '/' + str(r['fail']):>12}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="tick fan-out benchmark（假交易所 + sqlite，跑真的 run_strategy_tick_job）")
+    parser.add_argument("--bots", type=int, nargs="+", default=DEFAULT_BOTS, help="ex: --bots 10 100 1000 10000")
+    parser.add_argument("--actions", nargs="+", default=DEFAULT_ACTIONS, choices=DEFAULT_ACTIONS)
+    parser.add_argument("--mode", default="threads", choices=["threads", "async"])
+    parser.add_argument("--threads", type=int, default=int(os.getenv("WORKER_MAX_THREADS", 10)))
+    parser.add_argument("--rate-limiter", default="redis", choices=["redis", "local"], help="共用限流（要 Redis）或 client 內節流")
+    parser.add_argument("--workers", type=int, default=0, help="開幾個 RQ worker 分 shard 跑（0 = tick 自己跑全部）")
+    parser.add_argument("--shard-size", type=int, default=100, help="--workers 時每包幾個 bot")
+    parser.add_argument("--bots-per-account", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="多少比例的請求會慢 --tail-ms（模擬長尾）")
+    parser.add_argument("--tail-ms", type=float, default=1000)
+    parser.add_argument("--rate-limit", type=float, default=0, help="假交易所每秒最多幾個請求，0 = 不限")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="把這次結果寫進 baseline")
+    parser.add_argument("--max-regression", type=float, default=0, help="任一欄位比 baseline 差超過幾 % 就 exit 1（0 = 只印不擋）")
+    parser.add_argument("--verbose", action="store_true", help="顯示每個情境的 log")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_scenario(json.loads(args.child))
+        with open(args.result, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        return
+    if args.worker:
+        run_worker(json.loads(args.worker), args.result)
+        return
+
+    config = {
+        "mode": args.mode,
+        "threads": args.threads,
+        "rate_limiter": args.rate_limiter,
+        "workers": args.workers,
+        "shard_size": args.shard_size,
+        "bots_per_account": args.bots_per_account,
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "error_rate": args.error_rate,
+        "tail_rate": args.tail_rate,
+        "tail_ms": args.tail_ms,
+        "rate_limit": args.rate_limit,
+        "seed": args.seed,
+    }
+
+    results = {}
+    for action in args.actions:
+        for bots in args.bots:
+            scenario = {**config, "action": action, "bots": bots}
+            print(f"[Benchmark] 跑 {scenario_key(scenario)} ...")
+            results[scenario_key(scenario)] = run_isolated(scenario, args.verbose)
+
+    print_table(results)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != config:
+            print(f"[Benchmark] baseline 的設定跟這次不同，比較僅供參考：{baseline.get('config')}")
+    diffs = compare(results, baseline) if baseline else []
+
+    if args.save_baseline:
+        saved = baseline if baseline.get("config") == config else {"config": config, "results": {}}
+        saved["results"].update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(saved, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"[Benchmark] baseline 寫到 {args.baseline}")
+
+    regressions = [d for d in diffs if args.max_regression and d[2] > args.max_regression]
+    if regressions:
+        for key, field, worse in regressions:
+            print(f"[Benchmark] 退步：{key} {field} 差了 {worse:.1f}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
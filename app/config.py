@@ -0,0 +1,19 @@
+from dotenv import load_dotenv
+import threading
+
+_loaded = False
+_lock = threading.Lock()
+
+
+def load_config():
+    """
+    讀 .env（整個 process 只讀一次）
+    每個模組開頭呼叫一次，已經讀過就直接返回，不會每個模組都重新找、重新解析 .env
+    """
+    global _loaded
+    if _loaded:
+        return
+    with _lock:
+        if not _loaded:
+            load_dotenv()
+            _loaded = True
@@ -1,15 +1,58 @@
-import ccxt
+from app.exchange.market_cache import market_cache
+from app.exchange.rate_limiter import install_rate_limiter
+from app.utils.lazy import LazyModule
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from app.config import load_config
 
-def build_ccxt_client(exchange_code, api_key, secret_key, passphrase=None):
+load_config()
+
+# client 快取設定：最多保留幾個 client、每個 client 最多活多久（秒）
+CLIENT_CACHE_MAX_SIZE = int(os.getenv("CCXT_CLIENT_CACHE_SIZE", 256))
+CLIENT_CACHE_TTL = int(os.getenv("CCXT_CLIENT_CACHE_TTL", 1800))
+
+# ccxt 三種版本都很重（光 import 就要幾百 ms），用到才載入；async / pro 只有對應模式會用到
+EXCHANGE_MODULES = {
+    "sync": LazyModule("ccxt"),
+    "async": LazyModule("ccxt.async_support"),
+    "pro": LazyModule("ccxt.pro"),
+}
+
+_exchange_classes = {}  # (kind, exchange_code) -> class
+
+
+def get_exchange_class(exchange_code, kind="sync"):
+    """
+    exchange_code = exchanges.code，kind = sync / async / pro
+    第一次用到才載入 ccxt 對應的版本，之後直接從表裡拿
+    """
+    key = (kind, exchange_code)
+    exchange_class = _exchange_classes.get(key)
+    if exchange_class is None:
+        module = EXCHANGE_MODULES[kind]
+        if not hasattr(module, exchange_code):
+            raise Exception(f"不支援的交易所: {exchange_code}")
+        exchange_class = _exchange_classes[key] = getattr(module, exchange_code)
+    return exchange_class
+
+
+def register_exchange_class(exchange_code, exchange_class, kind="sync"):
+    """加一個 ccxt 沒有的交易所（benchmark 的假交易所），之後 build_* / get_ccxt_client 都照常用"""
+    _exchange_classes[(kind, exchange_code)] = exchange_class
+
+
+def build_ccxt_client(exchange_code, api_key, secret_key, passphrase=None, exchange_account_id=None):
     """
     exchange_code = exchanges.code
     ex: binance, bitget, okx, bybit
+    有 exchange_account_id 的話 private API 也會算進這個帳號的限流
     """
 
-    if not hasattr(ccxt, exchange_code):
-        raise Exception(f"不支援的交易所: {exchange_code}")
-
-    exchange_class = getattr(ccxt, exchange_code)
+    exchange_class = get_exchange_class(exchange_code)
 
     params = {
         "apiKey": api_key,
@@ -20,4 +63,227 @@ def build_ccxt_client(exchange_code, api_key, secret_key, passphrase=None):
     if passphrase:
         params["password"] = passphrase  # bitget / okx 用
 
-    return exchange_class(params)
+    return install_rate_limiter(exchange_class(params), exchange_code, exchange_account_id)
+
+
+def build_async_ccxt_client(exchange_code, params, sandbox=None, exchange_account_id=None):
+    """
+    ccxt.async_support 版的 client（async fan-out 用）
+    async client 綁在建立它的 event loop 上，用完要 await client.close()
+    params = json.loads(exchange_accounts.params)
+    """
+    return _build_from_kind("async", exchange_code, params, sandbox, exchange_account_id)
+
+
+def build_pro_ccxt_client(exchange_code, params, sandbox=None, exchange_account_id=None):
+    """ccxt.pro 版的 client（websocket watch_orders 用），一樣要 await client.close()"""
+    return _build_from_kind("pro", exchange_code, params, sandbox, exchange_account_id)
+
+
+def _build_from_kind(kind, exchange_code, params, sandbox, exchange_account_id=None):
+    exchange_class = get_exchange_class(exchange_code, kind)
+
+    config = {
+        "apiKey": params.get("api_key"),
+        "secret": params.get("secret_key"),
+        "enableRateLimit": True,
+    }
+
+    if params.get("passphrase"):
+        config["password"] = params["passphrase"]  # bitget / okx 用
+
+    client = exchange_class(config)
+    sandbox = sandbox_enabled() if sandbox is None else bool(sandbox)
+    client.set_sandbox_mode(sandbox)
+    _inject_markets(client, exchange_code, sandbox)
+    return install_rate_limiter(client, exchange_code, exchange_account_id)
+
+
+def sandbox_enabled():
+    """SANDBOX_MODE 環境變數，預設開啟"""
+    return bool(int(os.getenv("SANDBOX_MODE", 1)))
+
+
+def _market_client(exchange_code, sandbox):
+    """抓 markets / 查精度用的同步 client（不帶金鑰，一樣走共用限流）"""
+    client = get_exchange_class(exchange_code)({"enableRateLimit": True})
+    client.set_sandbox_mode(bool(sandbox))
+    return install_rate_limiter(client, exchange_code)
+
+
+def _inject_markets(client, exchange_code, sandbox):
+    # 新 client 直接掛上共用的 markets，不用自己再 load_markets（幾 MB 的回應）
+    if market_cache is not None:
+        market_cache.inject(client, exchange_code, bool(sandbox), _market_client)
+    return client
+
+
+def warm_markets(exchange_code, sandbox=None):
+    """先把 markets 載進這個 process（async fan-out 開始前在 thread 裡呼叫，不要卡住 event loop）"""
+    if market_cache is not None:
+        market_cache.warm(exchange_code, sandbox_enabled() if sandbox is None else bool(sandbox), _market_client)
+
+
+def get_market(exchange_code, symbol, sandbox=None):
+    """
+    交易所的 market 資訊（precision / limits / contractSize），快取有就不會打網路
+    symbol 可以是 BTC/USDT:USDT 或 BTCUSDT；找不到 / 快取關掉回 None
+    """
+    if market_cache is None:
+        return None
+    sandbox = sandbox_enabled() if sandbox is None else bool(sandbox)
+    try:
+        return market_cache.market(exchange_code, symbol, sandbox, _market_client)
+    except Exception as e:
+        print(f"[MarketCache] 查不到 {exchange_code} {symbol} 的 market：{e}")
+        return None
+
+
+def amount_to_precision(exchange_code, symbol, amount, sandbox=None):
+    """
+    依交易所精度無條件捨去下單數量（不打網路）
+    捨完變 0 回 None；快取關掉 / 查不到 market 就原樣回傳
+    """
+    if market_cache is None:
+        return amount
+    sandbox = sandbox_enabled() if sandbox is None else bool(sandbox)
+    try:
+        return market_cache.amount_to_precision(exchange_code, symbol, amount, sandbox, _market_client)
+    except EXCHANGE_MODULES["sync"].InvalidOrder:
+        return None
+    except Exception as e:
+        print(f"[MarketCache] {exchange_code} {symbol} 算不出精度，用原本的數量：{e}")
+        return amount
+
+
+def _credential_fingerprint(exchange_code, params):
+    """把交易所 + API 金鑰算成 hash，金鑰一改 fingerprint 就會不同"""
+    raw = json.dumps(
+        {
+            "exchange_code": exchange_code,
+            "api_key": params.get("api_key"),
+            "secret_key": params.get("secret_key"),
+            "passphrase": params.get("passphrase"),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CcxtClientCache:
+    """
+    以 (exchange_account_id, sandbox) 為 key 的 ccxt client 快取
+    - 同一個帳號的開倉 / 查單 / 平倉共用同一個 client（HTTP session、markets、rate limit 狀態都保留）
+    - LRU + TTL 淘汰
+    - exchange_accounts.params 的金鑰變了就丟掉舊 client 重建
+    """
+
+    def __init__(self, max_size=CLIENT_CACHE_MAX_SIZE, ttl=CLIENT_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (client, fingerprint, created_at)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, exchange_account_id, exchange_code, params, sandbox):
+        key = (exchange_account_id, bool(sandbox))
+        fingerprint = _credential_fingerprint(exchange_code, params)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                client, cached_fingerprint, created_at = entry
+                if cached_fingerprint != fingerprint:
+                    # 金鑰被改過，舊的 client 不能再用
+                    del self._entries[key]
+                    self.invalidations += 1
+                elif time.monotonic() - created_at > self.ttl:
+                    del self._entries[key]
+                    self.evictions += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return client
+            self.misses += 1
+
+        # 建 client 不用握著 lock，避免一個慢的交易所卡住其他帳號
+        client = build_ccxt_client(
+            exchange_code=exchange_code,
+            api_key=params.get("api_key"),
+            secret_key=params.get("secret_key"),
+            passphrase=params.get("passphrase"),
+            exchange_account_id=exchange_account_id,
+        )
+        client.set_sandbox_mode(bool(sandbox))
+        _inject_markets(client, exchange_code, sandbox)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] == fingerprint:
+                # 別的 thread 先建好了，用它的就好
+                self._entries.move_to_end(key)
+                return entry[0]
+
+            self._entries[key] = (client, fingerprint, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return client
+
+    def invalidate(self, exchange_account_id=None):
+        """清掉某個帳號的 client；不帶參數就全部清掉"""
+        with self._lock:
+            if exchange_account_id is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == exchange_account_id]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+client_cache = CcxtClientCache()
+
+
+def get_ccxt_client(exchange_account_id, exchange_code, params, sandbox=None):
+    """
+    從快取拿 ccxt client（已經設好 sandbox mode）
+    params = json.loads(exchange_accounts.params)
+    """
+    if sandbox is None:
+        sandbox = sandbox_enabled()
+    return client_cache.get(exchange_account_id, exchange_code, params, sandbox)
+
+
+_public_clients = {}
+_public_clients_lock = threading.Lock()
+
+
+def get_public_ccxt_client(exchange_code):
+    """
+    不帶金鑰的 client（抓 K 線等公開資料用），每個交易所共用一個
+    ex: binanceusdm
+    """
+    with _public_clients_lock:
+        client = _public_clients.get(exchange_code)
+        if client is None:
+            client = get_exchange_class(exchange_code)({"enableRateLimit": True})
+            _inject_markets(client, exchange_code, False)
+            install_rate_limiter(client, exchange_code)
+            _public_clients[exchange_code] = client
+        return client
@@ -0,0 +1,174 @@
+from app.exchange.exchange_factory import build_pro_ccxt_client
+from abc import ABC, abstractmethod
+import asyncio
+import threading
+
+
+class FillEventSource(ABC):
+    """
+    訂單 / 成交推播來源的介面
+    - start(on_order)：開始接收，每收到一筆訂單更新就呼叫 on_order(exchange_account_id, order)
+      order 是 ccxt unified order 格式（跟 fetch_order 回來的一樣）
+    - watch_account(context)：開始監聽某個交易所帳號（同一個帳號只會有一條串流）
+    - unwatch_account(exchange_account_id)：停止監聽
+    - stop()：全部停掉
+    """
+
+    @abstractmethod
+    def start(self, on_order):
+        ...
+
+    @abstractmethod
+    def watch_account(self, context):
+        ...
+
+    @abstractmethod
+    def unwatch_account(self, exchange_account_id):
+        ...
+
+    @abstractmethod
+    def watched_accounts(self):
+        ...
+
+    @abstractmethod
+    def stop(self):
+        ...
+
+
+class CcxtProFillEventSource(FillEventSource):
+    """
+    用 ccxt.pro 的 watch_orders 接私有訂單串流
+    - 背景 thread 跑一個 event loop，一個帳號一條 websocket（所有 symbol 共用）
+    - 斷線自動重連，重連間隔指數退避
+    """
+
+    def __init__(self, reconnect_delay=1, max_reconnect_delay=60):
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self._on_order = None
+        self._loop = None
+        self._thread = None
+        self._tasks = {}  # exchange_account_id -> asyncio.Task
+        self._lock = threading.Lock()
+
+    def start(self, on_order):
+        self._on_order = on_order
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="fill-event-loop", daemon=True)
+        self._thread.start()
+
+    def watch_account(self, context):
+        account_id = context["exchange_account_id"]
+        with self._lock:
+            if account_id in self._tasks:
+                return
+            future = asyncio.run_coroutine_threadsafe(self._spawn(context), self._loop)
+            self._tasks[account_id] = future.result()
+
+    def unwatch_account(self, exchange_account_id):
+        with self._lock:
+            task = self._tasks.pop(exchange_account_id, None)
+        if task:
+            self._loop.call_soon_threadsafe(task.cancel)
+
+    def watched_accounts(self):
+        with self._lock:
+            return set(self._tasks)
+
+    def stop(self):
+        for account_id in list(self.watched_accounts()):
+            self.unwatch_account(account_id)
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+    async def _spawn(self, context):
+        return asyncio.get_running_loop().create_task(self._watch(context))
+
+    async def _watch(self, context):
+        account_id = context["exchange_account_id"]
+        delay = self.reconnect_delay
+
+        while True:
+            client = None
+            try:
+                # 建 client 也放在 try 裡：丟例外就照樣重連，不會讓這個帳號的 task 默默死掉
+                client = build_pro_ccxt_client(
+                    context["exchange_code"], context["params"], exchange_account_id=account_id)
+                if not client.has.get("watchOrders"):
+                    print(f"[FillEvent] {context['exchange_code']} 不支援 watch_orders，帳號 {account_id} 改靠對帳")
+                    return
+
+                print(f"[FillEvent] 開始監聽帳號 {account_id} ({context['exchange_code']})")
+                while True:
+                    orders = await client.watch_orders()
+                    delay = self.reconnect_delay  # 有收到資料就重置重連間隔
+                    for order in orders:
+                        try:
+                            self._on_order(account_id, order)
+                        except Exception as e:
+                            print(f"[FillEvent] 處理帳號 {account_id} 訂單 {order.get('id')} 失敗：{e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[FillEvent] 帳號 {account_id} 串流中斷，{delay} 秒後重連：{e}")
+            finally:
+                if client is not None:
+                    try:
+                        await client.close()
+                    except Exception:
+                        pass
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+
+class LocalFillEventSource(FillEventSource):
+    """
+    本機 in-process 的替身（測試 / 開發用）
+    不連交易所，呼叫 emit() 就當作交易所推了一筆訂單更新
+    """
+
+    def __init__(self):
+        self._on_order = None
+        self._accounts = set()
+        self._lock = threading.Lock()
+
+    def start(self, on_order):
+        self._on_order = on_order
+
+    def watch_account(self, context):
+        with self._lock:
+            self._accounts.add(context["exchange_account_id"])
+
+    def unwatch_account(self, exchange_account_id):
+        with self._lock:
+            self._accounts.discard(exchange_account_id)
+
+    def watched_accounts(self):
+        with self._lock:
+            return set(self._accounts)
+
+    def stop(self):
+        with self._lock:
+            self._accounts.clear()
+
+    def emit(self, exchange_account_id, order):
+        """模擬交易所推送一筆訂單更新；沒在監聽的帳號會被忽略"""
+        if exchange_account_id not in self.watched_accounts():
+            return False
+        self._on_order(exchange_account_id, order)
+        return True
+
+
+FILL_EVENT_SOURCES = {
+    "ccxtpro": CcxtProFillEventSource,
+    "local": LocalFillEventSource,
+}
+
+
+def build_fill_event_source(name):
+    if name not in FILL_EVENT_SOURCES:
+        raise Exception(f"不支援的成交推播來源: {name}")
+    return FILL_EVENT_SOURCES[name]()
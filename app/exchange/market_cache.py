@@ -0,0 +1,233 @@
+from app.utils.redis_client import redis_conn
+import json
+import os
+import threading
+import time
+import zlib
+from app.config import load_config
+
+load_config()
+
+# redis（所有 process 共用）/ disk（同一台機器共用）/ off（每個 client 自己 load_markets）
+MARKET_CACHE_BACKEND = os.getenv("MARKET_CACHE_BACKEND", "redis").lower()
+
+# markets 多久重抓一次（秒），新幣上架 / 精度調整最多延遲這麼久
+MARKET_CACHE_TTL = int(os.getenv("MARKET_CACHE_TTL", 3600))
+
+MARKET_CACHE_DIR = os.getenv("MARKET_CACHE_DIR", "./cache/markets")
+
+# 抓 markets 失敗後幾秒內不再重試（交易所掛掉時不要每建一個 client 就打一次）
+MARKET_CACHE_RETRY_SECONDS = float(os.getenv("MARKET_CACHE_RETRY_SECONDS", 60))
+
+KEY_PREFIX = "strade:markets"
+
+# ccxt set_markets 算出來的欄位，第一個 client 算好之後其他 client 直接共用同一份
+MARKET_ATTRIBUTES = (
+    "markets", "markets_by_id", "symbols", "ids",
+    "currencies", "currencies_by_id", "codes", "baseCurrencies", "quoteCurrencies",
+)
+
+
+def _key(exchange_code, sandbox):
+    return f"{exchange_code}:{'sandbox' if sandbox else 'live'}"
+
+
+def _pack(markets, currencies):
+    return zlib.compress(json.dumps({"markets": markets, "currencies": currencies}, default=str).encode("utf-8"), 6)
+
+
+def _unpack(blob):
+    data = json.loads(zlib.decompress(blob))
+    return data["markets"], data["currencies"]
+
+
+class RedisMarketBackend:
+    def __init__(self, conn=redis_conn, prefix=KEY_PREFIX):
+        self.conn = conn
+        self.prefix = prefix
+
+    def load(self, key):
+        return self.conn.get(f"{self.prefix}:{key}")
+
+    def save(self, key, blob, ttl):
+        self.conn.set(f"{self.prefix}:{key}", blob, ex=ttl)
+
+    def delete(self, key):
+        self.conn.delete(f"{self.prefix}:{key}")
+
+
+class DiskMarketBackend:
+    """一個檔案一份 markets，用 mtime 判斷過期"""
+
+    def __init__(self, directory=MARKET_CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, key.replace(":", "-") + ".json.z")
+
+    def load(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > MARKET_CACHE_TTL:
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def save(self, key, blob, ttl):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)  # 其他 process 不會讀到寫一半的檔案
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class MarketCache:
+    """
+    每個 (交易所, sandbox) 的 markets 只抓一次：
+    - process 裡：第一個 client set_markets 算好的欄位，之後新建的 client 直接掛上去（不用再 load_markets）
+    - process 之間：壓縮後存在 Redis / 硬碟，TTL 內其他 worker 直接拿
+    - 都沒有才去交易所 load_markets 一次
+    new_client(exchange_code, sandbox) 由 exchange_factory 提供：回傳還沒載入 markets 的同步 client
+    """
+
+    def __init__(self, backend, ttl=MARKET_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._entries = {}  # key -> (loaded_at, attributes, template client)
+        self._failed_at = {}  # key -> 上次抓失敗的時間
+        self.hits = 0
+        self.shared_hits = 0
+        self.fetches = 0
+
+    def inject(self, client, exchange_code, sandbox, new_client):
+        """把快取的 markets 掛到 client 上（sync / async / pro 都可以）；失敗就什麼都不做，client 之後照舊自己 load_markets"""
+        try:
+            attributes, _ = self._get(exchange_code, sandbox, new_client)
+        except Exception as e:
+            print(f"[MarketCache] {exchange_code} markets 快取失敗，client 自己 load_markets：{e}")
+            return client
+        for name, value in attributes.items():
+            setattr(client, name, value)
+        return client
+
+    def warm(self, exchange_code, sandbox, new_client):
+        """先載進這個 process（之後 inject 都不用等）"""
+        self._get(exchange_code, sandbox, new_client)
+
+    def market(self, exchange_code, symbol, sandbox, new_client):
+        """
+        symbol 可以是 unified（BTC/USDT:USDT）或交易所的 id（BTCUSDT）
+        回傳 ccxt market（precision / limits / contractSize ...），找不到回 None
+        """
+        _, template = self._get(exchange_code, sandbox, new_client)
+        try:
+            return template.market(symbol)
+        except Exception:
+            return None
+
+    def amount_to_precision(self, exchange_code, symbol, amount, sandbox, new_client):
+        """照交易所的數量精度無條件捨去，精度不夠（捨完變 0）丟 ccxt InvalidOrder"""
+        _, template = self._get(exchange_code, sandbox, new_client)
+        return float(template.amount_to_precision(symbol, amount))
+
+    def invalidate(self, exchange_code=None, sandbox=None):
+        """清掉 process 裡和共用的快取（下次用到重抓）；不帶參數 = process 裡全部清掉"""
+        with self._lock:
+            if exchange_code is None:
+                self._entries.clear()
+                return
+            key = _key(exchange_code, sandbox)
+            self._entries.pop(key, None)
+        self.backend.delete(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "fetches": self.fetches,
+            }
+
+    def _get(self, exchange_code, sandbox, new_client):
+        key = _key(exchange_code, sandbox)
+        entry = self._fresh(key)
+        if entry:
+            return entry[1], entry[2]
+
+        # 同一個 process 裡同時只有一個 thread 去 Redis / 交易所拿，其他等它
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            entry = self._fresh(key)
+            if entry:
+                return entry[1], entry[2]
+            if time.monotonic() - self._failed_at.get(key, float("-inf")) < MARKET_CACHE_RETRY_SECONDS:
+                raise Exception(f"{key} markets 剛抓失敗，{MARKET_CACHE_RETRY_SECONDS:.0f} 秒內不重試")
+
+            try:
+                return self._load(key, exchange_code, sandbox, new_client)
+            except Exception:
+                self._failed_at[key] = time.monotonic()
+                raise
+
+    def _load(self, key, exchange_code, sandbox, new_client):
+        template = new_client(exchange_code, sandbox)
+        blob = self._load_shared(key)
+        if blob is not None:
+            markets, currencies = _unpack(blob)
+            template.set_markets(markets, currencies or None)
+            with self._lock:
+                self.shared_hits += 1
+        else:
+            template.load_markets()
+            blob = _pack(template.markets, getattr(template, "currencies", None))
+            self._save_shared(key, blob)
+            with self._lock:
+                self.fetches += 1
+            print(f"[MarketCache] 從交易所抓 {key} markets：{len(template.markets)} 個，壓縮後 {len(blob) // 1024} KB")
+
+        attributes = {name: getattr(template, name) for name in MARKET_ATTRIBUTES if hasattr(template, name)}
+        with self._lock:
+            self._entries[key] = (time.monotonic(), attributes, template)
+        return attributes, template
+
+    def _load_shared(self, key):
+        try:
+            return self.backend.load(key)
+        except Exception as e:
+            print(f"[MarketCache] 讀取共用 markets 失敗，改從交易所抓：{e}")
+            return None
+
+    def _save_shared(self, key, blob):
+        try:
+            self.backend.save(key, blob, self.ttl)
+        except Exception as e:
+            print(f"[MarketCache] 寫入共用 markets 失敗（只留在這個 process）：{e}")
+
+    def _fresh(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                self.hits += 1
+                return entry
+            return None
+
+
+if MARKET_CACHE_BACKEND == "off":
+    market_cache = None
+elif MARKET_CACHE_BACKEND == "disk":
+    market_cache = MarketCache(DiskMarketBackend())
+else:
+    market_cache = MarketCache(RedisMarketBackend())
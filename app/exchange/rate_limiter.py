@@ -0,0 +1,198 @@
+from app.utils.redis_client import redis_conn
+import asyncio
+import json
+import os
+import threading
+import time
+from app.config import load_config
+
+load_config()
+
+# redis：所有 worker 共用同一個 token bucket / local：每個 client 自己節流（ccxt 預設，開發用）
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "redis")
+
+# bucket 最多可以囤幾秒的量（允許一次小爆量）
+RATE_LIMIT_BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", 1))
+
+# 同一個出口 IP 的機器設一樣的名字；不同 IP 各自一組 bucket
+RATE_LIMIT_IP_GROUP = os.getenv("RATE_LIMIT_IP_GROUP", "default")
+
+# 每個交易所每秒可用的 weight（ccxt 的 cost 單位，一般請求 = 1）
+# ip：整個 IP（所有帳號加總），account：單一帳號（UID），只算 private API
+# 沒設的用 ccxt 的 rateLimit 換算（1000 / rateLimit，也就是 ccxt 原本單一 client 的速度）
+# ex: {"bitget": {"ip": 40, "account": 20}}
+RATE_LIMITS = json.loads(os.getenv("RATE_LIMITS", "{}"))
+
+# 個別 endpoint 的 weight，蓋掉 ccxt api 定義裡的 cost
+# ex: {"bitget:v2/mix/order/batch-place-order": 5}
+RATE_LIMIT_ENDPOINT_WEIGHTS = json.loads(os.getenv("RATE_LIMIT_ENDPOINT_WEIGHTS", "{}"))
+
+KEY_PREFIX = "strade:ratelimit"
+
+# 預約制 token bucket：token 不夠也先扣（可以變負的），回傳要等多久才輪到
+# 每個請求只打一次 Redis，等待時間由 Redis 排好，不會大家一起醒來再搶
+# KEYS：bucket..., 統計 hash；ARGV：weight, 然後每個 bucket 一組 (每 ms 補多少, 最多囤多少)
+_ACQUIRE_SCRIPT = """
+if redis.replicate_commands then redis.replicate_commands() end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + tonumber(t[2]) / 1000
+local weight = tonumber(ARGV[1])
+local buckets = #KEYS - 1
+local wait = 0
+local levels = {}
+
+for i = 1, buckets do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    if tokens < weight then
+        wait = math.max(wait, (weight - tokens) / rate)
+    end
+    levels[i] = tokens
+end
+
+for i = 1, buckets do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local tokens = levels[i] - weight
+    redis.call('HSET', KEYS[i], 'tokens', tokens, 'ts', now)
+    redis.call('PEXPIRE', KEYS[i], math.ceil((burst - tokens) / rate) + 1000)
+end
+
+local stats = KEYS[#KEYS]
+redis.call('HINCRBY', stats, 'requests', 1)
+redis.call('HINCRBYFLOAT', stats, 'weight', weight)
+if wait > 0 then
+    redis.call('HINCRBY', stats, 'waited', 1)
+    redis.call('HINCRBYFLOAT', stats, 'wait_ms', wait)
+end
+return tostring(wait)
+"""
+
+
+class RateLimiter:
+    """
+    跨 worker 的交易所限流（Redis token bucket）
+    - 每個交易所一個 IP bucket，private API 另外再過一個帳號 bucket
+    - 每個請求的 weight 用 ccxt 自己的 endpoint cost（可用 RATE_LIMIT_ENDPOINT_WEIGHTS 蓋掉）
+    - 接在 ccxt 的 fetch2 前面，ccxt 原本 client 內的節流關掉
+    - Redis 掛了就退回 ccxt 原本的單一 client 節流，不擋下單
+    """
+
+    def __init__(self, redis=redis_conn, burst_seconds=RATE_LIMIT_BURST_SECONDS, ip_group=RATE_LIMIT_IP_GROUP):
+        self.redis = redis
+        self.burst_seconds = burst_seconds
+        self.ip_group = ip_group
+        self._script = redis.register_script(_ACQUIRE_SCRIPT)
+        self._lock = threading.Lock()
+        self._stats = {}  # exchange_code -> 這個 process 的統計
+
+    def install(self, client, exchange_code, exchange_account_id=None):
+        """把 client 的請求接到共用 bucket（sync / async client 都可以）"""
+        original_fetch2 = client.fetch2
+        client.enableRateLimit = False
+
+        if asyncio.iscoroutinefunction(original_fetch2):
+            async def fetch2(path, api="public", method="GET", params={}, headers=None, body=None, config={}):
+                weight, buckets = self._request(client, exchange_code, exchange_account_id, path, api, method, params, config)
+                try:
+                    wait = await asyncio.to_thread(self._reserve, exchange_code, weight, buckets)
+                except Exception as e:
+                    print(f"[RateLimiter] {exchange_code} Redis 限流失敗，改用 client 內節流: {e}")
+                    await client.throttle(weight)
+                else:
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                return await original_fetch2(path, api, method, params, headers, body, config)
+        else:
+            def fetch2(path, api="public", method="GET", params={}, headers=None, body=None, config={}):
+                weight, buckets = self._request(client, exchange_code, exchange_account_id, path, api, method, params, config)
+                try:
+                    wait = self._reserve(exchange_code, weight, buckets)
+                except Exception as e:
+                    print(f"[RateLimiter] {exchange_code} Redis 限流失敗，改用 client 內節流: {e}")
+                    client.throttle(weight)
+                else:
+                    if wait > 0:
+                        time.sleep(wait)
+                return original_fetch2(path, api, method, params, headers, body, config)
+
+        client.fetch2 = fetch2
+        return client
+
+    def _request(self, client, exchange_code, exchange_account_id, path, api, method, params, config):
+        """回傳 (weight, [(bucket key, 每秒 weight), ...])"""
+        weight = RATE_LIMIT_ENDPOINT_WEIGHTS.get(f"{exchange_code}:{path}")
+        if weight is None:
+            weight = client.calculate_rate_limiter_cost(api, method, path, params, config)
+        weight = float(weight or 1)
+
+        limits = RATE_LIMITS.get(exchange_code, {})
+        default_rate = 1000 / client.rateLimit
+        buckets = [(f"{KEY_PREFIX}:{exchange_code}:ip:{self.ip_group}", limits.get("ip") or default_rate)]
+        if exchange_account_id is not None and "private" in str(api).lower():
+            buckets.append(
+                (f"{KEY_PREFIX}:{exchange_code}:account:{exchange_account_id}", limits.get("account") or default_rate))
+        return weight, buckets
+
+    def _reserve(self, exchange_code, weight, buckets):
+        """在 Redis 預約 weight，回傳要等幾秒"""
+        keys = [key for key, _ in buckets] + [f"{KEY_PREFIX}:stats:{exchange_code}"]
+        args = [weight]
+        for _, rate in buckets:
+            # burst 至少要放得下一個請求，不然永遠等不到
+            args += [rate / 1000, max(rate * self.burst_seconds, weight)]
+
+        wait = float(self._script(keys=keys, args=args)) / 1000
+        self._record(exchange_code, wait)
+        return wait
+
+    def _record(self, exchange_code, wait):
+        with self._lock:
+            stats = self._stats.setdefault(exchange_code, {"requests": 0, "waited": 0, "wait_total": 0.0, "wait_max": 0.0})
+            stats["requests"] += 1
+            if wait > 0:
+                stats["waited"] += 1
+                stats["wait_total"] += wait
+                stats["wait_max"] = max(stats["wait_max"], wait)
+
+    def stats(self, reset=False):
+        """這個 process 的等待統計：{exchange_code: {requests, waited, wait_avg_ms, wait_max_ms}}"""
+        with self._lock:
+            result = {
+                code: {
+                    "requests": s["requests"],
+                    "waited": s["waited"],
+                    "wait_avg_ms": s["wait_total"] / s["waited"] * 1000 if s["waited"] else 0.0,
+                    "wait_max_ms": s["wait_max"] * 1000,
+                }
+                for code, s in self._stats.items()
+            }
+            if reset:
+                self._stats.clear()
+            return result
+
+    def cluster_stats(self, exchange_code):
+        """所有 worker 加總的統計（Redis 裡累計，requests / weight / waited / wait_ms）"""
+        raw = self.redis.hgetall(f"{KEY_PREFIX}:stats:{exchange_code}")
+        return {k.decode(): float(v) for k, v in raw.items()}
+
+    def print_stats(self, reset=True):
+        for code, s in self.stats(reset).items():
+            print(
+                f"[RateLimiter] {code}: {s['requests']} 次請求，{s['waited']} 次要排隊，"
+                f"平均等 {s['wait_avg_ms']:.0f} ms，最久 {s['wait_max_ms']:.0f} ms"
+            )
+
+
+rate_limiter = RateLimiter() if RATE_LIMIT_BACKEND == "redis" else None
+
+
+def install_rate_limiter(client, exchange_code, exchange_account_id=None):
+    """RATE_LIMIT_BACKEND=redis 時把 client 接上共用限流；local 就保留 ccxt 原本的節流"""
+    if rate_limiter is not None:
+        rate_limiter.install(client, exchange_code, exchange_account_id)
+    return client
@@ -0,0 +1,309 @@
+from app.migrate import migrate
+from app.utils.db import connect, execute, execute_many, query_all
+from app.utils.now import now
+import argparse
+import ast
+import os
+import re
+import sys
+from app.config import load_config
+
+load_config()
+
+# 要檢查的模組：裡面每一句 query_one / query_all / execute / insert_and_get_id 的 SQL 都會拿去 EXPLAIN
+EXPLAIN_CHECK_MODULES = (
+    "app/services/trade_service.py",
+    "app/services/strategy_service.py",
+    "app/services/bot_service.py",
+    "app/services/reconcile_service.py",
+    "app/services/trade_writer.py",
+)
+# bulk_update 不在這裡：它一律是 UPDATE ... WHERE id IN (...)，走主鍵
+DB_CALLS = {"query_one", "query_all", "execute", "execute_many", "insert_and_get_id"}
+
+# 組 INSERT 的 helper（trade_writer._insert_sql(table, columns)），認得出來就當成 INSERT 略過
+INSERT_BUILDERS = {"_insert_sql"}
+
+# 設定表（幾十列），全表掃比走索引還快，不算退步
+SCAN_ALLOWED_TABLES = {"exchanges", "strategies"}
+
+# EXPLAIN 時 %s 帶什麼值（照 %s 前面的欄位名找，都是 seed 裡有的資料）
+SAMPLE_VALUES = {
+    "id": 1,
+    "bot_id": 1,
+    "strategy_id": 1,
+    "user_trade_id": 1,
+    "exchange_account_id": 1,
+    "exchange_order_id": "1",
+    "client_order_id": "sb1b1o",
+    "is_active": 1,
+    "status": "CLOSED",
+}
+
+# seed 的資料量：量太少 MySQL 會覺得全表掃比較快，EXPLAIN 就看不出有沒有用到索引
+SEED_EXCHANGES = ("binance", "bybit", "okx")
+SEED_STRATEGIES = 20
+SEED_BOTS = 2000
+SEED_BOTS_PER_ACCOUNT = 5
+SEED_STRATEGY_TRADES = 200  # 每個策略
+SEED_USER_TRADES = 20  # 每個 bot
+SEED_CHUNK = 1000
+
+
+def extract_statements(path):
+    """
+    用 ast 找出模組裡每個 DB 呼叫的 SQL，回傳 [(位置, sql)]
+    - f-string 的 {placeholders} 換成一個 %s（IN (...) 只帶一個值）
+    - BOT_CONTEXT_SQL + "..."、sql = "..." 這種先組好再傳的也找得到
+    - PENDING_ORDERS_SQL.format(statuses=...) 的 {statuses} 一樣換成一個 %s
+    - 後面再 sql += " AND ..." 補篩選條件的，沒篩選的那一句和每個條件各自加上去的都會檢查
+    - _insert_sql(table, columns) 組出來的當成 INSERT
+    - 組不出來的回傳 sql=None，當作檢查失敗，不會默默漏掉
+    """
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    constants = _string_assignments(tree.body)
+    statements = {}  # 位置 -> sql（巢狀函式會被外層再走一次）
+    for function in ast.walk(tree):
+        if not isinstance(function, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        names = {**constants, **_string_assignments(ast.walk(function), constants)}
+        augments = _string_augments(ast.walk(function), names)
+        for node in ast.walk(function):
+            if not isinstance(node, ast.Call) or len(node.args) < 2:
+                continue
+            func = node.func
+            name = func.id if isinstance(func, ast.Name) else getattr(func, "attr", None)
+            if name in DB_CALLS:
+                location = f"{path}:{node.lineno}"
+                sql = statements[location] = _resolve(node.args[1], names)
+                if sql is not None and isinstance(node.args[1], ast.Name):
+                    for lineno, extra in augments.get(node.args[1].id, ()):
+                        statements[f"{location}（+ 第 {lineno} 行的條件）"] = sql + extra
+    return list(statements.items())
+
+
+def _string_assignments(nodes, names=None):
+    result = {}
+    for node in nodes:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            value = _resolve(node.value, {**(names or {}), **result})
+            if value is not None:
+                result[node.targets[0].id] = value
+    return result
+
+
+def _string_augments(nodes, names):
+    """sql += "..." 補上去的字串，{變數: [(行號, 字串)]}（組不出來的略過）"""
+    result = {}
+    for node in nodes:
+        if isinstance(node, ast.AugAssign) and isinstance(node.op, ast.Add) and isinstance(node.target, ast.Name):
+            value = _resolve(node.value, names)
+            if value is not None:
+                result.setdefault(node.target.id, []).append((node.lineno, value))
+    return result
+
+
+def _resolve(node, names):
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.JoinedStr):
+        return "".join(part.value if isinstance(part, ast.Constant) else "%s" for part in node.values)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left, right = _resolve(node.left, names), _resolve(node.right, names)
+        return left + right if left is not None and right is not None else None
+    if isinstance(node, ast.Name):
+        return names.get(node.id)
+    if isinstance(node, ast.Call):
+        func = node.func
+        if isinstance(func, ast.Attribute) and func.attr == "format":
+            template = _resolve(func.value, names)
+            return re.sub(r"\{\w*\}", "%s", template) if template is not None else None
+        if isinstance(func, ast.Name) and func.id in INSERT_BUILDERS:
+            table = node.args[0].value if node.args and isinstance(node.args[0], ast.Constant) else "?"
+            return f"INSERT INTO {table}"
+    return None
+
+
+def bind_params(sql):
+    """照每個 %s 前面的欄位名從 SAMPLE_VALUES 找值；UPDATE 的 SET 不影響執行計畫，一律帶 NULL"""
+    where_at = sql.upper().find("WHERE") if sql.lstrip().upper().startswith("UPDATE") else 0
+    params = []
+    for match in re.finditer(r"%s", sql):
+        if match.start() < where_at:
+            params.append(None)
+            continue
+        column = re.search(
+            r"(\w+)\s*(?:=|>=|<=|>|<|(?:\bNOT\s+)?\bIN\s*\()\s*$", sql[:match.start()], re.IGNORECASE)
+        if not column or column.group(1) not in SAMPLE_VALUES:
+            raise Exception(f"不知道這個 %s 要帶什麼值，請加進 SAMPLE_VALUES：{sql[:match.end()].strip()[-80:]}")
+        params.append(SAMPLE_VALUES[column.group(1)])
+    return params
+
+
+def scans(plan):
+    """EXPLAIN 結果裡全表掃 / 全索引掃的表（子查詢產生的 <derived2> 這種暫存表不算）"""
+    return [
+        row for row in plan
+        if row["type"] in ("ALL", "index")
+        and row["table"] and not row["table"].startswith("<")
+        and row["table"] not in SCAN_ALLOWED_TABLES
+    ]
+
+
+def seed(db):
+    """清空後灌一份跟線上比例差不多的資料，最後 ANALYZE 讓統計資料是新的"""
+    tables = (
+        "user_trade_orders", "user_trades", "strategy_trades", "bots",
+        "strategies", "exchange_accounts", "exchanges",
+    )
+    for table in tables:
+        execute(db, f"TRUNCATE TABLE {table}")
+
+    ts = now()
+    execute_many(
+        db, "INSERT INTO exchanges (id, code) VALUES (%s, %s)",
+        [(i + 1, code) for i, code in enumerate(SEED_EXCHANGES)],
+    )
+
+    accounts = SEED_BOTS // SEED_BOTS_PER_ACCOUNT
+    _insert_chunks(
+        db, "INSERT INTO exchange_accounts (id, user_id, exchange_id, params) VALUES (%s, %s, %s, %s)",
+        [(i, i, i % len(SEED_EXCHANGES) + 1, '{"apiKey": "x", "secret": "x"}') for i in range(1, accounts + 1)],
+    )
+    _insert_chunks(
+        db, "INSERT INTO strategies (id, name, unified_symbol, is_active, timeframe) VALUES (%s, %s, %s, %s, %s)",
+        [(i, f"strategy-{i}", "BTC/USDT:USDT", 1, "1h") for i in range(1, SEED_STRATEGIES + 1)],
+    )
+    # 八成 RUNNING，其他 STOPPED
+    _insert_chunks(
+        db,
+        """
+        INSERT INTO bots (id, user_id, strategy_id, exchange_account_id, exchange_symbol, leverage, base_order_usdt, status)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """,
+        [
+            (i, i, i % SEED_STRATEGIES + 1, (i - 1) // SEED_BOTS_PER_ACCOUNT + 1, "BTCUSDT", 5, 100,
+             "STOPPED" if i % 5 == 0 else "RUNNING")
+            for i in range(1, SEED_BOTS + 1)
+        ],
+    )
+
+    # 每個策略一堆已出場的，最後一筆還開著
+    strategy_trades = []
+    for strategy_id in range(1, SEED_STRATEGIES + 1):
+        for n in range(SEED_STRATEGY_TRADES):
+            is_open = n == SEED_STRATEGY_TRADES - 1
+            strategy_trades.append((
+                strategy_id, "LONG", 100, ts, None if is_open else ts, "OPEN" if is_open else "CLOSED", ts, ts))
+    _insert_chunks(
+        db,
+        """
+        INSERT INTO strategy_trades (strategy_id, position_side, entry_price, entry_at, exit_at, status, created_at, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """,
+        strategy_trades,
+    )
+
+    # 每個 bot 一堆 CLOSED 的，最後一筆 OPEN；每筆 user_trade 一張 OPEN、一張 CLOSE
+    user_trades = []
+    orders = []
+    user_trade_id = 0
+    for bot_id in range(1, SEED_BOTS + 1):
+        for n in range(SEED_USER_TRADES):
+            user_trade_id += 1
+            is_open = n == SEED_USER_TRADES - 1
+            user_trades.append((
+                bot_id, n + 1, (bot_id - 1) // SEED_BOTS_PER_ACCOUNT + 1, bot_id, "BTCUSDT", "LONG", 1, 5, 100,
+                "OPEN" if is_open else "CLOSED", ts, ts))
+            orders.append((user_trade_id, str(len(orders) + 1), "OPEN", 100, 1, 1, "CLOSED", ts, ts))
+            if not is_open:
+                orders.append((user_trade_id, str(len(orders) + 1), "CLOSE", 100, 1, 1, "CLOSED", ts, ts))
+    _insert_chunks(
+        db,
+        """
+        INSERT INTO user_trades (user_id, strategy_trade_id, exchange_account_id, bot_id, exchange_symbol,
+                                 position_side, quantity, leverage, entry_price, status, created_at, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """,
+        user_trades,
+    )
+    _insert_chunks(
+        db,
+        """
+        INSERT INTO user_trade_orders (user_trade_id, exchange_order_id, type, price, requested_qty, filled_qty,
+                                       status, created_at, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """,
+        orders,
+    )
+
+    execute(db, f"ANALYZE TABLE {', '.join(tables)}")
+
+
+def _insert_chunks(db, sql, rows):
+    for start in range(0, len(rows), SEED_CHUNK):
+        execute_many(db, sql, rows[start:start + SEED_CHUNK])
+
+
+def check(db, modules=EXPLAIN_CHECK_MODULES):
+    """每一句 SQL 跑 EXPLAIN，回傳有問題的 [(位置, 原因)]"""
+    failures = []
+    for path in modules:
+        for location, sql in extract_statements(path):
+            if sql is None:
+                failures.append((location, "組不出 SQL（請改成字串 / f-string / 模組常數）"))
+                continue
+            if sql.lstrip().upper().startswith("INSERT"):
+                continue  # INSERT ... VALUES 不會掃表
+
+            try:
+                plan = query_all(db, "EXPLAIN " + sql, bind_params(sql))
+            except Exception as e:
+                failures.append((location, f"EXPLAIN 失敗：{e}"))
+                continue
+
+            summary = ", ".join(f"{row['table']}:{row['type']}({row['key'] or '-'})" for row in plan)
+            bad = scans(plan)
+            print(f"[ExplainCheck] {'全表掃' if bad else 'OK'} {location} {summary}")
+            if bad:
+                failures.append((location, f"{', '.join(row['table'] for row in bad)} 沒有用到索引"))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在 seed 過的資料庫上 EXPLAIN 熱路徑的每一句 SQL，有全表掃就 exit 1")
+    parser.add_argument("--database", default=os.getenv("EXPLAIN_CHECK_DB", f"{os.getenv('DB_NAME', 'strade')}_explain_check"),
+                        help="檢查用的資料庫，每次都會整個砍掉重建")
+    parser.add_argument("--keep", action="store_true", help="檢查完不要砍掉資料庫")
+    args = parser.parse_args()
+
+    if args.database == os.getenv("DB_NAME", "strade"):
+        print("[ExplainCheck] 不能拿 DB_NAME 來檢查（會被清空），請指定另一個 --database")
+        sys.exit(2)
+
+    admin = connect()
+    execute(admin, f"DROP DATABASE IF EXISTS `{args.database}`")
+    execute(admin, f"CREATE DATABASE `{args.database}`")
+
+    db = connect(args.database)
+    try:
+        migrate(db)
+        seed(db)
+        failures = check(db)
+    finally:
+        db.close()
+        if not args.keep:
+            execute(admin, f"DROP DATABASE IF EXISTS `{args.database}`")
+        admin.close()
+
+    if failures:
+        for location, reason in failures:
+            print(f"[ExplainCheck] ❌ {location}：{reason}")
+        sys.exit(1)
+    print("[ExplainCheck] 全部都有用到索引")
+
+
+if __name__ == "__main__":
+    main()
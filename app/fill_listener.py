@@ -0,0 +1,41 @@
+from app.exchange.fill_event_sources import build_fill_event_source
+from app.services.fill_event_service import FillEventService
+from app.utils.metrics import start_metrics_server
+import os
+import time
+from app.config import load_config
+
+load_config()
+
+# ccxtpro（交易所 websocket）/ local（本機替身，測試用）
+FILL_EVENT_SOURCE = os.getenv("FILL_EVENT_SOURCE", "ccxtpro")
+
+# 每幾秒重新同步一次要監聽的帳號（新 bot / 停用的 bot）
+FILL_EVENT_ACCOUNT_SYNC_SECONDS = int(os.getenv("FILL_EVENT_ACCOUNT_SYNC_SECONDS", 60))
+
+
+def main():
+    start_metrics_server()
+    service = FillEventService(build_fill_event_source(FILL_EVENT_SOURCE))
+    service.start()
+
+    print(f"[FillListener] 啟動，來源={FILL_EVENT_SOURCE}")
+
+    try:
+        while True:
+            try:
+                count = service.sync_accounts()
+                print(
+                    f"[FillListener] 監聽 {count} 個帳號，已收到 {service.received} 筆、"
+                    f"已套用 {service.applied} 筆、略過 {service.dropped} 筆"
+                )
+            except Exception as e:
+                print(f"[FillListener] 同步帳號失敗：{e}")
+            time.sleep(FILL_EVENT_ACCOUNT_SYNC_SECONDS)
+    except (KeyboardInterrupt, SystemExit):
+        print("[FillListener] 收到停止訊號，結束")
+        service.stop()
+
+
+if __name__ == "__main__":
+    main()
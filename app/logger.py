@@ -1,10 +1,19 @@
 import logging
-from logging.handlers import TimedRotatingFileHandler
-import os
-from dotenv import load_dotenv
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
+from contextlib import contextmanager
+import atexit
 import builtins
+import contextvars
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from app.config import load_config
 
-load_dotenv()
+load_config()
 
 # Log 目錄
 LOG_DIR = os.getenv("LOG_DIR", "./logs")
@@ -13,13 +22,154 @@ os.makedirs(LOG_DIR, exist_ok=True)
 # Log 檔案路徑
 LOG_FILE = os.path.join(LOG_DIR, "app.log")
 
+env = os.getenv("APP_ENV", "local")
+
+# json（一行一筆，方便 log 平台解析）/ text（舊格式）
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_CONSOLE_FORMAT = os.getenv("LOG_CONSOLE_FORMAT", "text").lower()
+
+# 排隊中的 log 超過這個數量就直接丟掉（寧可掉 log 也不能卡住下單）
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+# 各等級訊息最多保留幾個字（0 = 不截斷），交易所整包回應通常只要前面一段
+LOG_MAX_CHARS = {
+    logging.DEBUG: int(os.getenv("LOG_MAX_CHARS_DEBUG", 500)),
+    logging.INFO: int(os.getenv("LOG_MAX_CHARS_INFO", 2000)),
+    logging.WARNING: int(os.getenv("LOG_MAX_CHARS_WARNING", 0)),
+    logging.ERROR: int(os.getenv("LOG_MAX_CHARS_ERROR", 0)),
+}
+
+# 各等級抽樣比例（1 = 全留）
+LOG_SAMPLE_RATE = {
+    logging.DEBUG: float(os.getenv("LOG_SAMPLE_DEBUG", 1)),
+    logging.INFO: float(os.getenv("LOG_SAMPLE_INFO", 1)),
+}
+
+# 程式結束 / job 結束時最多等幾秒把排隊中的 log 寫完
+LOG_FLUSH_TIMEOUT = float(os.getenv("LOG_FLUSH_TIMEOUT", 2))
+
+# 每筆 log 要帶的欄位（bot_id / strategy_trade_id / exchange ...），用 log_context 設定
+_context = contextvars.ContextVar("log_context", default={})
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    這個區塊裡印的 log 都會帶上這些欄位（thread / coroutine 各自獨立）
+    with log_context(bot_id=1, strategy_trade_id=10, exchange="bitget"):
+        print("...")
+    """
+    token = _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def current_log_context():
+    """目前 log_context 設的欄位（metrics 拿來當 label）"""
+    return _context.get()
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    在呼叫端的 thread 只做：抽樣、截斷、記下 context，然後 put_nowait 丟進 queue
+    寫檔 / 寫 console 都在背景 listener thread，queue 滿了就丟掉並計數
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._reported_dropped = 0
+
+    def emit(self, record):
+        rate = LOG_SAMPLE_RATE.get(record.levelno, 1)
+        if rate < 1 and random.random() >= rate:
+            return
+        super().emit(record)
+
+    def prepare(self, record):
+        message = record.getMessage()
+        limit = LOG_MAX_CHARS.get(record.levelno, 0)
+        if limit and len(message) > limit:
+            message = f"{message[:limit]}...（截斷，原長 {len(message)} 字）"
+
+        if record.exc_info:
+            message = f"{message}\n{logging.Formatter().formatException(record.exc_info)}"
+
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.context = dict(_context.get())
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.report_dropped()
+
+    def report_dropped(self):
+        """有丟掉的 log 就補一筆 WARNING 說丟了幾筆"""
+        if self.dropped <= self._reported_dropped:
+            return
+        dropped = self.dropped - self._reported_dropped
+        warning = logging.makeLogRecord({
+            "name": logger.name,
+            "levelno": logging.WARNING,
+            "levelname": "WARNING",
+            "msg": f"[Logger] log queue 滿了，丟掉 {dropped} 筆",
+            "context": {},
+        })
+        try:
+            self.queue.put_nowait(warning)
+            self._reported_dropped += dropped
+        except queue.Full:
+            pass
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": self.formatTime(record, "%Y-%m-%d %H:%M:%S"),
+            "level": record.levelname,
+            "env": env,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        data.update(getattr(record, "context", None) or {})
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        message = super().format(record)
+        context = getattr(record, "context", None)
+        if context:
+            message += " " + " ".join(f"{k}={v}" for k, v in context.items())
+        return message
+
+
+def _formatter(name):
+    if name == "json":
+        return JsonFormatter()
+    # Log 格式
+    return TextFormatter(f"[%(asctime)s] {env}.%(levelname)s: %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+
+
 # 建立 logger（全域使用）
 logger = logging.getLogger("app_logger")
 logger.setLevel(logging.INFO)
+logger.propagate = False
 
 # ---- Handler 1：輸出到終端（讓你看到 print 類似效果） ----
-console_handler = logging.StreamHandler()
+console_handler = logging.StreamHandler(sys.stdout)
 console_handler.setLevel(logging.INFO)
+console_handler.setFormatter(_formatter(LOG_CONSOLE_FORMAT))
 
 # ---- Handler 2：每天自動切割 log 檔案 ----
 file_handler = TimedRotatingFileHandler(
@@ -27,21 +177,53 @@ file_handler = TimedRotatingFileHandler(
 )
 file_handler.setLevel(logging.INFO)
 file_handler.suffix = "%Y-%m-%d"  # 會變成 app.log.2025-11-27
+file_handler.setFormatter(_formatter(LOG_FORMAT))
 
-env = os.getenv("APP_ENV", "local")
+queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _start_listener():
+    """背景 thread 把 queue 裡的 log 寫到 console / 檔案"""
+    global _listener
+    _listener = QueueListener(queue_handler.queue, console_handler, file_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_in_child():
+    """fork 出來的 process（RQ work horse）沒有 listener thread，queue 的 lock 也可能停在 fork 當下的狀態，全部換新"""
+    global _listener_lock
+    _listener_lock = threading.Lock()
+    queue_handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler.dropped = 0
+    queue_handler._reported_dropped = 0
+    _start_listener()
+
+
+def flush_logs(timeout=LOG_FLUSH_TIMEOUT):
+    """等排隊中的 log 寫完（最多 timeout 秒），process 要結束前呼叫"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        queue_handler.report_dropped()
+        if not queue_handler.queue.unfinished_tasks:
+            break
+        time.sleep(0.01)
+
+
+def stop_logging():
+    with _listener_lock:
+        if _listener is not None:
+            flush_logs()
+            _listener.stop()
 
-# Log 格式
-formatter = logging.Formatter(
-    f"[%(asctime)s] {env}.%(levelname)s: %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
-console_handler.setFormatter(formatter)
-file_handler.setFormatter(formatter)
 
 # 確保不重複加入 handler
 if not logger.handlers:
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    logger.addHandler(queue_handler)
+    _start_listener()
+    os.register_at_fork(after_in_child=_restart_in_child)
+    atexit.register(stop_logging)
 
 
 def log(msg):
@@ -52,9 +234,12 @@ def log(msg):
 # 備份原本的 print
 original_print = print
 
-def print(*args, **kwargs):
-    message = " ".join(str(x) for x in args)
-    logger.info(message)
-    original_print(*args, **kwargs)  # 還是要照樣印到 console
+def print(*args, sep=" ", end="\n", file=None, flush=False):
+    if file is not None and file not in (sys.stdout, sys.stderr):
+        # 明確印到其他地方（檔案、StringIO）的就照原本的 print
+        original_print(*args, sep=sep, end=end, file=file, flush=flush)
+        return
+    # 只丟進 queue，console / 檔案都由背景 thread 寫
+    logger.info(sep.join(str(x) for x in args))
 
 builtins.print = print
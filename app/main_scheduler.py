@@ -1,29 +1,145 @@
 from apscheduler.schedulers.blocking import BlockingScheduler
-from app.worker_jobs import run_strategy_tick_job
+from app.worker_jobs import (
+    run_strategy_tick_job, reconcile_orders_job, purge_raw_responses_job, replay_dead_letters_job, queue)
+from app.services.prearm_service import PREARM_SECONDS, prearm_strategies
+from app.services.strategy_service import load_active_strategies, run_strategies
+from app.services.candle_store import timeframe_to_ms
+from app.utils.metrics import start_metrics_server
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+# 每幾分鐘全量掃一次還沒結束的訂單（補上延遲對帳放棄的、或 worker 重啟漏掉的）
+RECONCILE_SWEEP_MINUTES = int(os.getenv("RECONCILE_SWEEP_MINUTES", 5))
+
+# 每幾分鐘補寫一次 DB 寫不進去的下單資料（dead-letter）
+DEAD_LETTER_REPLAY_MINUTES = int(os.getenv("DEAD_LETTER_REPLAY_MINUTES", 1))
+
+# 每天幾點（Asia/Taipei）清一次超過保留天數的完整交易所回應
+RAW_RESPONSE_PURGE_HOUR = int(os.getenv("RAW_RESPONSE_PURGE_HOUR", 4))
+
+# 同時有幾個策略在幫 bot 下單
+STRATEGY_DISPATCH_THREADS = int(os.getenv("STRATEGY_DISPATCH_THREADS", 4))
+
+
+def due_timeframes(timeframes, now_ms=None):
+    """哪些 timeframe 剛好在這一分鐘換 K 線（1h → 每整點、4h → 0/4/8... 點，以 UTC 對齊）"""
+    now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+    minute_ms = now_ms - now_ms % 60_000
+    return {tf for tf in timeframes if minute_ms % timeframe_to_ms(tf) == 0}
 
 
 def enqueue_strategy_job():
-    """實際丟 RQ job 的函式，每次被 scheduler 呼叫一次"""
-    strategy_id = 1  # 目前先寫死策略 1，要之後再改成動態可以再調整
-    print(f"[Scheduler] 丟策略 job: strategy_id={strategy_id}")
-    run_strategy_tick_job(strategy_id)
+    """每分鐘被 scheduler 呼叫一次：跑剛換 K 線的策略，有訊號的才幫 bot 下單"""
+    strategies = load_active_strategies()
+    timeframes = due_timeframes({s["timeframe"] for s in strategies})
+    if not timeframes:
+        return
+
+    print(f"[Scheduler] 跑策略：timeframe={sorted(timeframes)}")
+    signals = run_strategies(strategies=[s for s in strategies if s["timeframe"] in timeframes])
+    if not signals:
+        print("[Scheduler] 這輪沒有策略產生訊號")
+        return
+
+    with ThreadPoolExecutor(max_workers=STRATEGY_DISPATCH_THREADS) as pool:
+        for strategy_id, signal in signals:
+            print(f"[Scheduler] 丟策略 job: strategy_id={strategy_id}")
+            pool.submit(_dispatch, strategy_id, signal)
+
+
+def prearm_job():
+    """
+    每分鐘在 00 秒前 PREARM_SECONDS 秒被呼叫：下一分鐘要換 K 線的策略，先把 bot / client / markets / 時間差 / 槓桿 / K 線準備好
+    收盤後的 tick 只剩跑策略 + create_order
+    """
+    strategies = load_active_strategies()
+    timeframes = due_timeframes({s["timeframe"] for s in strategies}, int(time.time() * 1000) + PREARM_SECONDS * 1000)
+    due = [s for s in strategies if s["timeframe"] in timeframes]
+    if not due:
+        return
+    try:
+        prearm_strategies(due)
+    except Exception as e:
+        # 沒預熱也沒關係，tick 時會照舊現建現查
+        print(f"[Scheduler] 預熱失敗：{e}")
+
+
+def _dispatch(strategy_id, signal):
+    try:
+        run_strategy_tick_job(strategy_id, signal)
+    except Exception as e:
+        print(f"[Scheduler] 策略 {strategy_id} 下單失敗：{e}")
+
+
+def enqueue_reconcile_sweep():
+    """丟一個全量對帳 job 給 RQ worker"""
+    queue.enqueue(reconcile_orders_job)
+
+
+def enqueue_dead_letter_replay():
+    """丟一個補寫 dead-letter 的 job 給 RQ worker"""
+    queue.enqueue(replay_dead_letters_job)
+
+
+def enqueue_raw_response_purge():
+    """丟一個清完整回應的 job 給 RQ worker"""
+    queue.enqueue(purge_raw_responses_job)
 
 
 def main():
+    # tick 在這個 process 裡跑，/metrics 也開在這裡（RQ worker 推到 Redis 的 shard / 對帳 histogram 也從這裡輸出）
+    start_metrics_server(include_workers=True)
+
     # 用 BlockingScheduler，程式會常駐跑
     scheduler = BlockingScheduler(timezone="Asia/Taipei")
 
-    # 每「整點」執行一次
-    # minute=0 表示 00 分，hour='*' 表示每個小時
+    # 每分鐘的 00 秒檢查一次，哪個 timeframe 換 K 線就跑那些策略（1h 的策略一樣是每整點）
     scheduler.add_job(
         enqueue_strategy_job,
         "cron",
-        minute=0,
-        id="run_strategy_tick_hourly",
+        minute="*",
+        id="run_strategy_tick",
+        replace_existing=True,
+    )
+
+    if PREARM_SECONDS > 0:
+        # 00 秒前 PREARM_SECONDS 秒先預熱下一分鐘要跑的策略
+        scheduler.add_job(
+            prearm_job,
+            "cron",
+            minute="*",
+            second=60 - PREARM_SECONDS,
+            id="prearm_strategy_tick",
+            replace_existing=True,
+        )
+
+    scheduler.add_job(
+        enqueue_reconcile_sweep,
+        "interval",
+        minutes=RECONCILE_SWEEP_MINUTES,
+        id="reconcile_orders_sweep",
+        replace_existing=True,
+    )
+
+    scheduler.add_job(
+        enqueue_dead_letter_replay,
+        "interval",
+        minutes=DEAD_LETTER_REPLAY_MINUTES,
+        id="replay_trade_dead_letters",
+        replace_existing=True,
+    )
+
+    scheduler.add_job(
+        enqueue_raw_response_purge,
+        "cron",
+        hour=RAW_RESPONSE_PURGE_HOUR,
+        minute=17,
+        id="purge_raw_responses",
         replace_existing=True,
     )
 
-    print("[Scheduler] APScheduler 啟動，將在每個整點丟策略 job")
+    print("[Scheduler] APScheduler 啟動，每個 timeframe 換 K 線時丟策略 job")
 
     try:
         scheduler.start()
@@ -0,0 +1,128 @@
+from app.utils.db import connect, query_all, query_one, execute
+from app.utils.now import now
+import argparse
+import hashlib
+import os
+import pymysql
+import sys
+from app.config import load_config
+
+load_config()
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+
+# 同時只有一個 process 在跑 migration（scheduler / worker 一起啟動時）
+MIGRATION_LOCK = "strade:migrate"
+MIGRATION_LOCK_TIMEOUT = int(os.getenv("MIGRATION_LOCK_TIMEOUT", 60))
+
+# 表 / 欄位 / 索引已經存在（手動建過的環境）就當作這句做過了
+ALREADY_APPLIED_ERRORS = {
+    1050,  # ER_TABLE_EXISTS_ERROR
+    1060,  # ER_DUP_FIELDNAME
+    1061,  # ER_DUP_KEYNAME
+}
+
+SCHEMA_MIGRATIONS_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version VARCHAR(255) NOT NULL PRIMARY KEY,
+        checksum CHAR(64) NOT NULL,
+        applied_at DATETIME NOT NULL
+    )
+"""
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """[(version, sql)]，照檔名排序；version 就是檔名去掉 .sql（0001_create_tables）"""
+    migrations = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".sql"):
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                migrations.append((name[:-4], f.read()))
+    return migrations
+
+
+def split_statements(sql):
+    """拿掉 -- 註解後用 ; 切成一句一句（migration 裡不寫 procedure / trigger，不用處理 DELIMITER）"""
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    return [statement.strip() for statement in "\n".join(lines).split(";") if statement.strip()]
+
+
+def checksum(sql):
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()
+
+
+def applied_migrations(db):
+    """{version: checksum}"""
+    execute(db, SCHEMA_MIGRATIONS_SQL)
+    return {row["version"]: row["checksum"] for row in query_all(db, "SELECT version, checksum FROM schema_migrations")}
+
+
+def migrate(db, directory=MIGRATIONS_DIR, dry_run=False):
+    """
+    依序跑還沒跑過的 migration，每個檔案跑完記一筆 schema_migrations
+    MySQL 的 DDL 會自己 commit，中途失敗的檔案不會記錄，修好之後整個檔案重跑（已經建好的會略過）
+    回傳這次跑了哪些 version
+    """
+    if not query_one(db, "SELECT GET_LOCK(%s, %s) AS locked", (MIGRATION_LOCK, MIGRATION_LOCK_TIMEOUT))["locked"]:
+        raise Exception(f"等了 {MIGRATION_LOCK_TIMEOUT} 秒還拿不到 migration lock，可能有別的 process 在跑")
+
+    try:
+        applied = applied_migrations(db)
+        done = []
+        for version, sql in load_migrations(directory):
+            if version in applied:
+                if applied[version] != checksum(sql):
+                    print(f"[Migrate] ⚠️ {version} 跑過之後檔案被改過，不會重跑；要改 schema 請加新的 migration")
+                continue
+
+            print(f"[Migrate] {'(dry-run) ' if dry_run else ''}執行 {version}")
+            if dry_run:
+                done.append(version)
+                continue
+
+            for statement in split_statements(sql):
+                try:
+                    execute(db, statement)
+                except pymysql.MySQLError as e:
+                    if e.args and e.args[0] in ALREADY_APPLIED_ERRORS:
+                        print(f"[Migrate] {version}：已經存在，略過（{e.args[1]}）")
+                        continue
+                    raise
+
+            execute(
+                db,
+                "INSERT INTO schema_migrations (version, checksum, applied_at) VALUES (%s, %s, %s)",
+                (version, checksum(sql), now()),
+            )
+            done.append(version)
+        return done
+    finally:
+        query_one(db, "SELECT RELEASE_LOCK(%s) AS released", (MIGRATION_LOCK,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="建立 / 更新資料表（app/migrations/*.sql）")
+    parser.add_argument("--database", help="要 migrate 的資料庫（預設 DB_NAME）")
+    parser.add_argument("--dry-run", action="store_true", help="只列出會跑哪些 migration")
+    parser.add_argument("--status", action="store_true", help="列出每個 migration 跑過了沒")
+    args = parser.parse_args()
+
+    db = connect(args.database)
+    try:
+        if args.status:
+            applied = applied_migrations(db)
+            for version, _ in load_migrations():
+                print(f"[Migrate] {version}: {'已套用' if version in applied else '未套用'}")
+            return
+
+        done = migrate(db, dry_run=args.dry_run)
+        print(f"[Migrate] 完成，這次跑了 {len(done)} 個：{', '.join(done) or '無'}")
+    except Exception as e:
+        print(f"[Migrate] 失敗：{e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
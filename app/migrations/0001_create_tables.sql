@@ -0,0 +1,105 @@
+-- tick / 對帳會碰到的表；已經手動建好的環境 IF NOT EXISTS 會略過（索引在 0002 補）
+
+CREATE TABLE IF NOT EXISTS exchanges (
+    id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    code VARCHAR(32) NOT NULL,
+    name VARCHAR(64) NULL,
+    UNIQUE KEY uq_exchanges_code (code)
+);
+
+CREATE TABLE IF NOT EXISTS exchange_accounts (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    user_id BIGINT UNSIGNED NULL,
+    exchange_id INT UNSIGNED NOT NULL,
+    params TEXT NOT NULL,
+    created_at DATETIME NULL,
+    updated_at DATETIME NULL
+);
+
+CREATE TABLE IF NOT EXISTS strategies (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(64) NOT NULL,
+    unified_symbol VARCHAR(32) NOT NULL,
+    is_active TINYINT(1) NOT NULL DEFAULT 1,
+    timeframe VARCHAR(8) NULL,
+    code VARCHAR(64) NULL,
+    params TEXT NULL
+);
+
+CREATE TABLE IF NOT EXISTS bots (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    user_id BIGINT UNSIGNED NOT NULL,
+    strategy_id BIGINT UNSIGNED NOT NULL,
+    exchange_account_id BIGINT UNSIGNED NOT NULL,
+    exchange_symbol VARCHAR(32) NOT NULL,
+    leverage INT NOT NULL DEFAULT 1,
+    base_order_usdt DECIMAL(20, 8) NOT NULL,
+    status VARCHAR(16) NOT NULL,
+    created_at DATETIME NULL,
+    updated_at DATETIME NULL
+);
+
+CREATE TABLE IF NOT EXISTS strategy_trades (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    strategy_id BIGINT UNSIGNED NOT NULL,
+    position_side VARCHAR(8) NULL,
+    entry_price DECIMAL(20, 8) NULL,
+    entry_at DATETIME NULL,
+    exit_price DECIMAL(20, 8) NULL,
+    exit_at DATETIME NULL,
+    status VARCHAR(16) NOT NULL,
+    pnl_pct DECIMAL(12, 6) NULL,
+    extra JSON NULL,
+    created_at DATETIME NULL,
+    updated_at DATETIME NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_trades (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    user_id BIGINT UNSIGNED NOT NULL,
+    strategy_trade_id BIGINT UNSIGNED NULL,
+    exchange_account_id BIGINT UNSIGNED NOT NULL,
+    bot_id BIGINT UNSIGNED NOT NULL,
+    exchange_symbol VARCHAR(32) NOT NULL,
+    position_side VARCHAR(8) NOT NULL,
+    quantity DECIMAL(20, 8) NULL,
+    leverage INT NULL,
+    entry_price DECIMAL(20, 8) NULL,
+    opened_at DATETIME NULL,
+    exit_price DECIMAL(20, 8) NULL,
+    closed_at DATETIME NULL,
+    pnl DECIMAL(20, 8) NULL,
+    pnl_pct DECIMAL(12, 6) NULL,
+    status VARCHAR(16) NOT NULL,
+    error_message TEXT NULL,
+    created_at DATETIME NULL,
+    updated_at DATETIME NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_trade_orders (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    user_trade_id BIGINT UNSIGNED NOT NULL,
+    exchange_order_id VARCHAR(64) NULL,
+    type VARCHAR(8) NOT NULL,
+    price DECIMAL(20, 8) NULL,
+    requested_qty DECIMAL(20, 8) NULL,
+    filled_qty DECIMAL(20, 8) NULL,
+    fee DECIMAL(20, 8) NULL,
+    status VARCHAR(16) NOT NULL,
+    raw_response TEXT NULL,
+    created_at DATETIME NULL,
+    updated_at DATETIME NULL
+);
+
+-- 完整的交易所回應（壓縮過），只會 INSERT，超過保留天數由 purge_raw_responses_job 清掉
+CREATE TABLE IF NOT EXISTS user_trade_order_responses (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    user_trade_id BIGINT UNSIGNED NOT NULL,
+    type VARCHAR(8) NOT NULL,
+    exchange_order_id VARCHAR(64) NULL,
+    codec VARCHAR(8) NOT NULL,
+    body MEDIUMBLOB NOT NULL,
+    created_at DATETIME NOT NULL,
+    KEY idx_uto_responses_trade (user_trade_id, exchange_order_id),
+    KEY idx_uto_responses_created_at (created_at)
+);
@@ -0,0 +1,27 @@
+-- tick / 查單 / 對帳每次都會跑的查詢，照 WHERE 的等值欄位 → 範圍 / 排序欄位排
+-- InnoDB 的二級索引後面會自動帶主鍵 id，所以 ORDER BY id / MAX(id) 不用另外排序
+
+-- bot_service：WHERE b.strategy_id=? AND b.status='RUNNING'
+CREATE INDEX idx_bots_strategy_status ON bots (strategy_id, status);
+-- bot_service：WHERE b.status='RUNNING' 撈有 bot 的帳號（DISTINCT exchange_account_id 直接走索引，不回表）
+CREATE INDEX idx_bots_status_account ON bots (status, exchange_account_id);
+
+-- bot_service：exchanges → exchange_accounts 的 JOIN 從交易所那邊接過來時用
+CREATE INDEX idx_exchange_accounts_exchange ON exchange_accounts (exchange_id);
+
+-- strategy_service：WHERE strategy_id=? AND status='OPEN' ORDER BY created_at DESC LIMIT 1
+CREATE INDEX idx_strategy_trades_strategy_status ON strategy_trades (strategy_id, status, created_at);
+-- strategy_service / 策略：WHERE strategy_id IN (...) AND exit_at IS NULL ORDER BY id
+CREATE INDEX idx_strategy_trades_strategy_exit ON strategy_trades (strategy_id, exit_at);
+
+-- trade_service：WHERE bot_id=? AND status='OPEN' ORDER BY id DESC LIMIT 1、
+-- MAX(id) ... WHERE bot_id IN (...) AND status='OPEN' GROUP BY bot_id（只讀索引）
+CREATE INDEX idx_user_trades_bot_status ON user_trades (bot_id, status);
+
+-- trade_service：WHERE user_trade_id=? AND exchange_order_id=? ORDER BY id DESC LIMIT 1
+CREATE INDEX idx_uto_trade_order ON user_trade_orders (user_trade_id, exchange_order_id);
+-- trade_service / 對帳：開倉那筆的手續費 WHERE user_trade_id=? AND type='OPEN' ORDER BY id DESC LIMIT 1
+CREATE INDEX idx_uto_trade_type ON user_trade_orders (user_trade_id, type);
+-- 對帳 / 成交推播：WHERE exchange_order_id IN (...)、還沒結束的訂單 WHERE status NOT IN (...)
+CREATE INDEX idx_uto_exchange_order ON user_trade_orders (exchange_order_id);
+CREATE INDEX idx_uto_status ON user_trade_orders (status);
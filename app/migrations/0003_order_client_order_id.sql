@@ -0,0 +1,2 @@
+-- 下單結果不明（逾時 / 斷線）時還拿不到 exchange_order_id，先用 clientOrderId 記一筆 PENDING 的單，對帳時再查回來
+ALTER TABLE user_trade_orders ADD COLUMN client_order_id VARCHAR(32) NULL AFTER exchange_order_id;
@@ -0,0 +1,2 @@
+-- 成交推播：還沒有 exchange_order_id 的 PENDING 單用 WHERE exchange_order_id IN (...) OR client_order_id IN (...) 認
+CREATE INDEX idx_uto_client_order ON user_trade_orders (client_order_id);
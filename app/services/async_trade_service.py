@@ -0,0 +1,183 @@
+from app.exchange.exchange_factory import build_async_ccxt_client, warm_markets
+from app.services.trade_service import (
+    build_open_order,
+    record_open_order,
+    record_unconfirmed_open,
+    build_close_order,
+    record_close_order,
+    record_close_error,
+    record_unconfirmed_close,
+    close_bot_position,
+    close_order_id,
+)
+from app.services.order_submitter import OrderInFlight, client_order_id, submit_order_async
+from app.services.leverage_cache import invalidate_leverage, is_leverage_set, remember_leverage
+from app.logger import log_context
+from app.utils.lazy import LazyModule
+from app.utils.metrics import metrics
+import asyncio
+import os
+from app.config import load_config
+
+load_config()
+
+ccxt_errors = LazyModule("ccxt.base.errors")
+
+# 同時最多幾個 bot 在送單、每個交易所請求最多等幾秒
+ASYNC_MAX_CONCURRENCY = int(os.getenv("ASYNC_MAX_CONCURRENCY", 200))
+ASYNC_REQUEST_TIMEOUT = float(os.getenv("ASYNC_REQUEST_TIMEOUT", 10))
+
+
+def run_fan_out_async(action, contexts, signal, writer, open_trades=None):
+    """
+    用 ccxt.async_support 把所有 bot 的下單當 coroutine 一次丟出去（同步入口）
+    回傳 (success_count, fail_count, results)，跟 thread 版一樣的算法
+    """
+    return asyncio.run(_fan_out(action, contexts, signal, writer, open_trades or {}))
+
+
+async def _fan_out(action, contexts, signal, writer, open_trades):
+    semaphore = asyncio.Semaphore(ASYNC_MAX_CONCURRENCY)
+    clients = {}  # 同一個帳號的 bot 共用一個 async client
+
+    def get_client(context):
+        key = context["exchange_account_id"]
+        if key not in clients:
+            with metrics.span("client_build", context["exchange_code"]):
+                clients[key] = build_async_ccxt_client(
+                    context["exchange_code"], context["params"], exchange_account_id=key)
+        return clients[key]
+
+    # markets 在 thread 裡先載好，建 client 時直接掛上去，不會卡住 event loop
+    await asyncio.gather(
+        *(asyncio.to_thread(warm_markets, code) for code in {c["exchange_code"] for c in contexts}),
+        return_exceptions=True,
+    )
+
+    coroutines = []
+    for context in contexts:
+        if action == "OPEN":
+            coroutine = _open(context, signal, writer, get_client, semaphore)
+        else:
+            user_trade = open_trades.get(context["bot"]["id"])
+            coroutine = _close(context, user_trade, signal, writer, get_client, semaphore)
+        coroutines.append(_with_log_context(context, signal, coroutine))
+
+    try:
+        outcomes = await asyncio.gather(*coroutines, return_exceptions=True)
+    finally:
+        await asyncio.gather(*(client.close() for client in clients.values()), return_exceptions=True)
+
+    success_count = 0
+    fail_count = 0
+    results = []
+    for context, outcome in zip(contexts, outcomes):
+        if isinstance(outcome, BaseException):
+            print(f"[Bot {context['bot']['id']}] async 下單發生例外: {outcome}")
+            fail_count += 1
+        elif outcome:
+            success_count += 1
+            results.append(outcome)
+        else:
+            fail_count += 1
+
+    return success_count, fail_count, results
+
+
+async def _with_log_context(context, signal, coroutine):
+    # gather 會把每個 coroutine 包成 task（各自一份 context），這裡設的欄位只會帶到這個 bot 的 log
+    with log_context(
+        bot_id=context["bot"]["id"],
+        strategy_trade_id=signal.get("trade_id"),
+        exchange=context["exchange_code"],
+    ):
+        return await coroutine
+
+
+async def _call(stage, coroutine):
+    with metrics.span(stage):
+        return await asyncio.wait_for(coroutine, timeout=ASYNC_REQUEST_TIMEOUT)
+
+
+async def _open(context, signal, writer, get_client, semaphore):
+    bot = context["bot"]
+    bot_id = bot["id"]
+    order_request = build_open_order(context, signal)
+    if order_request is None:
+        return None
+
+    async with semaphore:
+        client = get_client(context)
+
+        # 設定槓桿（快取裡已經是同樣的槓桿 / 保證金模式就不用再打一次）
+        if not is_leverage_set(context):
+            try:
+                await _call("set_leverage", client.set_leverage(
+                    bot["leverage"],
+                    bot["exchange_symbol"],
+                    params={"marginMode": "isolated"},
+                ))
+            except (ccxt_errors.ExchangeError, asyncio.TimeoutError) as e:
+                print(f"[Bot {bot_id}] 設定槓桿失敗: {str(e) or type(e).__name__}")
+                invalidate_leverage(context)
+                return None
+            remember_leverage(context)
+
+        try:
+            with metrics.span("create_order"):
+                order = await submit_order_async(
+                    client, order_request, client_order_id(signal["trade_id"], bot_id, "OPEN"), context["exchange_code"])
+        except ccxt_errors.ExchangeError as e:
+            print(f"[Bot {bot_id}] 下單失敗: {str(e)}")
+            if invalidate_leverage(context, e):
+                print(f"[Bot {bot_id}] 看起來是槓桿 / 保證金設定問題，下次開倉會重新設定")
+            return None
+        except ccxt_errors.NetworkError as e:
+            print(f"[Bot {bot_id}] 下單沒有確認結果: {str(e)}")
+            return record_unconfirmed_open(context, signal, order_request, writer)
+        except OrderInFlight as e:
+            print(f"[Bot {bot_id}] {e}")
+            return None
+
+    metrics.observe_signal_to_order(signal)
+    print(f"[Bot {bot_id}] 交易所回應：", order)
+
+    return record_open_order(context, signal, order_request, order, writer)
+
+
+async def _close(context, user_trade, signal, writer, get_client, semaphore):
+    bot_id = context["bot"]["id"]
+
+    if not user_trade:
+        print(f"[Bot {bot_id}] 沒有 OPEN 部位，略過平倉")
+        return None
+
+    if context["exchange_account_id"] != user_trade["exchange_account_id"]:
+        # 部位是用哪個帳號開的就用哪個帳號平，這種少見情況丟回同步版處理
+        return await asyncio.to_thread(
+            close_bot_position, bot_id, signal, None, user_trade, writer)
+
+    order_request = build_close_order(user_trade)
+
+    async with semaphore:
+        client = get_client(context)
+        try:
+            with metrics.span("create_order"):
+                order = await submit_order_async(
+                    client, order_request, close_order_id(user_trade), context["exchange_code"])
+        except ccxt_errors.ExchangeError as e:
+            print(f"[Bot {bot_id}] 平倉下單失敗：{str(e)}")
+            record_close_error(user_trade, e, writer)
+            return None
+        except ccxt_errors.NetworkError as e:
+            # 逾時不代表交易所沒收到，不標 ERROR，先用 clientOrderId 記一筆 PENDING 留給查單處理
+            print(f"[Bot {bot_id}] 平倉下單沒有確認結果：{str(e)}")
+            return record_unconfirmed_close(user_trade, signal, order_request, writer)
+        except OrderInFlight as e:
+            print(f"[Bot {bot_id}] {e}")
+            return None
+
+    metrics.observe_signal_to_order(signal)
+    print(f"[Bot {bot_id}] 平倉下單交易所回應：", order)
+
+    return record_close_order(user_trade, signal, order_request, order, writer)
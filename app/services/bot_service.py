@@ -1,9 +1,188 @@
-from app.utils.db import get_db, query_all
+from app.utils.db import get_db, query_all, query_one
+from app.utils.metrics import metrics
+from app.utils.redis_client import redis_conn
+import json
+import os
+import threading
+import time
+from app.config import load_config
+
+load_config()
+
+# bot 執行上下文快取多久（秒）：只要撐過預熱 → 收盤 tick → shard 這一分鐘，
+# bot 的寫入都在本 repo 外（後台），沒 publish 失效通知時最多舊這麼久（0 = 每次都查 DB）
+BOT_CONTEXT_CACHE_TTL = int(os.getenv("BOT_CONTEXT_CACHE_TTL", 30))
+
+# 後台改了 bots / exchange_accounts 之後 publish 到這個 channel，所有 process 的快取都會清掉
+BOT_CONTEXT_CHANNEL = "strade:bot_context:invalidate"
+
+# 一次 JOIN 把 bot、帳號金鑰、交易所代碼撈出來
+BOT_CONTEXT_SQL = """
+    SELECT b.*,
+           ea.params AS _account_params,
+           e.code AS _exchange_code
+    FROM bots b
+    JOIN exchange_accounts ea ON ea.id = b.exchange_account_id
+    JOIN exchanges e ON e.id = ea.exchange_id
+"""
+
+_cache = {}  # strategy_id -> (loaded_at, [context])
+_cache_lock = threading.Lock()
+_listener = None
+_listener_pid = None
+
 
 def get_bots_for_strategy(strategy_id: int):
-    with get_db() as db:
-        bots = query_all(db, """
-            SELECT * FROM bots
-            WHERE strategy_id=%s AND status='RUNNING'
+    return [context["bot"] for context in get_bot_contexts_for_strategy(strategy_id)]
+
+
+def get_bot_contexts_for_strategy(strategy_id: int):
+    """
+    撈出策略底下所有 RUNNING 的 bot 執行上下文（一次查詢，有快取）
+    context = {
+        "bot": bots 那一列,
+        "exchange_account_id": ...,
+        "params": 解開後的 exchange_accounts.params,
+        "exchange_code": exchanges.code,
+    }
+    """
+    _ensure_listener()
+
+    with _cache_lock:
+        cached = _cache.get(strategy_id)
+        if cached and time.monotonic() - cached[0] < BOT_CONTEXT_CACHE_TTL:
+            return cached[1]
+
+    with metrics.span("db_read"), get_db() as db:
+        rows = query_all(db, BOT_CONTEXT_SQL + """
+            WHERE b.strategy_id=%s AND b.status='RUNNING'
         """, (strategy_id,))
-    return bots
+
+    contexts = [_to_context(row) for row in rows]
+
+    with _cache_lock:
+        _cache[strategy_id] = (time.monotonic(), contexts)
+
+    return contexts
+
+
+def get_bot_context(bot_id: int):
+    """單一 bot 的執行上下文（不分狀態，不走快取）"""
+    with metrics.span("db_read"), get_db() as db:
+        row = query_one(db, BOT_CONTEXT_SQL + " WHERE b.id=%s", (bot_id,))
+    return _to_context(row) if row else None
+
+
+def get_account_context(exchange_account_id: int):
+    """只有帳號 + 交易所的上下文（查單 / 平倉時帳號可能跟 bot 現在的不同）"""
+    return get_account_contexts([exchange_account_id]).get(exchange_account_id)
+
+
+def get_account_contexts(exchange_account_ids):
+    """一次查多個帳號的上下文，回傳 {exchange_account_id: context}"""
+    if not exchange_account_ids:
+        return {}
+
+    placeholders = ", ".join(["%s"] * len(exchange_account_ids))
+    with metrics.span("db_read"), get_db() as db:
+        rows = query_all(db, f"""
+            SELECT ea.id, ea.params, e.code AS exchange_code
+            FROM exchange_accounts ea
+            JOIN exchanges e ON e.id = ea.exchange_id
+            WHERE ea.id IN ({placeholders})
+        """, tuple(exchange_account_ids))
+
+    return {row["id"]: _to_account_context(row) for row in rows}
+
+
+def get_active_account_contexts():
+    """底下有 RUNNING bot 的交易所帳號，回傳 {exchange_account_id: context}"""
+    with get_db() as db:
+        rows = query_all(db, """
+            SELECT DISTINCT ea.id, ea.params, e.code AS exchange_code
+            FROM bots b
+            JOIN exchange_accounts ea ON ea.id = b.exchange_account_id
+            JOIN exchanges e ON e.id = ea.exchange_id
+            WHERE b.status='RUNNING'
+        """)
+
+    return {row["id"]: _to_account_context(row) for row in rows}
+
+
+def invalidate_bot_contexts(strategy_id=None):
+    """清掉這個 process 的快取；不帶參數就全部清掉"""
+    with _cache_lock:
+        if strategy_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(strategy_id, None)
+
+
+def notify_bot_context_changed(strategy_id=None):
+    """bots / exchange_accounts 有異動時呼叫，通知所有 process 清快取"""
+    invalidate_bot_contexts(strategy_id)
+    payload = "" if strategy_id is None else str(strategy_id)
+    redis_conn.publish(BOT_CONTEXT_CHANNEL, payload)
+
+
+def _to_context(row):
+    row = dict(row)
+    params = row.pop("_account_params")
+    exchange_code = row.pop("_exchange_code")
+    return {
+        "bot": row,
+        "exchange_account_id": row["exchange_account_id"],
+        "params": json.loads(params) if isinstance(params, str) else params,
+        "exchange_code": exchange_code,
+    }
+
+
+def _to_account_context(row):
+    return {
+        "bot": None,
+        "exchange_account_id": row["id"],
+        "params": json.loads(row["params"]),
+        "exchange_code": row["exchange_code"],
+    }
+
+
+def _on_invalidate(message):
+    data = message.get("data") or b""
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    try:
+        strategy_id = int(data) if data else None
+    except ValueError:
+        # 格式不對就全部清掉；例外丟出去會弄死 run_in_thread 的 listener
+        print(f"[BotContext] 看不懂的失效通知 {data!r}，全部清掉")
+        strategy_id = None
+    print(f"[BotContext] 收到快取失效通知 strategy_id={strategy_id or 'ALL'}")
+    invalidate_bot_contexts(strategy_id)
+
+
+def _on_listener_error(error, pubsub, thread):
+    # 預設會直接結束 thread，之後就只剩 TTL；印出來，下一輪繼續收
+    print(f"[BotContext] 收失效通知出錯：{error}")
+    time.sleep(1)
+
+
+def _ensure_listener():
+    """每個 process 背景訂閱一次失效通知（Redis 連不上就只靠 TTL）"""
+    global _listener, _listener_pid
+    pid = os.getpid()
+    if _listener is not None and _listener_pid == pid:
+        return
+
+    with _cache_lock:
+        if _listener is not None and _listener_pid == pid:
+            return
+        if _listener_pid != pid:
+            _cache.clear()
+        try:
+            pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{BOT_CONTEXT_CHANNEL: _on_invalidate})
+            _listener = pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=_on_listener_error)
+        except Exception as e:
+            print(f"[BotContext] 訂閱快取失效通知失敗，只靠 TTL={BOT_CONTEXT_CACHE_TTL}s：{e}")
+            _listener = False
+        _listener_pid = pid
@@ -0,0 +1,192 @@
+from app.exchange.exchange_factory import get_public_ccxt_client
+from app.utils.redis_client import redis_conn
+from app.utils.lazy import LazyModule
+import json
+import os
+import re
+import threading
+from app.config import load_config
+
+load_config()
+
+# redis（scheduler / worker 共用）/ memory（只存在目前 process）
+CANDLE_STORE_BACKEND = os.getenv("CANDLE_STORE_BACKEND", "redis")
+
+# 每個 (交易所, symbol, timeframe) 最多留幾根 K 線
+CANDLE_STORE_MAX_BARS = int(os.getenv("CANDLE_STORE_MAX_BARS", 5000))
+
+# 每次 fetch_ohlcv 最多要幾根（交易所單次上限，超過就分頁）
+CANDLE_FETCH_LIMIT = int(os.getenv("CANDLE_FETCH_LIMIT", 1000))
+
+CANDLE_COLUMNS = ["timestamp", "open", "high", "low", "close", "volume"]
+
+# 只有真的要組 DataFrame 時才載入 pandas（下單的 worker job 用不到）
+pd = LazyModule("pandas")
+
+TIMEFRAME_UNITS_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "M": 2592000, "y": 31536000}
+
+
+class RedisCandleBackend:
+    """
+    一個 key 一個 sorted set：score = K 線開盤時間（ms），member = json [ts, o, h, l, c, v]
+    """
+
+    def __init__(self, conn=redis_conn, prefix="strade:candles"):
+        self.conn = conn
+        self.prefix = prefix
+
+    def key(self, exchange_code, symbol, timeframe):
+        return f"{self.prefix}:{exchange_code}:{symbol}:{timeframe}"
+
+    def load(self, key, count):
+        """最新的 count 根，由舊到新"""
+        return [json.loads(member) for member in self.conn.zrange(key, -count, -1)]
+
+    def save(self, key, candles, max_bars):
+        if not candles:
+            return
+        pipe = self.conn.pipeline(transaction=True)
+        for candle in candles:
+            # 同一根 K 線（通常是還沒收完的最後一根）先刪再寫
+            pipe.zremrangebyscore(key, candle[0], candle[0])
+        pipe.zadd(key, {json.dumps(candle): candle[0] for candle in candles})
+        pipe.zremrangebyrank(key, 0, -max_bars - 1)
+        pipe.execute()
+
+
+class MemoryCandleBackend:
+    """存在 process 記憶體裡（scheduler 常駐時可用，也方便測試）"""
+
+    def __init__(self):
+        self._data = {}  # key -> {ts: candle}
+        self._lock = threading.Lock()
+
+    def key(self, exchange_code, symbol, timeframe):
+        return (exchange_code, symbol, timeframe)
+
+    def load(self, key, count):
+        with self._lock:
+            candles = self._data.get(key, {})
+            return [candles[ts] for ts in sorted(candles)[-count:]]
+
+    def save(self, key, candles, max_bars):
+        with self._lock:
+            stored = self._data.setdefault(key, {})
+            for candle in candles:
+                stored[candle[0]] = list(candle)
+            for ts in sorted(stored)[:-max_bars]:
+                del stored[ts]
+
+
+CANDLE_BACKENDS = {
+    "redis": RedisCandleBackend,
+    "memory": MemoryCandleBackend,
+}
+
+
+class CandleStore:
+    """
+    依 (交易所, symbol, timeframe) 快取 K 線
+    - 第一次（或要的根數比存的多）才抓完整歷史
+    - 之後只抓最後一根之後的 K 線（最後一根可能還沒收完，會一起重抓覆蓋）
+    - 視窗裡有缺的時間段會補抓
+    """
+
+    def __init__(self, backend, max_bars=CANDLE_STORE_MAX_BARS, fetch_limit=CANDLE_FETCH_LIMIT):
+        self.backend = backend
+        self.max_bars = max_bars
+        self.fetch_limit = fetch_limit
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._unfillable = set()  # 交易所本來就沒資料的缺口，同一個 process 只補一次
+
+    def get_window(self, exchange_code, symbol, timeframe, bars, client=None):
+        """最新 bars 根 K 線的 DataFrame（含還沒收完的最後一根），欄位跟原本 run_strategy 的一樣"""
+        return candles_to_dataframe(self.get_candles(exchange_code, symbol, timeframe, bars, client))
+
+    def get_candles(self, exchange_code, symbol, timeframe, bars, client=None):
+        bars = min(bars, self.max_bars)
+        client = client or get_public_ccxt_client(exchange_code)
+        key = self.backend.key(exchange_code, symbol, timeframe)
+        timeframe_ms = timeframe_to_ms(timeframe)
+
+        with self._lock_for(key):
+            stored = self.backend.load(key, bars)
+
+            if len(stored) < bars:
+                since = _floor(client.milliseconds(), timeframe_ms) - (bars - 1) * timeframe_ms
+                print(f"[CandleStore] {exchange_code} {symbol} {timeframe} 快取只有 {len(stored)} 根，抓 {bars} 根歷史")
+            else:
+                since = stored[-1][0]
+
+            fetched = fetch_ohlcv_range(client, symbol, timeframe, since, limit=self.fetch_limit)
+            self.backend.save(key, fetched, self.max_bars)
+
+            candles = self.backend.load(key, bars)
+            repaired = self._repair_gaps(client, key, symbol, timeframe, timeframe_ms, candles)
+            if repaired:
+                self.backend.save(key, repaired, self.max_bars)
+                candles = self.backend.load(key, bars)
+
+        return candles
+
+    def _repair_gaps(self, client, key, symbol, timeframe, timeframe_ms, candles):
+        repaired = []
+        for prev, current in zip(candles, candles[1:]):
+            gap_start = prev[0] + timeframe_ms
+            if current[0] <= gap_start or (key, gap_start) in self._unfillable:
+                continue
+
+            missing = (current[0] - gap_start) // timeframe_ms
+            print(f"[CandleStore] {symbol} {timeframe} 缺 {missing} 根（{gap_start} ~ {current[0]}），補抓")
+            batch = fetch_ohlcv_range(
+                client, symbol, timeframe, gap_start, until=current[0], limit=self.fetch_limit)
+            if len(batch) < missing:
+                # 交易所維護等原因真的沒有資料，不要每個 tick 都重抓
+                self._unfillable.add((key, gap_start))
+            repaired.extend(batch)
+        return repaired
+
+    def _lock_for(self, key):
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+
+def fetch_ohlcv_range(client, symbol, timeframe, since, until=None, limit=CANDLE_FETCH_LIMIT):
+    """從 since（ms）開始分頁抓到最新（或 until 之前），回傳 [[ts, o, h, l, c, v], ...]"""
+    timeframe_ms = timeframe_to_ms(timeframe)
+    candles = []
+    while True:
+        batch = client.fetch_ohlcv(symbol, timeframe=timeframe, since=since, limit=limit)
+        batch = [c for c in batch if c[0] >= since and (until is None or c[0] < until)]
+        if not batch:
+            break
+        candles.extend(batch)
+        next_since = batch[-1][0] + timeframe_ms
+        if len(batch) < limit or next_since <= since or (until is not None and next_since >= until):
+            break
+        since = next_since
+    return candles
+
+
+def candles_to_dataframe(candles):
+    df = pd.DataFrame(candles, columns=CANDLE_COLUMNS)
+
+    # 把 timestamp 轉成可讀時間（UTC），排序由舊到新
+    df["timestamp"] = pd.to_datetime(df["timestamp"], unit="ms")
+    return df.sort_values("timestamp").reset_index(drop=True)
+
+
+def timeframe_to_ms(timeframe):
+    """1m / 15m / 1h / 4h / 1d ... 換成毫秒（算法跟 ccxt 的 parse_timeframe 一樣，不用為了這個載入 ccxt）"""
+    match = re.fullmatch(r"(\d+)([smhdwMy])", timeframe)
+    if not match:
+        raise Exception(f"不支援的 timeframe: {timeframe}")
+    return int(match.group(1)) * TIMEFRAME_UNITS_SECONDS[match.group(2)] * 1000
+
+
+def _floor(ms, timeframe_ms):
+    return ms - ms % timeframe_ms
+
+
+candle_store = CandleStore(CANDLE_BACKENDS[CANDLE_STORE_BACKEND]())
@@ -0,0 +1,143 @@
+from app.services.bot_service import get_active_account_contexts
+from app.services.reconcile_service import get_pending_orders, order_row_to_user_trade
+from app.services.trade_service import apply_order_update
+from app.services.trade_writer import TradeWriter
+from collections import defaultdict
+import os
+import queue
+import threading
+import time
+from app.config import load_config
+
+load_config()
+
+# 推播比 DB 寫入還快時（write-behind 還沒 flush），找不到訂單的事件先留著重試幾秒
+FILL_EVENT_UNMATCHED_TTL = float(os.getenv("FILL_EVENT_UNMATCHED_TTL", 30))
+FILL_EVENT_RETRY_INTERVAL = float(os.getenv("FILL_EVENT_RETRY_INTERVAL", 1))
+
+
+class FillEventService:
+    """
+    把推播來源（FillEventSource）送來的訂單更新寫回 DB
+    - 來源的 callback 只把事件丟進 queue，不在 websocket 的 event loop 裡碰 DB
+    - 背景 thread 一次撈一批：同一個帳號的訂單一次查 DB，再交給 apply_order_update（跟查單 / 對帳同一套邏輯）
+    - 寫入走 TradeWriter 批次 flush
+    """
+
+    def __init__(self, source, writer=None):
+        self.source = source
+        self.writer = writer or TradeWriter()
+        self.received = 0
+        self.applied = 0
+        self.dropped = 0
+        self._queue = queue.Queue()
+        self._unmatched = {}  # (exchange_account_id, order_id) -> (order, first_seen)
+        self._process_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, background=True):
+        self.source.start(self._on_order)
+        if background:
+            self._thread = threading.Thread(target=self._run, name="fill-event-service", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self.source.stop()
+        self.process_pending()
+        self.writer.close()
+
+    def sync_accounts(self):
+        """監聽所有底下有 RUNNING bot 的帳號，沒有 bot 的帳號就停掉"""
+        contexts = get_active_account_contexts()
+        for account_id in self.source.watched_accounts() - set(contexts):
+            self.source.unwatch_account(account_id)
+        for context in contexts.values():
+            self.source.watch_account(context)
+        return len(contexts)
+
+    def process_pending(self):
+        """同步處理目前 queue 裡的事件並寫進 DB（測試 / 關閉時用）"""
+        events = []
+        while True:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._process(events, retry_all=True)
+        self.writer.flush()
+
+    def _on_order(self, exchange_account_id, order):
+        self.received += 1
+        self._queue.put((exchange_account_id, order))
+
+    def _run(self):
+        while not self._stopped.is_set():
+            events = []
+            try:
+                events.append(self._queue.get(timeout=FILL_EVENT_RETRY_INTERVAL))
+                while True:
+                    events.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            try:
+                self._process(events)
+            except Exception as e:
+                print(f"[FillEvent] 處理推播事件失敗：{e}")
+
+    def _process(self, events, retry_all=False):
+        with self._process_lock:
+            # 同一張單只留最新的一筆事件
+            latest = {}
+            for account_id, order in events:
+                latest[(account_id, str(order.get("id")))] = (order, time.monotonic())
+
+            now = time.monotonic()
+            for key, (order, first_seen) in list(self._unmatched.items()):
+                if key in latest:
+                    latest[key] = (latest[key][0], first_seen)
+                elif retry_all or now - first_seen >= FILL_EVENT_RETRY_INTERVAL:
+                    latest[key] = (order, first_seen)
+                else:
+                    continue  # 還沒到重試時間，留著等下一輪
+                del self._unmatched[key]
+
+            if not latest:
+                return
+
+            by_account = defaultdict(dict)
+            for (account_id, order_id), item in latest.items():
+                by_account[account_id][order_id] = item
+
+            for account_id, items in by_account.items():
+                client_order_ids = {
+                    order["clientOrderId"] for order, _ in items.values() if order.get("clientOrderId")}
+                rows = get_pending_orders(
+                    exchange_account_id=account_id, exchange_order_ids=list(items),
+                    client_order_ids=list(client_order_ids))
+                rows_by_order_id = {str(row["exchange_order_id"]): row for row in rows if row["exchange_order_id"]}
+                # 下單結果不明、還沒有 exchange_order_id 的單用 clientOrderId 認（apply_order_update 會補上 exchange_order_id）
+                rows_by_client_id = {
+                    row["client_order_id"]: row for row in rows
+                    if row["client_order_id"] and not row["exchange_order_id"]}
+
+                for order_id, (order, first_seen) in items.items():
+                    row = rows_by_order_id.get(order_id) or rows_by_client_id.get(order.get("clientOrderId"))
+                    if row is None:
+                        if now - first_seen < FILL_EVENT_UNMATCHED_TTL:
+                            self._unmatched[(account_id, order_id)] = (order, first_seen)
+                        else:
+                            # 不是 bot 下的單，或對帳已經處理完了
+                            self.dropped += 1
+                        continue
+
+                    print(f"[FillEvent] 帳號 {account_id} 訂單 {order_id} 狀態 {order.get('status')}")
+                    apply_order_update(
+                        order_row_to_user_trade(row), row, order, self.writer,
+                        open_order_fee=row["open_order_fee"] or 0,
+                    )
+                    self.applied += 1
@@ -0,0 +1,119 @@
+from app.utils.redis_client import redis_conn
+from app.utils.lazy import LazyModule
+from contextlib import contextmanager
+import contextvars
+import os
+import re
+from app.config import load_config
+
+load_config()
+
+ccxt_errors = LazyModule("ccxt.base.errors")
+
+# 交易所確認過的槓桿 / 保證金模式記多久（秒），0 = 不快取（每次開倉都 set_leverage）
+LEVERAGE_CACHE_TTL = int(os.getenv("LEVERAGE_CACHE_TTL", 86400))
+
+# 下單錯誤訊息符合這個就當作槓桿 / 保證金設定跑掉了，清掉快取讓下次重設
+# 不要只寫 margin：binance -2019 "Margin is insufficient." 這種餘額不足也會中
+LEVERAGE_ERROR_PATTERN = re.compile(
+    os.getenv("LEVERAGE_ERROR_PATTERN", r"leverage|\blever\b|margin[ _]?(mode|type)|isolated"), re.IGNORECASE)
+
+KEY_PREFIX = "strade:leverage"
+
+# tick 開始時一次 MGET 全部 bot 的狀態，fan-out 的 thread / coroutine 直接查這份
+_prefetched = contextvars.ContextVar("leverage_prefetched", default=None)
+
+
+def _key(exchange_account_id, symbol):
+    return f"{KEY_PREFIX}:{exchange_account_id}:{symbol}"
+
+
+def _state(leverage, margin_mode):
+    return f"{int(leverage)}:{margin_mode}"
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+@contextmanager
+def prefetch_leverage(contexts):
+    """
+    with prefetch_leverage(targets):
+        fan-out...
+    這個區塊裡 is_leverage_set 不用再打 Redis（Redis 掛了就當全部沒快取，照舊 set_leverage）
+    """
+    keys = list({(c["exchange_account_id"], c["bot"]["exchange_symbol"]) for c in contexts})
+    states = {}
+    if LEVERAGE_CACHE_TTL and keys:
+        try:
+            values = redis_conn.mget([_key(*key) for key in keys])
+            states = {key: _decode(value) for key, value in zip(keys, values)}
+        except Exception as e:
+            print(f"[Leverage] 讀取槓桿快取失敗，這個 tick 全部重設：{e}")
+
+    token = _prefetched.set(states)
+    try:
+        yield states
+    finally:
+        _prefetched.reset(token)
+
+
+def is_leverage_set(context, margin_mode="isolated"):
+    """這個 bot 的帳號 + symbol 是否已經確認是 bot 設定的槓桿 / 保證金模式"""
+    if not LEVERAGE_CACHE_TTL:
+        return False
+
+    bot = context["bot"]
+    key = (context["exchange_account_id"], bot["exchange_symbol"])
+    prefetched = _prefetched.get()
+    if prefetched is not None:
+        current = prefetched.get(key)
+    else:
+        try:
+            current = _decode(redis_conn.get(_key(*key)))
+        except Exception:
+            return False
+    return current == _state(bot["leverage"], margin_mode)
+
+
+def remember_leverage(context, margin_mode="isolated"):
+    """set_leverage 成功後記下來（所有 worker 共用）"""
+    if not LEVERAGE_CACHE_TTL:
+        return
+    bot = context["bot"]
+    key = (context["exchange_account_id"], bot["exchange_symbol"])
+    state = _state(bot["leverage"], margin_mode)
+    try:
+        redis_conn.set(_key(*key), state, ex=LEVERAGE_CACHE_TTL)
+    except Exception as e:
+        print(f"[Leverage] 寫入槓桿快取失敗：{e}")
+        return
+
+    prefetched = _prefetched.get()
+    if prefetched is not None:
+        prefetched[key] = state
+
+
+def invalidate_leverage(context, error=None):
+    """
+    清掉快取，下次開倉會重新 set_leverage
+    有帶 error 時只有槓桿 / 保證金相關的錯誤才清（餘額不足之類的不用）
+    """
+    if not LEVERAGE_CACHE_TTL:
+        return False
+    if error is not None:
+        # ccxt 已經歸類成餘額不足的就不用看訊息了
+        if isinstance(error, ccxt_errors.InsufficientFunds) or not LEVERAGE_ERROR_PATTERN.search(str(error)):
+            return False
+
+    key = (context["exchange_account_id"], context["bot"]["exchange_symbol"])
+    try:
+        redis_conn.delete(_key(*key))
+    except Exception as e:
+        print(f"[Leverage] 清除槓桿快取失敗：{e}")
+
+    prefetched = _prefetched.get()
+    if prefetched is not None:
+        prefetched.pop(key, None)
+    return True
@@ -0,0 +1,426 @@
+from app.utils.lazy import LazyModule
+from app.utils.metrics import metrics
+from app.utils.redis_client import redis_conn
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import asyncio
+import contextvars
+import os
+import re
+import threading
+import time
+from app.config import load_config
+
+load_config()
+
+ccxt_errors = LazyModule("ccxt.base.errors")
+
+# 一張單從送出到放棄最多等幾秒（時間到會再用 clientOrderId 查一次交易所才算失敗）
+ORDER_DEADLINE_SECONDS = float(os.getenv("ORDER_DEADLINE_SECONDS", 10))
+
+# 第一個請求還沒回就可以補送的交易所（逗號分隔，預設沒有）：超過 p95 查一次 clientOrderId，沒有這張單才補送
+# 只能列「clientOrderId 重複就擋，不管前一張成交了沒」的交易所；binance 只擋還掛著的單，市價單成交後再送一次就是第二張
+ORDER_HEDGE_EXCHANGES = {code.strip() for code in os.getenv("ORDER_HEDGE_EXCHANGES", "").split(",") if code.strip()}
+
+# 樣本不夠算 p95 時用這個（ms）；p95 再小也至少等這麼久（ms）
+ORDER_HEDGE_AFTER_MS = float(os.getenv("ORDER_HEDGE_AFTER_MS", 1500))
+ORDER_HEDGE_MIN_MS = float(os.getenv("ORDER_HEDGE_MIN_MS", 200))
+ORDER_HEDGE_MIN_SAMPLES = 20
+ORDER_LATENCY_WINDOW = 500
+
+# 同一個 clientOrderId 在 Redis 佔著多久（秒），這段時間內其他 worker / 重跑的 job 不會再送
+ORDER_INFLIGHT_TTL = int(os.getenv("ORDER_INFLIGHT_TTL", 3600))
+
+# clientOrderId 開頭（okx 只收英數、最多 32 字，所以不用符號）
+CLIENT_ORDER_ID_PREFIX = os.getenv("CLIENT_ORDER_ID_PREFIX", "sb")
+
+# 下單錯誤訊息符合這個 = 交易所已經有同一個 clientOrderId 的單（另一個請求先到了）
+ORDER_DUPLICATE_ERROR_PATTERN = re.compile(
+    os.getenv("ORDER_DUPLICATE_ERROR_PATTERN", r"duplicat|already exist|clientOrderId.*(used|exist)"), re.IGNORECASE)
+
+# 送單的網路錯誤（或 ccxt 包住的原始例外）符合這個 = 連線根本沒建起來，請求確定沒到交易所，可以補送
+ORDER_UNSENT_ERROR_PATTERN = re.compile(
+    os.getenv(
+        "ORDER_UNSENT_ERROR_PATTERN",
+        r"ConnectTimeout|NewConnectionError|ClientConnectorError|gaierror|Connection refused"
+        r"|Name or service not known|Temporary failure in name resolution"),
+    re.IGNORECASE)
+
+# 送單的 thread（bot 的 thread 只負責等，才能在 p95 之後補送）
+ORDER_SUBMIT_THREADS = int(os.getenv("ORDER_SUBMIT_THREADS", 50))
+
+# 同一個帳號有多個 bot 時用 create_orders 一次送（交易所有支援才會用）
+BATCH_ORDERS_ENABLED = bool(int(os.getenv("BATCH_ORDERS_ENABLED", 1)))
+
+# 各交易所一次 batch 最多幾張，沒列的用 BATCH_ORDER_DEFAULT_LIMIT
+BATCH_ORDER_LIMITS = {"binance": 5, "binanceusdm": 5, "bybit": 10, "okx": 20, "bitget": 20}
+BATCH_ORDER_DEFAULT_LIMIT = int(os.getenv("BATCH_ORDER_DEFAULT_LIMIT", 5))
+
+KEY_PREFIX = "strade:order"
+
+
+class OrderInFlight(Exception):
+    """同一個 clientOrderId 已經有別的 worker 送過 / 正在送（下單結果由它記錄）"""
+
+
+_pool = ThreadPoolExecutor(max_workers=ORDER_SUBMIT_THREADS, thread_name_prefix="order-submit")
+_latencies = {}  # exchange_code -> 最近幾次下單成功的耗時（秒）
+_latencies_lock = threading.Lock()
+
+
+def client_order_id(strategy_trade_id, bot_id, order_type):
+    """
+    同一個策略單 + bot + OPEN / CLOSE 永遠是同一個 id，重送 / 重跑 job 交易所都認得出是同一張
+    ex: sb1234b56o
+    """
+    return f"{CLIENT_ORDER_ID_PREFIX}{strategy_trade_id}b{bot_id}{'o' if order_type == 'OPEN' else 'c'}"
+
+
+def hedge_delay(exchange_code):
+    """這個交易所最近下單耗時的 p95（秒），樣本不夠用 ORDER_HEDGE_AFTER_MS"""
+    with _latencies_lock:
+        samples = sorted(_latencies.get(exchange_code, ()))
+    if len(samples) < ORDER_HEDGE_MIN_SAMPLES:
+        return ORDER_HEDGE_AFTER_MS / 1000
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return max(p95, ORDER_HEDGE_MIN_MS / 1000)
+
+
+def submit_order(client, order_request, order_id, exchange_code):
+    """
+    用 clientOrderId 送 create_order（同步 client）：
+    - Redis 先佔住 clientOrderId，別的 worker 已經在送 / 送過就丟 OrderInFlight（不送也不記錄）
+    - 第一個請求確定沒送到交易所（被限流、連線沒建起來）：用 clientOrderId 查交易所，真的沒有才補送一次
+    - 請求還沒回、逾時、連線中途斷掉都不補送（交易所可能已經收到，binance 這類成交後不擋重複 clientOrderId 的會變兩張單）；
+      只有 ORDER_HEDGE_EXCHANGES 裡的交易所才會在超過 p95 時查單 / 補送
+    - ORDER_DEADLINE_SECONDS 到了（或結果不明的錯誤回來）最後再查一次，還是沒有就丟 RequestTimeout
+    交易所明確拒絕（ExchangeError）照樣丟出去
+    """
+    _claim(order_id)
+    return _submit_claimed(client, order_request, order_id, exchange_code)
+
+
+def _submit_claimed(client, order_request, order_id, exchange_code):
+    request = _with_client_order_id(order_request, order_id)
+    started = time.monotonic()
+    deadline = started + ORDER_DEADLINE_SECONDS
+    hedge_ok = exchange_code in ORDER_HEDGE_EXCHANGES
+    hedge_at = started + hedge_delay(exchange_code) if hedge_ok else deadline
+    pending = {_send(client, request, exchange_code)}
+    spare = True
+    error = None
+
+    while True:
+        if pending:
+            wait_until = min(hedge_at, deadline) if spare else deadline
+            done, pending = wait(pending, timeout=max(0.0, wait_until - time.monotonic()), return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return _finish(order_id, future.result(), pending)
+                except Exception as e:
+                    error = e
+            if _is_rejection(error) and not pending:
+                _release(order_id)
+                raise error
+
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        if pending:
+            if not spare or now < hedge_at:
+                continue
+        elif not (spare and (hedge_ok or _never_sent(error))):
+            # 結果不明（逾時、連線中途斷掉）：交易所可能已經收到，不補送
+            break
+
+        # 確定沒送到 / 會擋重複 clientOrderId 的交易所過了 p95：交易所有這張單就直接用，確定沒有才補送
+        spare = False
+        try:
+            order = _lookup(client, request, order_id)
+        except Exception as e:
+            print(f"[Order] {order_id} 查不到交易所狀態，不補送：{e}")
+            continue
+        if order is not None:
+            return _finish(order_id, order, pending)
+        print(f"[Order] {order_id} {(now - started) * 1000:.0f} ms 還沒有結果，補送一次")
+        metrics.observe_stage("order_hedge", now - started, exchange_code)
+        pending.add(_send(client, request, exchange_code))
+
+    try:
+        order = _lookup(client, request, order_id)
+    except Exception:
+        order = None
+    if order is not None:
+        return _finish(order_id, order, pending)
+    if _is_rejection(error):
+        _release(order_id)
+        raise error
+    # 不知道交易所有沒有收到，clientOrderId 繼續佔著，之後重跑也不會再送
+    # 呼叫端會記一筆用 clientOrderId 認的 PENDING 單，對帳確定交易所沒有這張單才放掉（release_client_order_id）
+    raise ccxt_errors.RequestTimeout(f"{order_id} {ORDER_DEADLINE_SECONDS:.0f} 秒內沒有確認下單結果：{error or '逾時'}")
+
+
+def supports_batch_orders(client):
+    return BATCH_ORDERS_ENABLED and bool((getattr(client, "has", None) or {}).get("createOrders"))
+
+
+def submit_orders(client, items, exchange_code):
+    """
+    同一個帳號的多張單用 create_orders 一次送（items = [(order_request, clientOrderId), ...]）
+    回傳跟 items 對齊的 [order 或 Exception]，單張被拒只影響那一張
+    整批失敗的：交易所明確拒絕 / 確定沒送到就改成一張一張送；
+    不確定有沒有收到的只用 clientOrderId 查，查不到就回 RequestTimeout（記成 PENDING 等對帳），不補送
+    """
+    results = [None] * len(items)
+    todo = []
+    for i, (_, order_id) in enumerate(items):
+        try:
+            _claim(order_id)
+            todo.append(i)
+        except OrderInFlight as e:
+            results[i] = e
+
+    limit = BATCH_ORDER_LIMITS.get(exchange_code, BATCH_ORDER_DEFAULT_LIMIT)
+    fallback = []  # (index, 要不要先查單)
+    for chunk in [todo[j:j + limit] for j in range(0, len(todo), limit)]:
+        requests = [_with_client_order_id(*items[i]) for i in chunk]
+        try:
+            with metrics.span("create_orders", exchange_code):
+                orders = client.create_orders(requests)
+        except Exception as e:
+            print(f"[Order] {exchange_code} 批次下單失敗，{len(chunk)} 張改成一張一張送：{e}")
+            fallback.extend((i, not (_is_rejection(e) or _never_sent(e))) for i in chunk)
+            continue
+
+        for i, order in zip(chunk, orders):
+            order_id = items[i][1]
+            error = _batch_item_error(order)
+            if error is None:
+                results[i] = _finish(order_id, order)
+            elif ORDER_DUPLICATE_ERROR_PATTERN.search(error):
+                fallback.append((i, True))
+            else:
+                _release(order_id)
+                results[i] = ccxt_errors.ExchangeError(error)
+        # 交易所少回了幾張（不該發生）：不知道有沒有下，當作要先查單
+        fallback.extend((i, True) for i in chunk[len(orders):])
+
+    if fallback:
+        with ThreadPoolExecutor(max_workers=len(fallback)) as pool:
+            futures = {
+                i: pool.submit(contextvars.copy_context().run, _submit_single, client, items[i], exchange_code, lookup)
+                for i, lookup in fallback
+            }
+        for i, future in futures.items():
+            results[i] = future.result()
+    return results
+
+
+def _submit_single(client, item, exchange_code, lookup_first):
+    order_request, order_id = item
+    if lookup_first:
+        try:
+            order = _lookup(client, _with_client_order_id(order_request, order_id), order_id)
+        except Exception as e:
+            return ccxt_errors.RequestTimeout(f"{order_id} 批次下單結果不明、也查不到交易所狀態，不補送：{e}")
+        if order is not None:
+            return _finish(order_id, order)
+        if exchange_code not in ORDER_HEDGE_EXCHANGES:
+            # 那一批可能還在交易所處理中，再送一次可能變兩張單；clientOrderId 繼續佔著，交給對帳
+            return ccxt_errors.RequestTimeout(f"{order_id} 批次下單結果不明、交易所還查不到，不補送")
+    try:
+        return _submit_claimed(client, order_request, order_id, exchange_code)
+    except Exception as e:
+        return e
+
+
+def _batch_item_error(order):
+    """create_orders 回來的單張結果：成功回 None，被拒回錯誤訊息"""
+    if order.get("id") and (order.get("status") or "").lower() != "rejected":
+        return None
+    info = order.get("info") or {}
+    if isinstance(info, dict):
+        return str(info.get("msg") or info.get("sMsg") or info.get("errorMsg") or info.get("retMsg") or info)
+    return str(info)
+
+
+async def submit_order_async(client, order_request, order_id, exchange_code):
+    """submit_order 的 async client 版（async fan-out 用），規則一樣"""
+    request = _with_client_order_id(order_request, order_id)
+    _claim(order_id)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + ORDER_DEADLINE_SECONDS
+    hedge_ok = exchange_code in ORDER_HEDGE_EXCHANGES
+    hedge_at = started + hedge_delay(exchange_code) if hedge_ok else deadline
+    pending = {asyncio.ensure_future(_send_async(client, request, exchange_code))}
+    spare = True
+    error = None
+
+    try:
+        while True:
+            if pending:
+                wait_until = min(hedge_at, deadline) if spare else deadline
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, wait_until - loop.time()), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        return _finish(order_id, task.result())
+                    except Exception as e:
+                        error = e
+                if _is_rejection(error) and not pending:
+                    _release(order_id)
+                    raise error
+
+            now = loop.time()
+            if now >= deadline:
+                break
+            if pending:
+                if not spare or now < hedge_at:
+                    continue
+            elif not (spare and (hedge_ok or _never_sent(error))):
+                break
+
+            spare = False
+            try:
+                order = await _lookup_async(client, request, order_id)
+            except Exception as e:
+                print(f"[Order] {order_id} 查不到交易所狀態，不補送：{e}")
+                continue
+            if order is not None:
+                return _finish(order_id, order)
+            print(f"[Order] {order_id} {(now - started) * 1000:.0f} ms 還沒有結果，補送一次")
+            metrics.observe_stage("order_hedge", now - started, exchange_code)
+            pending.add(asyncio.ensure_future(_send_async(client, request, exchange_code)))
+
+        try:
+            order = await _lookup_async(client, request, order_id)
+        except Exception:
+            order = None
+        if order is not None:
+            return _finish(order_id, order)
+        if _is_rejection(error):
+            _release(order_id)
+            raise error
+        raise ccxt_errors.RequestTimeout(f"{order_id} {ORDER_DEADLINE_SECONDS:.0f} 秒內沒有確認下單結果：{error or '逾時'}")
+    finally:
+        # 還沒回的請求不用等：已經有結果的話另一個請求要嘛被擋、要嘛印 ⚠️；沒結果的交給對帳用 clientOrderId 查
+        for task in pending:
+            task.cancel()
+
+
+def _with_client_order_id(order_request, order_id):
+    # ccxt 會把 clientOrderId 轉成各交易所的欄位（newClientOrderId / clOrdId / clientOid / orderLinkId）
+    return {**order_request, "params": {**order_request.get("params", {}), "clientOrderId": order_id}}
+
+
+def _send(client, request, exchange_code):
+    started = time.monotonic()
+
+    def create():
+        order = client.create_order(**request)
+        _observe(exchange_code, time.monotonic() - started)
+        return order
+
+    return _pool.submit(contextvars.copy_context().run, create)
+
+
+async def _send_async(client, request, exchange_code):
+    started = time.monotonic()
+    order = await client.create_order(**request)
+    _observe(exchange_code, time.monotonic() - started)
+    return order
+
+
+def _observe(exchange_code, seconds):
+    with _latencies_lock:
+        window = _latencies.get(exchange_code)
+        if window is None:
+            window = _latencies[exchange_code] = deque(maxlen=ORDER_LATENCY_WINDOW)
+        window.append(seconds)
+
+
+def _lookup(client, request, order_id):
+    """用 clientOrderId 查交易所，沒有這張單回 None；查詢本身失敗（不知道有沒有）丟例外"""
+    try:
+        with metrics.span("order_lookup"):
+            return client.fetch_order(None, request["symbol"], params={"clientOrderId": order_id})
+    except ccxt_errors.OrderNotFound:
+        return None
+
+
+async def _lookup_async(client, request, order_id):
+    try:
+        with metrics.span("order_lookup"):
+            return await client.fetch_order(None, request["symbol"], params={"clientOrderId": order_id})
+    except ccxt_errors.OrderNotFound:
+        return None
+
+
+def _is_rejection(error):
+    """交易所明確拒絕（餘額不足、參數錯…）：不會有這張單，可以放掉 clientOrderId"""
+    return (
+        isinstance(error, ccxt_errors.ExchangeError)
+        and not ORDER_DUPLICATE_ERROR_PATTERN.search(str(error))
+    )
+
+
+def _never_sent(error):
+    """
+    送單失敗但請求確定沒到交易所（被限流擋下、連線根本沒建起來），補送不會變成兩張單
+    逾時、連線中途斷掉都不算：交易所可能已經收到
+    """
+    if isinstance(error, (ccxt_errors.RateLimitExceeded, ccxt_errors.DDoSProtection)):
+        return True
+    if not isinstance(error, ccxt_errors.NetworkError):
+        return False
+    # ccxt 的訊息只有 url，原始的 requests / aiohttp 例外在 __cause__
+    while error is not None:
+        if ORDER_UNSENT_ERROR_PATTERN.search(f"{type(error).__name__} {error}"):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def _finish(order_id, order, pending=()):
+    for future in pending:
+        # 還在跑的另一個請求（同步 client 沒辦法取消），回來的是別張單就大聲講
+        future.add_done_callback(lambda f, first=order: _check_duplicate(order_id, first, f))
+    try:
+        redis_conn.set(_key(order_id), f"done:{order.get('id')}", ex=ORDER_INFLIGHT_TTL)
+    except Exception as e:
+        print(f"[Order] 寫入 {order_id} 下單結果失敗：{e}")
+    return order
+
+
+def _check_duplicate(order_id, first, future):
+    if future.exception() is None and future.result().get("id") != first.get("id"):
+        print(f"[Order] ⚠️ {order_id} 交易所接受了兩張單：{first.get('id')} / {future.result().get('id')}，請人工確認")
+
+
+def _claim(order_id):
+    """Redis SET NX 佔住 clientOrderId；Redis 掛了就照送（交易所的 clientOrderId 還是會擋重複）"""
+    try:
+        claimed = redis_conn.set(_key(order_id), "pending", nx=True, ex=ORDER_INFLIGHT_TTL)
+    except Exception as e:
+        print(f"[Order] 登記 {order_id} 失敗，照常送單：{e}")
+        return
+    if not claimed:
+        raise OrderInFlight(f"{order_id} 已經送過或正在送，這次不送")
+
+
+def release_client_order_id(order_id):
+    """對帳確定交易所沒有這張單：放掉 clientOrderId，同一張單之後才送得出去"""
+    _release(order_id)
+
+
+def _release(order_id):
+    try:
+        redis_conn.delete(_key(order_id))
+    except Exception as e:
+        print(f"[Order] 清除 {order_id} 失敗：{e}")
+
+
+def _key(order_id):
+    return f"{KEY_PREFIX}:{order_id}"
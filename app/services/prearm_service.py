@@ -0,0 +1,142 @@
+from app.exchange.exchange_factory import get_ccxt_client, warm_markets
+from app.services.bot_service import get_bot_contexts_for_strategy
+from app.services.candle_store import candle_store
+from app.services.leverage_cache import is_leverage_set, prefetch_leverage
+from app.services.strategy_service import STRATEGY_CANDLE_BARS, STRATEGY_CANDLE_EXCHANGE
+from app.services.trade_service import ensure_leverage
+from app.worker_jobs import TICK_SHARD_SIZE
+from app.logger import log_context
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import os
+import time
+from app.config import load_config
+
+load_config()
+
+# 換 K 線前幾秒開始預熱（0 = 不預熱，全部在訊號出來後才做；最多 59 秒）
+PREARM_SECONDS = min(int(os.getenv("PREARM_SECONDS", 20)), 59)
+
+# 預熱時同時處理幾個帳號
+PREARM_THREADS = int(os.getenv("PREARM_THREADS", 10))
+
+
+def prearm_strategies(strategies):
+    """
+    K 線收盤前先把下單要用的東西準備好，訊號出來後只剩 create_order：
+    - bot 執行上下文（bot_service 快取）
+    - 每個帳號的 ccxt client（client 快取，markets 已掛上）+ 跟交易所對時（順便把 HTTPS 連線建好）
+    - 槓桿 / 保證金模式（有變的先 set_leverage，寫進槓桿快取）
+    - 策略要用的 K 線先補到最新（收盤後只差最後一根）
+    bot 多到會切 shard（TICK_SHARD_SIZE）的策略，單是在 RQ worker 每個 job fork 出來的 work horse 裡下的，
+    這裡建的 client / 對時到不了那邊，所以只做 Redis 裡共用的 markets 快取、槓桿快取和 K 線，不建 client
+    回傳統計
+    """
+    started = time.perf_counter()
+    contexts = []
+    accounts = {}
+    sharded_exchanges = set()
+    sharded = 0
+    for strategy in strategies:
+        strategy_contexts = get_bot_contexts_for_strategy(strategy["id"])
+        contexts.extend(strategy_contexts)
+        if TICK_SHARD_SIZE and len(strategy_contexts) > TICK_SHARD_SIZE:
+            sharded += 1
+            sharded_exchanges.update(c["exchange_code"] for c in strategy_contexts)
+            continue
+        accounts.update((c["exchange_account_id"], c) for c in strategy_contexts)
+    candle_groups = {(s["unified_symbol"], s["timeframe"]) for s in strategies}
+
+    with ThreadPoolExecutor(max_workers=PREARM_THREADS) as pool:
+        candle_futures = [pool.submit(_warm_candles, symbol, timeframe) for symbol, timeframe in candle_groups]
+        market_futures = [pool.submit(_run_in_context(_warm_markets), code) for code in sharded_exchanges]
+        armed = sum(pool.map(_run_in_context(_arm_account), accounts.values()))
+        refreshed, failed = refresh_leverage(contexts, pool)
+        candles = sum(future.result() for future in candle_futures)
+        for future in market_futures:
+            future.result()
+
+    stats = {
+        "strategies": len(strategies),
+        "strategies_sharded": sharded,
+        "bots": len(contexts),
+        "accounts": armed,
+        "accounts_failed": len(accounts) - armed,
+        "leverage_refreshed": refreshed,
+        "leverage_failed": failed,
+        "candle_groups": candles,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000),
+    }
+    print(f"[Prearm] 預熱完成：{stats}")
+    return stats
+
+
+def refresh_leverage(contexts, pool):
+    """
+    槓桿快取沒有 / 跟 bot 設定不同（剛改過槓桿、快取過期）的先 set_leverage，開倉時就不用等
+    同一個帳號 + symbol 只設一次，回傳 (成功數, 失敗數)
+    """
+    stale = {}
+    with prefetch_leverage(contexts):
+        for context in contexts:
+            if not is_leverage_set(context):
+                stale.setdefault((context["exchange_account_id"], context["bot"]["exchange_symbol"]), context)
+
+    if not stale:
+        return 0, 0
+
+    print(f"[Leverage] {len(contexts)} 個 bot 裡有 {len(stale)} 組帳號 / symbol 要重設槓桿")
+    refreshed = sum(pool.map(_run_in_context(_refresh_leverage), stale.values()))
+    return refreshed, len(stale) - refreshed
+
+
+def _run_in_context(fn):
+    # pool 裡的 thread 帶著呼叫端的 log_context / tick recorder
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(fn, *args)
+
+
+def _arm_account(context):
+    with log_context(exchange_account_id=context["exchange_account_id"], exchange=context["exchange_code"]):
+        try:
+            client = get_ccxt_client(context["exchange_account_id"], context["exchange_code"], context["params"])
+            _sync_clock(client)
+            return True
+        except Exception as e:
+            print(f"[Prearm] 帳號 {context['exchange_account_id']} 預熱失敗，下單時再建：{e}")
+            return False
+
+
+def _sync_clock(client):
+    """跟交易所對時（ccxt 簽名的 timestamp 會扣掉 timeDifference），不支援 fetchTime 的交易所略過"""
+    if not (getattr(client, "has", None) or {}).get("fetchTime"):
+        return
+    client.load_time_difference()
+
+
+def _refresh_leverage(context):
+    bot = context["bot"]
+    with log_context(bot_id=bot["id"], exchange=context["exchange_code"]):
+        try:
+            client = get_ccxt_client(context["exchange_account_id"], context["exchange_code"], context["params"])
+            ensure_leverage(client, context)
+            return True
+        except Exception as e:
+            print(f"[Leverage] bot {bot['id']} 預先設定槓桿失敗，開倉時再試：{e}")
+            return False
+
+
+def _warm_markets(exchange_code):
+    try:
+        warm_markets(exchange_code)
+    except Exception as e:
+        print(f"[Prearm] 預先載 {exchange_code} markets 失敗：{e}")
+
+
+def _warm_candles(symbol, timeframe):
+    try:
+        candle_store.get_candles(STRATEGY_CANDLE_EXCHANGE, symbol, timeframe, STRATEGY_CANDLE_BARS)
+        return 1
+    except Exception as e:
+        print(f"[Prearm] 預先抓 {symbol} {timeframe} K 線失敗：{e}")
+        return 0
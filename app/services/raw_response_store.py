@@ -0,0 +1,167 @@
+from app.utils.db import get_db, query_all, execute
+from app.utils.now import now
+from datetime import datetime, timedelta
+import gzip
+import importlib.util
+import json
+import os
+import threading
+from app.config import load_config
+
+load_config()
+
+# user_trade_orders.raw_response 只留這幾個欄位，完整回應壓縮後另存 user_trade_order_responses
+RAW_RESPONSE_INLINE_FIELDS = [
+    f.strip()
+    for f in os.getenv("RAW_RESPONSE_INLINE_FIELDS", "id,clientOrderId,status,filled,average,fee").split(",")
+    if f.strip()
+]
+# 完整回應要不要另存（0 = 只留 inline 欄位）
+RAW_RESPONSE_KEEP = os.getenv("RAW_RESPONSE_KEEP", "1") == "1"
+# zstd（有裝 zstandard 才用得到，沒裝自動退回 gzip）/ gzip
+RAW_RESPONSE_CODEC = os.getenv("RAW_RESPONSE_CODEC", "zstd")
+RAW_RESPONSE_LEVEL = int(os.getenv("RAW_RESPONSE_LEVEL", 3))
+# 完整回應保留幾天（0 = 不清），清掉前有設 ARCHIVE_DIR 就先寫進 jsonl.gz
+RAW_RESPONSE_RETENTION_DAYS = int(os.getenv("RAW_RESPONSE_RETENTION_DAYS", 30))
+RAW_RESPONSE_ARCHIVE_DIR = os.getenv("RAW_RESPONSE_ARCHIVE_DIR", "")
+RAW_RESPONSE_PURGE_BATCH = int(os.getenv("RAW_RESPONSE_PURGE_BATCH", 5000))
+
+if RAW_RESPONSE_CODEC == "zstd" and importlib.util.find_spec("zstandard") is None:
+    RAW_RESPONSE_CODEC = "gzip"
+
+_local = threading.local()  # ZstdCompressor 不能多個 thread 共用
+
+
+def inline_response(order):
+    """user_trade_orders.raw_response 要存的 JSON（只留 RAW_RESPONSE_INLINE_FIELDS）"""
+    return json.dumps({field: order[field] for field in RAW_RESPONSE_INLINE_FIELDS if field in order})
+
+
+def response_row(order_type, exchange_order_id, order, user_trade_id=None):
+    """
+    user_trade_order_responses 的一列（交給 TradeWriter 寫）
+    開倉時還不知道 user_trade_id，writer flush 時會補上；RAW_RESPONSE_KEEP=0 回 None
+    """
+    if not RAW_RESPONSE_KEEP:
+        return None
+    codec, body = pack(order)
+    return {
+        "user_trade_id": user_trade_id,
+        "type": order_type,
+        "exchange_order_id": exchange_order_id,
+        "codec": codec,
+        "body": body,
+        "created_at": now(),
+    }
+
+
+def pack(order):
+    data = json.dumps(order).encode()
+    if RAW_RESPONSE_CODEC == "zstd":
+        if not hasattr(_local, "zstd"):
+            import zstandard
+            _local.zstd = zstandard.ZstdCompressor(level=RAW_RESPONSE_LEVEL)
+        return "zstd", _local.zstd.compress(data)
+    return "gzip", gzip.compress(data, compresslevel=RAW_RESPONSE_LEVEL, mtime=0)
+
+
+def unpack(codec, body):
+    if codec == "zstd":
+        import zstandard
+        data = zstandard.ZstdDecompressor().decompress(body)
+    elif codec == "gzip":
+        data = gzip.decompress(body)
+    else:
+        data = body
+    return json.loads(data)
+
+
+def get_raw_responses(user_trade_id, exchange_order_id=None):
+    """查某筆 user_trade 存下來的完整回應（舊到新），除錯 / 對帳用"""
+    sql = """
+        SELECT id, type, exchange_order_id, codec, body, created_at FROM user_trade_order_responses
+        WHERE user_trade_id=%s
+    """
+    params = [user_trade_id]
+    if exchange_order_id is not None:
+        sql += " AND exchange_order_id=%s"
+        params.append(exchange_order_id)
+    sql += " ORDER BY id"
+
+    with get_db() as db:
+        rows = query_all(db, sql, params)
+    return [
+        {
+            "id": row["id"],
+            "type": row["type"],
+            "exchange_order_id": row["exchange_order_id"],
+            "created_at": row["created_at"],
+            "response": unpack(row["codec"], row["body"]),
+        }
+        for row in rows
+    ]
+
+
+def purge_raw_responses(
+    retention_days=RAW_RESPONSE_RETENTION_DAYS,
+    archive_dir=RAW_RESPONSE_ARCHIVE_DIR,
+    batch_size=RAW_RESPONSE_PURGE_BATCH,
+):
+    """
+    刪掉超過保留天數的完整回應，一次 batch_size 筆，避免一句 DELETE 鎖太久
+    有 archive_dir 就先把要刪的解壓後 append 到 raw_responses-YYYYMMDD.jsonl.gz
+    回傳刪掉幾筆
+    """
+    if retention_days <= 0:
+        return 0
+
+    cutoff = (datetime.strptime(now(), "%Y-%m-%d %H:%M:%S") - timedelta(days=retention_days)).strftime(
+        "%Y-%m-%d %H:%M:%S")
+    purged = 0
+    while True:
+        with get_db() as db:
+            rows = query_all(
+                db,
+                """
+                SELECT id, user_trade_id, type, exchange_order_id, codec, body, created_at
+                FROM user_trade_order_responses
+                WHERE created_at < %s
+                ORDER BY id
+                LIMIT %s
+                """,
+                (cutoff, batch_size),
+            )
+            if not rows:
+                break
+
+            if archive_dir:
+                _archive(rows, archive_dir)
+
+            ids = [row["id"] for row in rows]
+            execute(
+                db,
+                f"DELETE FROM user_trade_order_responses WHERE id IN ({', '.join(['%s'] * len(ids))})",
+                ids,
+            )
+        purged += len(rows)
+        if len(rows) < batch_size:
+            break
+
+    print(f"[RawResponse] 清掉 {purged} 筆 {cutoff} 以前的完整回應" + (f"（已封存到 {archive_dir}）" if archive_dir else ""))
+    return purged
+
+
+def _archive(rows, archive_dir):
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"raw_responses-{now()[:10].replace('-', '')}.jsonl.gz")
+    # gzip 用 append 會多一個 member，gzip.open 讀的時候會接起來
+    with gzip.open(path, "at") as f:
+        for row in rows:
+            f.write(json.dumps({
+                "id": row["id"],
+                "user_trade_id": row["user_trade_id"],
+                "type": row["type"],
+                "exchange_order_id": row["exchange_order_id"],
+                "created_at": str(row["created_at"]),
+                "response": unpack(row["codec"], row["body"]),
+            }) + "\n")
@@ -0,0 +1,242 @@
+from app.utils.db import get_db, query_all
+from app.exchange.exchange_factory import get_ccxt_client
+from app.services.bot_service import get_account_contexts
+from app.services.trade_service import apply_order_missing, apply_order_update
+from app.services.trade_writer import TradeWriter
+from app.utils.lazy import LazyModule
+from app.utils.metrics import metrics
+from app.utils.now import now
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
+import pytz
+from app.config import load_config
+
+load_config()
+
+ccxt_errors = LazyModule("ccxt.base.errors")
+
+# 同時對帳幾個交易所帳號
+RECONCILE_MAX_THREADS = int(os.getenv("RECONCILE_MAX_THREADS", 10))
+
+# 交易所已經結束的訂單狀態（MySQL 預設 collation 不分大小寫，ccxt 的 closed 也會命中）
+FINAL_ORDER_STATUSES = ("CLOSED", "FILLED", "CANCELED", "CANCELLED", "REJECTED", "EXPIRED")
+
+# 下單結果不明的單（只有 clientOrderId）下單後超過幾秒交易所還是查不到，才當作沒送到
+RECONCILE_MISSING_ORDER_SECONDS = int(os.getenv("RECONCILE_MISSING_ORDER_SECONDS", 120))
+
+PENDING_ORDERS_SQL = """
+    SELECT uto.id, uto.user_trade_id, uto.exchange_order_id, uto.client_order_id, uto.type, uto.price,
+           uto.filled_qty, uto.raw_response, uto.created_at,
+           ut.exchange_account_id, ut.exchange_symbol, ut.entry_price, ut.quantity,
+           ut.position_side, ut.leverage,
+           (
+               SELECT o.fee FROM user_trade_orders o
+               WHERE o.user_trade_id = uto.user_trade_id AND o.type = 'OPEN'
+               ORDER BY o.id DESC
+               LIMIT 1
+           ) AS open_order_fee
+    FROM user_trade_orders uto
+    JOIN user_trades ut ON ut.id = uto.user_trade_id
+    WHERE (uto.exchange_order_id IS NOT NULL OR uto.client_order_id IS NOT NULL)
+      AND uto.status NOT IN ({statuses})
+"""
+
+
+def get_pending_orders(user_trade_ids=None, exchange_account_id=None, exchange_order_ids=None, client_order_ids=None):
+    """
+    撈出還沒結束的 user_trade_orders（連同對帳需要的 user_trades 欄位）
+    可以用 user_trade_ids，或 exchange_account_id + exchange_order_ids / client_order_ids（符合其中一個就算）篩選
+    """
+    sql = PENDING_ORDERS_SQL.format(statuses=", ".join(["%s"] * len(FINAL_ORDER_STATUSES)))
+    params = list(FINAL_ORDER_STATUSES)
+
+    if user_trade_ids is not None:
+        if not user_trade_ids:
+            return []
+        sql += f" AND uto.user_trade_id IN ({', '.join(['%s'] * len(user_trade_ids))})"
+        params.extend(user_trade_ids)
+
+    if exchange_order_ids is not None or client_order_ids is not None:
+        exchange_order_ids, client_order_ids = exchange_order_ids or [], client_order_ids or []
+        if not exchange_order_ids and not client_order_ids:
+            return []
+        # 下單結果不明的單還沒有 exchange_order_id，只能用 clientOrderId 認；IN (NULL) 什麼都不符合
+        sql += (
+            f" AND (uto.exchange_order_id IN ({', '.join(['%s'] * len(exchange_order_ids)) or 'NULL'})"
+            f" OR uto.client_order_id IN ({', '.join(['%s'] * len(client_order_ids)) or 'NULL'}))"
+        )
+        params.extend(exchange_order_ids)
+        params.extend(client_order_ids)
+
+    if exchange_account_id is not None:
+        sql += " AND ut.exchange_account_id=%s"
+        params.append(exchange_account_id)
+
+    with metrics.span("db_read"), get_db() as db:
+        return query_all(db, sql, params)
+
+
+def order_row_to_user_trade(row):
+    """PENDING_ORDERS_SQL 的一列裡 apply_order_update 需要的 user_trades 欄位"""
+    return {
+        "id": row["user_trade_id"],
+        "entry_price": row["entry_price"],
+        "quantity": row["quantity"],
+        "position_side": row["position_side"],
+        "leverage": row["leverage"],
+    }
+
+
+def reconcile_pending_orders(user_trade_ids=None):
+    """
+    對帳：把還沒結束的訂單依交易所帳號分組，一個帳號一個 symbol 盡量只打一次 API
+    - 有 fetchOrders 就一次拉回來比對
+    - 沒有的話用 fetchOpenOrders + fetchClosedOrders
+    - 都找不到的才逐筆 fetch_order（下單結果不明、還沒有 exchange_order_id 的用 clientOrderId 查）
+    回傳 (還沒結束的 user_trade_ids, 這輪有沒有進展)
+    """
+    rows = get_pending_orders(user_trade_ids)
+    if not rows:
+        return [], False
+
+    by_account = defaultdict(list)
+    for row in rows:
+        by_account[row["exchange_account_id"]].append(row)
+
+    contexts = get_account_contexts(list(by_account))
+
+    writer = TradeWriter(flush_interval=None)
+    with ThreadPoolExecutor(max_workers=RECONCILE_MAX_THREADS) as pool:
+        outcomes = list(pool.map(
+            lambda item: _reconcile_account(contexts.get(item[0]), item[1], writer),
+            by_account.items(),
+        ))
+    writer.flush()
+
+    pending = sorted({user_trade_id for ids, _ in outcomes for user_trade_id in ids})
+    progressed = any(progress for _, progress in outcomes)
+
+    print(f"[Reconcile] 本輪對帳 {len(rows)} 筆，還有 {len(pending)} 筆 user_trade 未完成")
+    return pending, progressed
+
+
+def _reconcile_account(context, rows, writer):
+    if not context:
+        print(f"[Reconcile] 找不到交易所帳號 id={rows[0]['exchange_account_id']}")
+        return [], False
+
+    with metrics.span("client_build", context["exchange_code"]):
+        client = get_ccxt_client(
+            context["exchange_account_id"], context["exchange_code"], context["params"])
+
+    by_symbol = defaultdict(list)
+    for row in rows:
+        by_symbol[row["exchange_symbol"]].append(row)
+
+    pending = []
+    progressed = False
+
+    for symbol, symbol_rows in by_symbol.items():
+        try:
+            with metrics.span("status_check", context["exchange_code"]):
+                orders, missing = _fetch_orders(client, symbol, symbol_rows)
+        except Exception as e:
+            print(f"[Reconcile] 帳號 {context['exchange_account_id']} {symbol} 查單失敗：{e}")
+            pending.extend(row["user_trade_id"] for row in symbol_rows)
+            continue
+
+        for row in symbol_rows:
+            order = orders.get(_order_key(row))
+            if order is None:
+                if _order_key(row) in missing and _age_seconds(row) >= RECONCILE_MISSING_ORDER_SECONDS:
+                    apply_order_missing(order_row_to_user_trade(row), row, writer)
+                    progressed = True
+                else:
+                    pending.append(row["user_trade_id"])
+                continue
+
+            status = apply_order_update(
+                order_row_to_user_trade(row), row, order, writer, open_order_fee=row["open_order_fee"] or 0)
+
+            if status in FINAL_ORDER_STATUSES:
+                progressed = True
+            else:
+                pending.append(row["user_trade_id"])
+                if float(order.get("filled") or 0) > float(row["filled_qty"] or 0):
+                    progressed = True  # 部分成交有推進
+
+    return pending, progressed
+
+
+def _fetch_orders(client, symbol, rows):
+    """
+    回傳 ({_order_key: order}, 交易所說查無此單的 clientOrderId)，能批次拉就批次拉
+    下單結果不明的單還沒有 exchange_order_id，用 clientOrderId 對
+    """
+    wanted = {_order_key(row): row for row in rows}
+    since = _since_ms(rows)
+    found = {}
+    missing = set()
+
+    def collect(orders):
+        for order in orders:
+            for key in (str(order.get("id")), order.get("clientOrderId")):
+                if key in wanted:
+                    found[key] = order
+
+    if client.has.get("fetchOrders") is True:
+        collect(client.fetch_orders(symbol, since=since))
+    else:
+        if client.has.get("fetchOpenOrders") is True:
+            collect(client.fetch_open_orders(symbol))
+        if wanted - set(found) and client.has.get("fetchClosedOrders") is True:
+            collect(client.fetch_closed_orders(symbol, since=since))
+
+    # 批次拉不到的（超出分頁、交易所不支援）才逐筆查
+    for key in wanted.keys() - found.keys():
+        by_client_order_id = wanted[key]["exchange_order_id"] is None
+        try:
+            if by_client_order_id:
+                found[key] = client.fetch_order(None, symbol, params={"clientOrderId": key})
+            else:
+                found[key] = client.fetch_order(key, symbol)
+        except ccxt_errors.OrderNotFound as e:
+            if by_client_order_id:
+                missing.add(key)
+            print(f"[Reconcile] fetch_order {key} 查無此單：{e}")
+        except Exception as e:
+            print(f"[Reconcile] fetch_order {key} 失敗：{e}")
+
+    return found, missing
+
+
+def _order_key(row):
+    """對帳時認訂單用的 key：有 exchange_order_id 用它，下單結果不明的用 clientOrderId"""
+    if row["exchange_order_id"] is None:
+        return row["client_order_id"]
+    return str(row["exchange_order_id"])
+
+
+def _since_ms(rows):
+    """DB 的 created_at 是台北時間，換成交易所要的 UTC 毫秒（往前多抓一分鐘）"""
+    created = [row["created_at"] for row in rows if row.get("created_at")]
+    if not created:
+        return None
+    return int(_taipei(min(created)).timestamp() * 1000) - 60_000
+
+
+def _age_seconds(row):
+    """這張單下了多久（秒），沒有 created_at 當作很久了"""
+    if not row.get("created_at"):
+        return float("inf")
+    return (_taipei(now()) - _taipei(row["created_at"])).total_seconds()
+
+
+def _taipei(value):
+    if isinstance(value, str):
+        value = datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+    if value.tzinfo is None:
+        value = pytz.timezone("Asia/Taipei").localize(value)
+    return value
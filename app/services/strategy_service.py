@@ -1,10 +1,59 @@
-from ccxt import binanceusdm
-import pandas as pd
-from app.utils.db import get_db, query_one, insert_and_get_id, execute
+from app.utils.db import get_db, query_one, query_all, insert_and_get_id, execute
 from app.utils.now import now
-from app.strategies.btcusdt_breakout import breakout_strategy
+from app.services.candle_store import candle_store
+from app.strategies.registry import get_strategy
+from app.utils.metrics import metrics
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import time
+from app.config import load_config
+
+load_config()
+
+# 策略用哪個交易所的 K 線、一次給策略幾根
+STRATEGY_CANDLE_EXCHANGE = os.getenv("STRATEGY_CANDLE_EXCHANGE", "binanceusdm")
+STRATEGY_CANDLE_BARS = int(os.getenv("STRATEGY_CANDLE_BARS", 100))
+
+# strategies 沒有 timeframe 欄位（或是空的）就當 1h
+DEFAULT_TIMEFRAME = "1h"
+
+# 同時抓幾組 (symbol, timeframe) 的 K 線
+STRATEGY_FETCH_THREADS = int(os.getenv("STRATEGY_FETCH_THREADS", 8))
+
+
+def load_active_strategies(timeframes=None):
+    """所有 is_active 的策略，可以只拿某些 timeframe 的"""
+    with metrics.span("db_read"), get_db() as db:
+        strategies = query_all(db, "SELECT * FROM strategies WHERE is_active=1")
+
+    for strategy in strategies:
+        strategy["timeframe"] = strategy.get("timeframe") or DEFAULT_TIMEFRAME
+
+    if timeframes is not None:
+        strategies = [s for s in strategies if s["timeframe"] in timeframes]
+    return strategies
+
+
+def get_open_strategy_trades(strategy_ids):
+    """一次查多個策略還沒出場的 strategy_trades，回傳 {strategy_id: row}"""
+    if not strategy_ids:
+        return {}
+
+    placeholders = ", ".join(["%s"] * len(strategy_ids))
+    with metrics.span("db_read"), get_db() as db:
+        rows = query_all(db, f"""
+            SELECT * FROM strategy_trades
+            WHERE strategy_id IN ({placeholders}) AND exit_at is null
+            ORDER BY id
+        """, tuple(strategy_ids))
+
+    return {row["strategy_id"]: row for row in rows}
+
 
 def run_strategy(strategy_id: int):
+    """跑單一策略（手動 / 測試用），有訊號就寫 strategy_trades"""
     # 先抓策略資料
     with get_db() as db:
         strategy = query_one(
@@ -17,34 +66,77 @@ def run_strategy(strategy_id: int):
         print(f"找不到策略 id={strategy_id} 或已停用")
         return None
 
+    strategy["timeframe"] = strategy.get("timeframe") or DEFAULT_TIMEFRAME
+    df = _get_candles(strategy["unified_symbol"], strategy["timeframe"])
+    signal = evaluate_strategy(strategy, df)
+    return record_signal(strategy, signal, df['close'].iloc[-1])
+
+
+def run_strategies(timeframes=None, strategies=None):
+    """
+    跑所有啟用中的策略（或指定的 strategies），回傳 [(strategy_id, signal), ...]（只有產生訊號的）
+    - 同一組 (symbol, timeframe) 的策略共用一次 K 線抓取
+    - 各組同時抓 / 同時算
+    - 所有策略的未平倉 strategy_trades 一次查好
+    """
+    if strategies is None:
+        strategies = load_active_strategies(timeframes)
+    if not strategies:
+        print("沒有要跑的策略")
+        return []
+
+    groups = defaultdict(list)
+    for strategy in strategies:
+        groups[(strategy["unified_symbol"], strategy["timeframe"])].append(strategy)
+
+    open_trades = get_open_strategy_trades([s["id"] for s in strategies])
+    print(f"共 {len(strategies)} 個策略、{len(groups)} 組 K 線")
+
+    def run_group(item):
+        (symbol, timeframe), group = item
+        try:
+            df = _get_candles(symbol, timeframe)
+        except Exception as e:
+            print(f"[Strategy] 抓 {symbol} {timeframe} K 線失敗：{e}")
+            return []
+
+        signals = []
+        for strategy in group:
+            try:
+                signal = evaluate_strategy(strategy, df, open_trades)
+                signal = record_signal(strategy, signal, df['close'].iloc[-1])
+            except Exception as e:
+                print(f"[Strategy {strategy['id']}] 執行失敗：{e}")
+                continue
+            if signal:
+                signals.append((strategy["id"], signal))
+        return signals
+
+    with ThreadPoolExecutor(max_workers=STRATEGY_FETCH_THREADS) as pool:
+        results = list(pool.map(run_group, groups.items()))
+
+    return [item for signals in results for item in signals]
+
+
+def evaluate_strategy(strategy, df, open_trades=None):
+    """
+    跑策略函式拿訊號（不寫 DB）
+    open_trades：get_open_strategy_trades 查好的結果，沒帶就讓策略自己查
+    """
     print("策略：", strategy["name"])
+    print(f"最新 {strategy['unified_symbol']} 價格：", df['close'].iloc[-1])
 
-    # 拿最新價格（先假設都是 BTCUSDT，用 binance 現貨 / 合約 ticker）
-    ohlcv = binanceusdm().fetch_ohlcv(
-        symbol=strategy['unified_symbol'],
-        timeframe='1h',
-        limit=100
-    )
-
-    # 轉成 DataFrame
-    df = pd.DataFrame(ohlcv, columns=[
-        'timestamp', 'open', 'high', 'low', 'close', 'volume'
-    ])
-
-    # 把 timestamp 轉成可讀時間（UTC）
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-
-    # 排序由舊到新
-    df = df.sort_values('timestamp')
+    strategy_fn = get_strategy(strategy.get("code"))
+    kwargs = {"strategy_id": strategy["id"], "params": _params_of(strategy)}
+    if open_trades is not None:
+        kwargs["open_trade"] = open_trades.get(strategy["id"])
+    with metrics.span("indicators"):
+        return strategy_fn(df, **kwargs)
 
-    # 只保留需要的欄位（時間 + OHLCV）
-    df = df[['timestamp', 'open', 'high', 'low', 'close', 'volume']]
-    price = df['close'].iloc[-1]
 
-    print("最新 BTC 價格：", price)
-
-    # 跑策略，取得訊號
-    signal = breakout_strategy(df)
+def record_signal(strategy, signal, price):
+    """把訊號寫進 strategy_trades（OPEN 新增一筆、CLOSE 更新最新一筆），回傳帶 trade_id 的訊號"""
+    strategy_id = strategy["id"]
 
     if not signal or not signal.get("action"):
         print("策略沒有訊號")
@@ -53,6 +145,7 @@ def run_strategy(strategy_id: int):
     action = signal["action"].upper()        # OPEN / CLOSE
     position_side = signal.get("position_side")  # LONG / SHORT
     signal["price"] = price                  # 保險一點，用實際 ticker 價
+    signal["emitted_at"] = time.time()       # 算訊號到下單的延遲
 
     # ---------- 處理 OPEN 訊號 ----------
     if action == "OPEN":
@@ -63,7 +156,7 @@ def run_strategy(strategy_id: int):
             VALUES (%s, %s, %s, %s, 'OPEN', %s, %s)
         """
 
-        with get_db() as db:
+        with metrics.span("db_write"), get_db() as db:
             trade_id = insert_and_get_id(
                 db,
                 sql,
@@ -79,7 +172,7 @@ def run_strategy(strategy_id: int):
     if action in ("CLOSE", "TP_CLOSE", "SL_CLOSE"):
         action+='D'
         # 找這個策略最新一筆未平倉的 strategy_trades
-        with get_db() as db:
+        with metrics.span("db_read"), get_db() as db:
             open_trade = query_one(
                 db,
                 """
@@ -108,7 +201,7 @@ def run_strategy(strategy_id: int):
             pnl_pct = (entry_price / exit_price - 1) * 100
 
         # 更新這筆 strategy_trade，補上 exit_price / exit_at / 狀態 / pnl_pct
-        with get_db() as db:
+        with metrics.span("db_write"), get_db() as db:
             execute(
                 db,
                 """
@@ -131,3 +224,16 @@ def run_strategy(strategy_id: int):
     # 其他不認得的 action
     print(f"不支援的策略 action: {action}")
     return None
+
+
+def _get_candles(symbol, timeframe):
+    with metrics.span("ohlcv_fetch"):
+        return candle_store.get_window(STRATEGY_CANDLE_EXCHANGE, symbol, timeframe, STRATEGY_CANDLE_BARS)
+
+
+def _params_of(strategy):
+    """strategies.params（JSON）覆蓋策略預設參數"""
+    params = strategy.get("params")
+    if isinstance(params, str):
+        params = json.loads(params) if params else None
+    return params or None
@@ -1,148 +1,299 @@
-from app.utils.db import execute, get_db, query_one, insert_and_get_id
+from app.utils.db import get_db, query_one, query_all
 from app.utils.now import now
-from app.exchange.exchange_factory import build_ccxt_client
-import json
-from ccxt.base.errors import ExchangeError
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-def run_bot_trade(bot_id, signal):
-    with get_db() as db:
-        bot = query_one(db, "SELECT * FROM bots WHERE id=%s", (bot_id,))
-        account = query_one(
-            db, "SELECT * FROM exchange_accounts WHERE id=%s", (bot["exchange_account_id"],))
-        exchange = query_one(
-            db, "SELECT * FROM exchanges WHERE id=%s", (account["exchange_id"],))
-
-    params = json.loads(account["params"])
-
-    print(f"[Bot {bot_id}] 使用交易所：{exchange['code']}")
-
-    client = build_ccxt_client(
-        exchange_code=exchange["code"],
-        api_key=params.get("api_key"),
-        secret_key=params.get("secret_key"),
-        passphrase=params.get("passphrase"),
-    )
-    client.set_sandbox_mode(bool(int(os.getenv("SANDBOX_MODE", 1))))
+from app.exchange.exchange_factory import amount_to_precision, get_ccxt_client, get_market
+from app.services.bot_service import get_bot_context, get_account_context
+from app.services.leverage_cache import invalidate_leverage, is_leverage_set, remember_leverage
+from app.services.order_submitter import (
+    OrderInFlight, client_order_id, release_client_order_id, submit_order, submit_orders)
+from app.services.trade_writer import writer_scope
+from app.services.raw_response_store import inline_response, response_row
+from app.utils.metrics import metrics
+from app.logger import log_context
+from app.utils.lazy import LazyModule
+
+# 只在 except 比對時才用到，那時 client 早就把 ccxt 載入了
+ccxt_errors = LazyModule("ccxt.base.errors")
+
+def run_bot_trade(bot_id, signal, context=None, writer=None):
+    """
+    開倉；context 是 bot_service 的 bot 執行上下文，
+    fan-out 時直接傳進來就不用再查 bots / exchange_accounts / exchanges
+
+    有傳 writer（TradeWriter）時 DB 寫入會延後批次處理，
+    回傳的 user_trade_id 要等 writer flush 之後才會有值
+    """
+    if context is None:
+        context = get_bot_context(bot_id)
+        if not context:
+            print(f"[Bot {bot_id}] 找不到 bot")
+            return None
 
-    qty = float(bot["base_order_usdt"]) / signal["price"]
+    bot = context["bot"]
 
-    print(f"[Bot {bot_id}] 下單 {signal['position_side']} {qty}")
+    print(f"[Bot {bot_id}] 使用交易所：{context['exchange_code']}")
+
+    with metrics.span("client_build", context["exchange_code"]):
+        client = get_ccxt_client(
+            context["exchange_account_id"], context["exchange_code"], context["params"])
+
+    order_request = build_open_order(context, signal)
+    if order_request is None:
+        return None
+
+    print(f"[Bot {bot_id}] 下單 {signal['position_side']} {order_request['amount']}")
 
     try:
         # 設定槓桿
-        client.set_leverage(
-            bot["leverage"],
-            bot["exchange_symbol"],
-            params={"marginMode": "isolated"},
-        )
-    except ExchangeError as e:
+        ensure_leverage(client, context)
+    except ccxt_errors.ExchangeError as e:
         print(f"[Bot {bot_id}] 設定槓桿失敗: {str(e)}")
         return None
 
     try:
-        order = client.create_order(
-            symbol=bot["exchange_symbol"],
-            type='market',
-            side='buy',  # hedge_mode：多單 = buy
-            amount=qty,
-            params={
-                'marginMode': 'isolated',
-                'tradeSide': 'open',   # 開倉
-                'presetStopLossPrice': str(round(signal["price"] * 0.9)),
-            },
-        )
-    except ExchangeError as e:
+        with metrics.span("create_order", context["exchange_code"]):
+            order = submit_order(
+                client, order_request, client_order_id(signal["trade_id"], bot_id, "OPEN"), context["exchange_code"])
+    except ccxt_errors.ExchangeError as e:
         print(f"[Bot {bot_id}] 下單失敗: {str(e)}")
+        if invalidate_leverage(context, e):
+            print(f"[Bot {bot_id}] 看起來是槓桿 / 保證金設定問題，下次開倉會重新設定")
+        return None
+    except ccxt_errors.NetworkError as e:
+        # 確認不了交易所有沒有收到，clientOrderId 還佔著，重跑也不會重複下單；先記一筆 PENDING 等對帳查回來
+        print(f"[Bot {bot_id}] 下單沒有確認結果: {str(e)}")
+        return record_unconfirmed_open(context, signal, order_request, writer)
+    except OrderInFlight as e:
+        print(f"[Bot {bot_id}] {e}")
         return None
 
+    metrics.observe_signal_to_order(signal)
     print(f"[Bot {bot_id}] 交易所回應：", order)
 
-    exchange_order_id = (
-        order.get("id")
-        or order.get("orderId")
-        or order.get("info", {}).get("orderId")
-    )
+    return record_open_order(context, signal, order_request, order, writer)
+
+
+def run_bot_trades_batch(contexts, signal, client, writer=None):
+    """
+    同一個帳號的多個 bot 開倉，用 create_orders 一次送（client 要支援 createOrders）
+    回傳跟 contexts 對齊的結果（失敗 / 略過的是 None），每個 bot 的錯誤各自處理
+    """
+    results = [None] * len(contexts)
+    items = []
+    indexes = []
+    for i, context in enumerate(contexts):
+        bot_id = context["bot"]["id"]
+        with log_context(bot_id=bot_id):
+            order_request = build_open_order(context, signal)
+            if order_request is None:
+                continue
+            try:
+                ensure_leverage(client, context)
+            except Exception as e:
+                # 一個 bot 設不了槓桿（包含 429 / 逾時）不影響同一批的其他 bot
+                print(f"[Bot {bot_id}] 設定槓桿失敗: {str(e)}")
+                continue
+        items.append((order_request, client_order_id(signal["trade_id"], bot_id, "OPEN")))
+        indexes.append(i)
+
+    if not items:
+        return results
+
+    print(f"[Batch] 帳號 {contexts[0]['exchange_account_id']} {len(items)} 個 bot 一起開倉")
+    orders = submit_orders(client, items, contexts[0]["exchange_code"])
+
+    for i, (order_request, _), order in zip(indexes, items, orders):
+        context = contexts[i]
+        bot_id = context["bot"]["id"]
+        with log_context(bot_id=bot_id):
+            if isinstance(order, OrderInFlight):
+                print(f"[Bot {bot_id}] {order}")
+            elif isinstance(order, ccxt_errors.ExchangeError):
+                print(f"[Bot {bot_id}] 下單失敗: {str(order)}")
+                if invalidate_leverage(context, order):
+                    print(f"[Bot {bot_id}] 看起來是槓桿 / 保證金設定問題，下次開倉會重新設定")
+            elif isinstance(order, Exception):
+                # 逾時 / 斷線：clientOrderId 還佔著，跟單張下單一樣先記一筆 PENDING 等對帳查回來
+                print(f"[Bot {bot_id}] 下單沒有確認結果: {str(order)}")
+                results[i] = record_unconfirmed_open(context, signal, order_request, writer)
+            else:
+                metrics.observe_signal_to_order(signal)
+                print(f"[Bot {bot_id}] 交易所回應：", order)
+                results[i] = record_open_order(context, signal, order_request, order, writer)
+    return results
+
+
+def ensure_leverage(client, context):
+    """
+    快取裡已經是 bot 設定的槓桿 / 保證金模式就跳過，不然 set_leverage 並記下來
+    回傳有沒有真的打交易所；失敗會清快取再把 ExchangeError 丟出去
+    """
+    if is_leverage_set(context):
+        return False
+
+    bot = context["bot"]
+    try:
+        with metrics.span("set_leverage", context["exchange_code"]):
+            client.set_leverage(
+                bot["leverage"],
+                bot["exchange_symbol"],
+                params={"marginMode": "isolated"},
+            )
+    except ccxt_errors.ExchangeError:
+        invalidate_leverage(context)
+        raise
+    remember_leverage(context)
+    return True
+
+
+def build_open_order(context, signal):
+    """
+    開倉要送給交易所 create_order 的參數（同步 / async 下單共用）
+    數量照 market 快取的精度 / 最小下單量算好，不夠交易所最小值就回 None（不用送出去被拒）
+    """
+    bot = context["bot"]
+    qty = size_open_amount(context, float(bot["base_order_usdt"]) / signal["price"], signal["price"])
+    if qty is None:
+        return None
+
+    return {
+        "symbol": bot["exchange_symbol"],
+        "type": 'market',
+        "side": 'buy',  # hedge_mode：多單 = buy
+        "amount": qty,
+        "params": {
+            'marginMode': 'isolated',
+            'tradeSide': 'open',   # 開倉
+            'presetStopLossPrice': str(round(signal["price"] * 0.9)),
+        },
+    }
+
+
+def size_open_amount(context, amount, price):
+    """數量捨到交易所精度，低於 limits.amount.min / limits.cost.min 回 None"""
+    exchange_code = context["exchange_code"]
+    symbol = context["bot"]["exchange_symbol"]
+    amount = amount_to_precision(exchange_code, symbol, amount)
+    if amount is None:
+        print(f"[Bot {context['bot']['id']}] 下單數量小於 {symbol} 的最小精度")
+        return None
+
+    limits = (get_market(exchange_code, symbol) or {}).get("limits") or {}
+    min_amount = (limits.get("amount") or {}).get("min")
+    min_cost = (limits.get("cost") or {}).get("min")
+    if min_amount and amount < min_amount:
+        print(f"[Bot {context['bot']['id']}] 下單數量 {amount} 小於 {symbol} 最小下單量 {min_amount}")
+        return None
+    if min_cost and amount * price < min_cost:
+        print(f"[Bot {context['bot']['id']}] 下單金額 {amount * price:.4f} 小於 {symbol} 最小下單金額 {min_cost}")
+        return None
+    return amount
+
+
+def record_open_order(context, signal, order_request, order, writer=None):
+    """把開倉結果寫進 user_trades / user_trade_orders（同步 / async 下單共用）"""
+    bot = context["bot"]
+    qty = order_request["amount"]
+    exchange_order_id = get_exchange_order_id(order)
     order_status = order.get("status") or "NEW"
     filled = order.get("filled") or 0
 
-    with get_db() as db:
-        user_trade_sql = """
-            INSERT INTO user_trades
-            (user_id, strategy_trade_id, exchange_account_id, bot_id, exchange_symbol,
-            position_side, quantity, leverage, entry_price, opened_at, status,
-            created_at, updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s,
-                    %s, %s)
-        """
-
-        user_trade_id = insert_and_get_id(
-            db,
-            user_trade_sql,
-            (
-                bot["user_id"],
-                signal['trade_id'],
-                bot["exchange_account_id"],
-                bot['id'],
-                bot['exchange_symbol'],
-                signal['position_side'],
-                qty,
-                bot["leverage"],
-                signal['price'],
-                now(),
-                "PENDING",  # 一開始標 PENDING，等填單/成交再改
-                now(),
-                now(),
-            ),
+    result = {
+        "user_trade_id": None,
+        "exchange_order_id": exchange_order_id,
+        "order_status": order_status,
+    }
+
+    with writer_scope(writer) as w:
+        w.insert_trade(
+            _open_trade_row(bot, signal, qty),
+            {
+                "exchange_order_id": exchange_order_id,
+                "client_order_id": client_order_id(signal["trade_id"], bot["id"], "OPEN"),
+                "type": "OPEN",
+                "price": signal['price'],
+                "requested_qty": qty,
+                "filled_qty": float(filled),
+                "status": order_status,
+                "raw_response": inline_response(order),
+                "created_at": now(),
+                "updated_at": now(),
+            },
+            result,
+            response_row("OPEN", exchange_order_id, order),
         )
 
-        print(f"[Bot {bot_id}] 建立 user_trades.id = {user_trade_id}")
+    print(f"[Bot {bot['id']}] 已送出 user_trades / user_trade_orders (OPEN) 寫入")
 
-        order_sql = """
-            INSERT INTO user_trade_orders
-            (user_trade_id, exchange_order_id, type, price,
-            requested_qty, filled_qty, status, raw_response,
-            created_at, updated_at)
-            VALUES (%s, %s, %s, %s,
-                    %s, %s, %s, %s,
-                    %s, %s)
-        """
+    return result
 
-        insert_and_get_id(
-            db,
-            order_sql,
-            (
-                user_trade_id,
-                exchange_order_id,
-                "OPEN",
-                signal['price'],
-                qty,
-                float(filled),
-                order_status,
-                json.dumps(order),
-                now(),
-                now(),
-            ),
+
+def record_unconfirmed_open(context, signal, order_request, writer=None):
+    """
+    開倉逾時 / 斷線、不知道交易所有沒有收到：user_trades / user_trade_orders 照樣記一筆 PENDING
+    exchange_order_id 先空著，對帳時用 clientOrderId 查回來補上；交易所確定沒有這張單才標 ERROR
+    """
+    bot = context["bot"]
+    qty = order_request["amount"]
+    result = {
+        "user_trade_id": None,
+        "exchange_order_id": None,
+        "order_status": "PENDING",
+    }
+
+    with writer_scope(writer) as w:
+        w.insert_trade(
+            _open_trade_row(bot, signal, qty),
+            {
+                "exchange_order_id": None,
+                "client_order_id": client_order_id(signal["trade_id"], bot["id"], "OPEN"),
+                "type": "OPEN",
+                "price": signal['price'],
+                "requested_qty": qty,
+                "filled_qty": 0.0,
+                "status": "PENDING",
+                "raw_response": None,
+                "created_at": now(),
+                "updated_at": now(),
+            },
+            result,
         )
 
-    print(f"[Bot {bot_id}] 已寫入 user_trade_orders (OPEN)")
+    print(f"[Bot {bot['id']}] 已送出 user_trades / user_trade_orders (OPEN, 結果不明) 寫入，等對帳用 clientOrderId 查")
+
+    return result
 
+
+def _open_trade_row(bot, signal, qty):
     return {
-        "user_trade_id": user_trade_id,
-        "exchange_order_id": exchange_order_id,
-        "order_status": order_status,
+        "user_id": bot["user_id"],
+        "strategy_trade_id": signal['trade_id'],
+        "exchange_account_id": bot["exchange_account_id"],
+        "bot_id": bot['id'],
+        "exchange_symbol": bot['exchange_symbol'],
+        "position_side": signal['position_side'],
+        "quantity": qty,
+        "leverage": bot["leverage"],
+        "entry_price": signal['price'],
+        "opened_at": now(),
+        "status": "PENDING",  # 一開始標 PENDING，等填單/成交再改
+        "created_at": now(),
+        "updated_at": now(),
     }
 
 
-def check_order_status(user_trade_id: int, exchange_order_id: str):
+def get_exchange_order_id(order):
+    return (
+        order.get("id")
+        or order.get("orderId")
+        or order.get("info", {}).get("orderId")
+    )
+
+
+def check_order_status(user_trade_id: int, exchange_order_id: str, writer=None):
     print(f"[CheckOrder] 檢查 user_trade_id={user_trade_id} order={exchange_order_id}")
 
-    # 1. 找 user_trades / account / exchange / 對應的 user_trade_order
-    with get_db() as db:
+    # 1. 找 user_trades / 對應的 user_trade_order
+    with metrics.span("db_read"), get_db() as db:
         user_trade = query_one(
             db, "SELECT * FROM user_trades WHERE id=%s", (user_trade_id,)
         )
@@ -150,15 +301,6 @@ def check_order_status(user_trade_id: int, exchange_order_id: str):
             print("[CheckOrder] user_trade 不存在")
             return
 
-        account = query_one(
-            db,
-            "SELECT * FROM exchange_accounts WHERE id=%s",
-            (user_trade["exchange_account_id"],),
-        )
-        exchange = query_one(
-            db, "SELECT * FROM exchanges WHERE id=%s", (account["exchange_id"],)
-        )
-
         user_trade_order = query_one(
             db,
             """
@@ -174,81 +316,86 @@ def check_order_status(user_trade_id: int, exchange_order_id: str):
         print("[CheckOrder] 找不到對應的 user_trade_order")
         return
 
-    order_type = user_trade_order["type"]  # OPEN / CLOSE
+    context = get_account_context(user_trade["exchange_account_id"])
 
-    params = json.loads(account["params"])
-
-    client = build_ccxt_client(
-        exchange_code=exchange["code"],
-        api_key=params.get("api_key"),
-        secret_key=params.get("secret_key"),
-        passphrase=params.get("passphrase"),
-    )
-    client.set_sandbox_mode(bool(int(os.getenv("SANDBOX_MODE", 1))))
+    with metrics.span("client_build", context["exchange_code"]):
+        client = get_ccxt_client(
+            context["exchange_account_id"], context["exchange_code"], context["params"])
 
     # 2. 呼叫交易所查詢訂單狀態
     try:
-        order = client.fetch_order(exchange_order_id, user_trade["exchange_symbol"])
+        with metrics.span("status_check", context["exchange_code"]):
+            order = client.fetch_order(exchange_order_id, user_trade["exchange_symbol"])
     except Exception as e:
         print("fetch_order 失敗：", e)
         return
 
     print("[CheckOrder] 交易所回應：", order)
 
+    apply_order_update(user_trade, user_trade_order, order, writer)
+
+    return order
+
+
+def apply_order_update(user_trade, user_trade_order, order, writer=None, open_order_fee=None):
+    """
+    把交易所回來的訂單狀態寫回 user_trade_orders / user_trades
+    查單、批次對帳、推播成交共用同一套邏輯
+    open_order_fee：平倉算損益要用的開倉手續費，沒給就自己查
+    回傳大寫的訂單狀態
+    """
+    user_trade_id = user_trade["id"]
+    order_type = user_trade_order["type"]  # OPEN / CLOSE
+
     status = (order.get("status") or "UNKNOWN").upper()
     filled = order.get("filled") or 0
     amount = order.get("amount") or None
     avg_price = order.get("average") or order.get("price") or user_trade_order["price"]
     fee = (order.get("fee") or {}).get("cost") or 0
 
-    # 3. 更新 user_trade_orders
-    with get_db() as db:
-        sql = """
-            UPDATE user_trade_orders
-            SET price=%s, requested_qty=%s, filled_qty=%s, fee=%s, status=%s, raw_response=%s, updated_at=%s
-            WHERE user_trade_id=%s AND exchange_order_id=%s
-        """
-        execute(
-            db,
-            sql,
-            (
-                avg_price,
-                amount,
-                filled,
-                fee,
-                status,
-                json.dumps(order),
-                now(),
-                user_trade_id,
-                exchange_order_id,
-            ),
-        )
+    # 平倉成交要算損益，先把開倉那筆的手續費查出來
+    if status in ("CLOSED", "FILLED") and order_type == "CLOSE" and open_order_fee is None:
+        with metrics.span("db_read"), get_db() as db:
+            open_user_trade_order = query_one(
+                db,
+                """
+                SELECT * FROM user_trade_orders
+                WHERE user_trade_id=%s AND type='OPEN'
+                ORDER BY id DESC
+                LIMIT 1
+                """,
+                (user_trade_id),
+            )
+        open_order_fee = open_user_trade_order["fee"]
+
+    with writer_scope(writer) as w:
+        # 3. 更新 user_trade_orders
+        # inline 欄位沒變（同一個狀態重複查單）就不重寫 raw_response，也不再另存一份完整回應
+        fields = dict(price=avg_price, requested_qty=amount, filled_qty=filled, fee=fee, status=status, updated_at=now())
+        exchange_order_id = user_trade_order.get("exchange_order_id")
+        if exchange_order_id is None:
+            # 下單結果不明、用 clientOrderId 查回來的單，補上交易所的訂單 id
+            exchange_order_id = fields["exchange_order_id"] = get_exchange_order_id(order)
+        raw_response = inline_response(order)
+        if raw_response != user_trade_order.get("raw_response"):
+            fields["raw_response"] = raw_response
+            w.insert_response(response_row(order_type, exchange_order_id, order, user_trade_id=user_trade_id))
+        w.update_order(user_trade_order["id"], **fields)
 
         # 4. 依照訂單型別做不同處理
         if status in ("CLOSED", "FILLED"):
             if order_type == "OPEN":
                 # 開倉完全成交
                 print(f"[CheckOrder] 開倉完全成交，更新 user_trade {user_trade_id} 為 OPEN")
-                execute(
-                    db,
-                    """
-                    UPDATE user_trades
-                    SET quantity=%s, entry_price=%s, status='OPEN', opened_at=%s, updated_at=%s
-                    WHERE id=%s
-                    """,
-                    (amount, avg_price, now(), now(), user_trade_id),
+                w.update_trade(
+                    user_trade_id,
+                    quantity=amount,
+                    entry_price=avg_price,
+                    status="OPEN",
+                    opened_at=now(),
+                    updated_at=now(),
                 )
             elif order_type == "CLOSE":
-                open_user_trade_order = query_one(
-                    db,
-                    """
-                    SELECT * FROM user_trade_orders
-                    WHERE user_trade_id=%s AND type='OPEN'
-                    ORDER BY id DESC
-                    LIMIT 1
-                    """,
-                    (user_trade_id),
-                )
                 # 平倉完全成交，計算損益
                 print(f"[CheckOrder] 平倉完全成交，更新 user_trade {user_trade_id} 為 CLOSED")
 
@@ -258,33 +405,74 @@ def check_order_status(user_trade_id: int, exchange_order_id: str):
                 side = user_trade["position_side"]  # LONG / SHORT
 
                 if side == "LONG":
-                    pnl = (exit_price - entry_price) * qty - float(open_user_trade_order["fee"]) - float(fee)
+                    pnl = (exit_price - entry_price) * qty - float(open_order_fee) - float(fee)
                 else:
-                    pnl = (entry_price - exit_price) * qty - float(open_user_trade_order["fee"]) - float(fee)
+                    pnl = (entry_price - exit_price) * qty - float(open_order_fee) - float(fee)
 
                 pnl_pct = pnl / (exit_price * qty) * 100 * float(user_trade['leverage'])
 
-                execute(
-                    db,
-                    """
-                    UPDATE user_trades
-                    SET status='CLOSED',
-                        closed_at=%s,
-                        exit_price=%s,
-                        pnl=%s,
-                        pnl_pct=%s,
-                        updated_at=%s
-                    WHERE id=%s
-                    """,
-                    (now(), exit_price, pnl, pnl_pct, now(), user_trade_id),
+                w.update_trade(
+                    user_trade_id,
+                    status="CLOSED",
+                    closed_at=now(),
+                    exit_price=exit_price,
+                    pnl=pnl,
+                    pnl_pct=pnl_pct,
+                    updated_at=now(),
                 )
         else:
             print(f"[CheckOrder] 訂單狀態：{status}")
 
-    return order
+    return status
+
+
+def apply_order_missing(user_trade, user_trade_order, writer=None):
+    """
+    下單結果不明的單（只有 clientOrderId）對帳時交易所說查無此單：當作沒送到
+    - user_trade_orders 標 REJECTED
+    - 開倉：user_trades 標 ERROR；平倉：部位還在，user_trades 改回 OPEN
+    - 放掉 clientOrderId，同一張單之後才送得出去
+    """
+    user_trade_id = user_trade["id"]
+    order_type = user_trade_order["type"]
+    error_message = f"交易所查不到 clientOrderId={user_trade_order['client_order_id']}，下單沒有送到"
+    print(f"[CheckOrder] user_trade {user_trade_id} 的 {order_type} 單{error_message}")
+
+    with writer_scope(writer) as w:
+        w.update_order(user_trade_order["id"], status="REJECTED", updated_at=now())
+        if order_type == "OPEN":
+            w.update_trade(user_trade_id, status="ERROR", error_message=error_message, updated_at=now())
+        else:
+            w.update_trade(
+                user_trade_id, status="OPEN", exit_price=None, error_message=error_message, updated_at=now())
+
+    release_client_order_id(user_trade_order["client_order_id"])
+    return "REJECTED"
+
+
+def get_open_user_trades_for_bots(bot_ids):
+    """一次查出多個 bot 各自最新一筆 OPEN 的 user_trades，回傳 {bot_id: user_trade}"""
+    if not bot_ids:
+        return {}
 
+    placeholders = ", ".join(["%s"] * len(bot_ids))
+    with metrics.span("db_read"), get_db() as db:
+        rows = query_all(
+            db,
+            f"""
+            SELECT ut.* FROM user_trades ut
+            JOIN (
+                SELECT MAX(id) AS id FROM user_trades
+                WHERE bot_id IN ({placeholders}) AND status='OPEN'
+                GROUP BY bot_id
+            ) latest ON latest.id = ut.id
+            """,
+            tuple(bot_ids),
+        )
+    return {row["bot_id"]: row for row in rows}
 
-def close_bot_position(bot_id, signal: dict):
+
+def close_bot_position(bot_id, signal: dict, context=None, user_trade=None, writer=None):
     """
     平倉流程：
     - 找出這個 bot 最新一筆 OPEN 的 user_trades
@@ -292,147 +480,204 @@ def close_bot_position(bot_id, signal: dict):
     - 建立交易所平倉訂單（tradeSide = close）
     - 新增一筆 user_trade_orders(type='CLOSE')
     - 將 user_trades.status 標記為 CLOSING（等查單後再標 CLOSED）
+
+    fan-out 時 context / user_trade 可以事先批次查好傳進來
     """
 
-    # 1. 先查 bot / user_trade / account / exchange
-    with get_db() as db:
-        bot = query_one(db, "SELECT * FROM bots WHERE id=%s", (bot_id,))
-        if not bot:
-            print(f"[Bot {bot_id}] 找不到 bot")
-            return None
+    # 1. 先找這個 bot 最新一筆 OPEN 的部位
+    if user_trade is None:
+        with metrics.span("db_read"), get_db() as db:
+            user_trade = query_one(
+                db,
+                """
+                SELECT * FROM user_trades
+                WHERE bot_id=%s AND status='OPEN'
+                ORDER BY id DESC
+                LIMIT 1
+                """,
+                (bot_id,),
+            )
+    if not user_trade:
+        print(f"[Bot {bot_id}] 沒有 OPEN 部位，略過平倉")
+        return None
 
-        # 找這個 bot 最新一筆 OPEN 的部位
-        user_trade = query_one(
-            db,
-            """
-            SELECT * FROM user_trades
-            WHERE bot_id=%s AND status='OPEN'
-            ORDER BY id DESC
-            LIMIT 1
-            """,
-            (bot_id,),
-        )
-        if not user_trade:
-            print(f"[Bot {bot_id}] 沒有 OPEN 部位，略過平倉")
-            return None
+    # 部位是用哪個帳號開的就用哪個帳號平（bot 後來換帳號也一樣）
+    if context is None or context["exchange_account_id"] != user_trade["exchange_account_id"]:
+        context = get_account_context(user_trade["exchange_account_id"])
 
-        account = query_one(
-            db,
-            "SELECT * FROM exchange_accounts WHERE id=%s",
-            (user_trade["exchange_account_id"],),
-        )
-        exchange = query_one(
-            db,
-            "SELECT * FROM exchanges WHERE id=%s",
-            (account["exchange_id"],),
-        )
+    print(f"[Bot {bot_id}] 使用交易所：{context['exchange_code']} 進行平倉")
 
-    params = json.loads(account["params"])
+    with metrics.span("client_build", context["exchange_code"]):
+        client = get_ccxt_client(
+            context["exchange_account_id"], context["exchange_code"], context["params"])
 
-    print(f"[Bot {bot_id}] 使用交易所：{exchange['code']} 進行平倉")
+    order_request = build_close_order(user_trade)
+    close_price = signal["price"]
 
-    client = build_ccxt_client(
-        exchange_code=exchange["code"],
-        api_key=params.get("api_key"),
-        secret_key=params.get("secret_key"),
-        passphrase=params.get("passphrase"),
+    print(
+        f"[Bot {bot_id}] 平倉 {user_trade['position_side']} {order_request['amount']} "
+        f"@ {close_price} ({order_request['side']})"
     )
-    client.set_sandbox_mode(bool(int(os.getenv("SANDBOX_MODE", 1))))
 
+    # 真正平倉下單
+    try:
+        with metrics.span("create_order", context["exchange_code"]):
+            order = submit_order(client, order_request, close_order_id(user_trade), context["exchange_code"])
+    except ccxt_errors.ExchangeError as e:
+        print(f"[Bot {bot_id}] 平倉下單失敗：{str(e)}")
+        record_close_error(user_trade, e, writer)
+        return None
+    except ccxt_errors.NetworkError as e:
+        # 逾時不代表交易所沒收到，不標 ERROR，先用 clientOrderId 記一筆 PENDING 留給查單處理
+        print(f"[Bot {bot_id}] 平倉下單沒有確認結果：{str(e)}")
+        return record_unconfirmed_close(user_trade, signal, order_request, writer)
+    except OrderInFlight as e:
+        print(f"[Bot {bot_id}] {e}")
+        return None
+
+    metrics.observe_signal_to_order(signal)
+    print(f"[Bot {bot_id}] 平倉下單交易所回應：", order)
+
+    return record_close_order(user_trade, signal, order_request, order, writer)
+
+
+def close_bot_positions_batch(user_trades, signal, client, exchange_code, writer=None):
+    """
+    同一個帳號的多個部位平倉，用 create_orders 一次送（user_trades 都要是 client 這個帳號開的）
+    回傳跟 user_trades 對齊的結果（失敗的是 None）
+    """
+    items = [(build_close_order(user_trade), close_order_id(user_trade)) for user_trade in user_trades]
+    print(f"[Batch] 帳號 {user_trades[0]['exchange_account_id']} {len(items)} 個 bot 一起平倉")
+    orders = submit_orders(client, items, exchange_code)
+
+    results = []
+    for user_trade, (order_request, _), order in zip(user_trades, items, orders):
+        bot_id = user_trade["bot_id"]
+        result = None
+        with log_context(bot_id=bot_id):
+            if isinstance(order, OrderInFlight):
+                print(f"[Bot {bot_id}] {order}")
+            elif isinstance(order, ccxt_errors.ExchangeError):
+                print(f"[Bot {bot_id}] 平倉下單失敗：{str(order)}")
+                record_close_error(user_trade, order, writer)
+            elif isinstance(order, Exception):
+                # 逾時不代表交易所沒收到，不標 ERROR，先用 clientOrderId 記一筆 PENDING 留給查單處理
+                print(f"[Bot {bot_id}] 平倉下單沒有確認結果：{str(order)}")
+                result = record_unconfirmed_close(user_trade, signal, order_request, writer)
+            else:
+                metrics.observe_signal_to_order(signal)
+                print(f"[Bot {bot_id}] 平倉下單交易所回應：", order)
+                result = record_close_order(user_trade, signal, order_request, order, writer)
+        results.append(result)
+    return results
+
+
+def build_close_order(user_trade):
+    """平倉要送給交易所 create_order 的參數（同步 / async 下單共用）"""
     # 要平掉的數量用 user_trades 的 quantity
     qty = float(user_trade["quantity"])
     position_side = user_trade["position_side"]  # LONG / SHORT
-    symbol = user_trade["exchange_symbol"]
 
     if position_side == "LONG":
         close_side = "buy"
     else:
         close_side = "sell"
 
-    close_price = signal["price"]
+    return {
+        "symbol": user_trade["exchange_symbol"],
+        "type": "market",
+        "side": close_side,
+        "amount": qty,
+        "params": {
+            "marginMode": "isolated",
+            "tradeSide": "close",  # ★ 關倉
+        },
+    }
 
-    print(f"[Bot {bot_id}] 平倉 {position_side} {qty} @ {close_price} ({close_side})")
 
-    # 真正平倉下單
-    try:
-        order = client.create_order(
-            symbol=symbol,
-            type="market",
-            side=close_side,
-            amount=qty,
-            params={
-                "marginMode": "isolated",
-                "tradeSide": "close",  # ★ 關倉
-            },
-        )
-    except ExchangeError as e:
-        print(f"[Bot {bot_id}] 平倉下單失敗：{str(e)}")
-        with get_db() as db:
-            execute(
-                db,
-                """
-                UPDATE user_trades
-                SET status='ERROR', error_message=%s, updated_at=%s
-                WHERE id=%s
-                """,
-                (str(e), now(), user_trade["id"]),
-            )
-        return None
+def close_order_id(user_trade):
+    """平倉的 clientOrderId：跟開倉同一個策略單 + bot（手動開的部位沒有策略單就用 user_trade id）"""
+    if user_trade.get("strategy_trade_id"):
+        return client_order_id(user_trade["strategy_trade_id"], user_trade["bot_id"], "CLOSE")
+    return client_order_id(f"u{user_trade['id']}", user_trade["bot_id"], "CLOSE")
 
-    print(f"[Bot {bot_id}] 平倉下單交易所回應：", order)
 
-    exchange_order_id = (
-        order.get("id")
-        or order.get("orderId")
-        or order.get("info", {}).get("orderId")
-    )
+def record_close_error(user_trade, error, writer=None):
+    with writer_scope(writer) as w:
+        w.update_trade(
+            user_trade["id"], status="ERROR", error_message=str(error), updated_at=now())
+
+
+def record_close_order(user_trade, signal, order_request, order, writer=None):
+    """寫入 CLOSE 訂單 + 將 user_trades 狀態標為 CLOSING（同步 / async 下單共用）"""
+    close_price = signal["price"]
+    qty = order_request["amount"]
+    exchange_order_id = get_exchange_order_id(order)
     order_status = order.get("status") or "NEW"
     filled = order.get("filled") or 0
 
-    # 2. 寫入 CLOSE 訂單 + 將 user_trades 狀態標為 CLOSING
-    with get_db() as db:
-        order_sql = """
-            INSERT INTO user_trade_orders
-            (user_trade_id, exchange_order_id, type, price,
-             requested_qty, filled_qty, status, raw_response,
-             created_at, updated_at)
-            VALUES (%s, %s, %s, %s,
-                    %s, %s, %s, %s,
-                    %s, %s)
-        """
-
-        insert_and_get_id(
-            db,
-            order_sql,
-            (
-                user_trade["id"],
-                exchange_order_id,
-                "CLOSE",
-                close_price,
-                qty,
-                float(filled),
-                order_status,
-                json.dumps(order),
-                now(),
-                now(),
-            ),
-        )
+    with writer_scope(writer) as w:
+        w.insert_order({
+            "user_trade_id": user_trade["id"],
+            "exchange_order_id": exchange_order_id,
+            "client_order_id": close_order_id(user_trade),
+            "type": "CLOSE",
+            "price": close_price,
+            "requested_qty": qty,
+            "filled_qty": float(filled),
+            "status": order_status,
+            "raw_response": inline_response(order),
+            "created_at": now(),
+            "updated_at": now(),
+        }, response_row("CLOSE", exchange_order_id, order, user_trade_id=user_trade["id"]))
 
         # 先把 user_trades 標記成 CLOSING，等查單後再設 CLOSED
-        execute(
-            db,
-            """
-            UPDATE user_trades
-            SET status='CLOSING', exit_price=%s, updated_at=%s
-            WHERE id=%s
-            """,
-            (close_price, now(), user_trade["id"]),
-        )
+        w.update_trade(
+            user_trade["id"], status="CLOSING", exit_price=close_price, updated_at=now())
 
-    print(f"[Bot {bot_id}] 已寫入 user_trade_orders (CLOSE)，user_trade {user_trade['id']} 標記為 CLOSING")
+    print(
+        f"[Bot {user_trade['bot_id']}] 已送出 user_trade_orders (CLOSE) 寫入，"
+        f"user_trade {user_trade['id']} 標記為 CLOSING"
+    )
 
     return {
         "user_trade_id": user_trade["id"],
         "exchange_order_id": exchange_order_id,
         "order_status": order_status,
     }
+
+
+def record_unconfirmed_close(user_trade, signal, order_request, writer=None):
+    """
+    平倉逾時 / 斷線、不知道交易所有沒有收到：照樣寫一筆 PENDING 的 CLOSE 單 + 標 CLOSING
+    exchange_order_id 先空著，對帳時用 clientOrderId 查回來；交易所確定沒有這張單會把部位改回 OPEN
+    """
+    close_price = signal["price"]
+
+    with writer_scope(writer) as w:
+        w.insert_order({
+            "user_trade_id": user_trade["id"],
+            "exchange_order_id": None,
+            "client_order_id": close_order_id(user_trade),
+            "type": "CLOSE",
+            "price": close_price,
+            "requested_qty": order_request["amount"],
+            "filled_qty": 0.0,
+            "status": "PENDING",
+            "raw_response": None,
+            "created_at": now(),
+            "updated_at": now(),
+        })
+        w.update_trade(
+            user_trade["id"], status="CLOSING", exit_price=close_price, updated_at=now())
+
+    print(
+        f"[Bot {user_trade['bot_id']}] 已送出 user_trade_orders (CLOSE, 結果不明) 寫入，"
+        f"user_trade {user_trade['id']} 標記為 CLOSING，等對帳用 clientOrderId 查"
+    )
+
+    return {
+        "user_trade_id": user_trade["id"],
+        "exchange_order_id": None,
+        "order_status": "PENDING",
+    }
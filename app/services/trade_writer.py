@@ -0,0 +1,376 @@
+from app.utils.db import get_db, query_one, query_all, execute_many, bulk_update, transaction
+from app.utils.metrics import metrics
+from app.utils.now import now
+from app.utils.redis_client import redis_conn
+from contextlib import contextmanager
+from collections import defaultdict, deque
+import base64
+import contextvars
+import json
+import os
+import threading
+import time
+from app.config import load_config
+
+load_config()
+
+# 背景 flush 的間隔（秒）與單次最多累積幾筆就提早 flush
+TRADE_WRITER_FLUSH_INTERVAL = float(os.getenv("TRADE_WRITER_FLUSH_INTERVAL", 0.5))
+TRADE_WRITER_MAX_BATCH = int(os.getenv("TRADE_WRITER_MAX_BATCH", 500))
+TRADE_WRITER_RETRIES = int(os.getenv("TRADE_WRITER_RETRIES", 2))
+
+# 逐筆重試後還是寫不進去的資料（JSON）放進 Redis list，由 replay_dead_letters_job 定期補寫
+DEAD_LETTER_KEY = "strade:trade_writer:dead_letter"
+# 讀不懂的（不是 JSON、格式不對）搬到這裡等人工處理，不會卡住補寫
+DEAD_LETTER_UNREADABLE_KEY = f"{DEAD_LETTER_KEY}:unreadable"
+
+USER_TRADE_COLUMNS = (
+    "user_id", "strategy_trade_id", "exchange_account_id", "bot_id", "exchange_symbol",
+    "position_side", "quantity", "leverage", "entry_price", "opened_at", "status",
+    "created_at", "updated_at",
+)
+
+USER_TRADE_ORDER_COLUMNS = (
+    "user_trade_id", "exchange_order_id", "client_order_id", "type", "price",
+    "requested_qty", "filled_qty", "status", "raw_response",
+    "created_at", "updated_at",
+)
+
+USER_TRADE_ORDER_RESPONSE_COLUMNS = (
+    "user_trade_id", "type", "exchange_order_id", "codec", "body", "created_at",
+)
+
+
+def _insert_sql(table, columns):
+    placeholders = ", ".join(["%s"] * len(columns))
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+
+
+class _Batch:
+    def __init__(self):
+        self.trades = []  # [(user_trade_row, order_row, result, response_row)]，user_trade_id 要 flush 後才知道
+        self.orders = []  # [order_row]，user_trade_id 已知
+        self.responses = []  # [response_row]，user_trade_id 已知（只會 INSERT，不會改）
+        self.order_updates = {}  # user_trade_orders.id -> {欄位: 值}
+        self.trade_updates = {}  # user_trades.id -> {欄位: 值}
+
+    def __len__(self):
+        return (
+            len(self.trades) + len(self.orders) + len(self.responses)
+            + len(self.order_updates) + len(self.trade_updates)
+        )
+
+    def split(self):
+        """拆成一筆一個 batch（批次失敗時逐筆重試用）"""
+        for item in self.trades:
+            batch = _Batch()
+            batch.trades.append(item)
+            yield batch
+        for item in self.orders:
+            batch = _Batch()
+            batch.orders.append(item)
+            yield batch
+        for item in self.responses:
+            batch = _Batch()
+            batch.responses.append(item)
+            yield batch
+        for key, fields in self.order_updates.items():
+            batch = _Batch()
+            batch.order_updates[key] = fields
+            yield batch
+        for key, fields in self.trade_updates.items():
+            batch = _Batch()
+            batch.trade_updates[key] = fields
+            yield batch
+
+
+class TradeWriter:
+    """
+    user_trades / user_trade_orders / user_trade_order_responses 的批次寫入器（write-behind）
+    - fan-out 的各 thread 只把要寫的資料丟進來，不碰 DB
+    - 背景每 flush_interval 秒（或累積 max_batch 筆）用一個 transaction 批次寫入：
+      multi-row INSERT + CASE 批次 UPDATE
+    - close() 會把剩下的全部寫完才回來，tick 結束前一定要呼叫
+    """
+
+    def __init__(self, flush_interval=TRADE_WRITER_FLUSH_INTERVAL, max_batch=TRADE_WRITER_MAX_BATCH):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.failed = []  # 逐筆重試後還是寫不進去的資料
+        self.flush_count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._batch = _Batch()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        if flush_interval:
+            # 背景 flush 沿用建立者的 context（log 欄位、tick 的耗時統計）
+            self._thread = threading.Thread(
+                target=contextvars.copy_context().run, args=(self._run,), name="trade-writer", daemon=True)
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # ---------- 收資料 ----------
+
+    def insert_trade(self, user_trade: dict, order: dict, result: dict, response: dict = None):
+        """
+        新增 user_trades + 第一筆 user_trade_orders，flush 後 result['user_trade_id'] 會被填上
+        response（raw_response_store.response_row）的 user_trade_id 也在 flush 時補上
+        """
+        self._add(lambda batch: batch.trades.append((user_trade, order, result, response)))
+        return result
+
+    def insert_order(self, order: dict, response: dict = None):
+        def apply(batch):
+            batch.orders.append(order)
+            if response:
+                batch.responses.append(response)
+        self._add(apply)
+
+    def insert_response(self, response: dict):
+        """完整的交易所回應另存一列（append-only）"""
+        if response:
+            self._add(lambda batch: batch.responses.append(response))
+
+    def update_order(self, user_trade_order_id, **fields):
+        self._add(lambda batch: batch.order_updates.setdefault(user_trade_order_id, {}).update(fields))
+
+    def update_trade(self, user_trade_id, **fields):
+        self._add(lambda batch: batch.trade_updates.setdefault(user_trade_id, {}).update(fields))
+
+    def _add(self, apply):
+        with self._lock:
+            apply(self._batch)
+            full = len(self._batch) >= self.max_batch
+        if full:
+            self._wakeup.set()
+
+    # ---------- 寫入 ----------
+
+    def flush(self):
+        """把目前累積的資料寫進 DB（同步，寫完才回來）"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._batch = self._batch, _Batch()
+            if not len(batch):
+                return 0
+
+            for attempt in range(TRADE_WRITER_RETRIES + 1):
+                try:
+                    with metrics.span("db_write"), get_db() as db, transaction(db):
+                        assigned = self._write(db, batch)
+                    self._assign_ids(assigned)
+                    self.flush_count += 1
+                    return len(batch)
+                except Exception as e:
+                    print(f"[TradeWriter] 批次寫入失敗（第 {attempt + 1} 次）：{e}")
+                    time.sleep(0.2 * (attempt + 1))
+
+            # 整批一直失敗就逐筆寫，避免一筆壞資料拖垮整批
+            written = 0
+            for single in batch.split():
+                try:
+                    with metrics.span("db_write"), get_db() as db, transaction(db):
+                        assigned = self._write(db, single)
+                    self._assign_ids(assigned)
+                    written += 1
+                except Exception as e:
+                    print(f"[TradeWriter] 寫入失敗，資料：{vars(single)} 錯誤：{e}")
+                    self.failed.append(single)
+                    _dead_letter(single, e)
+            self.flush_count += 1
+            return written
+
+    def failed_user_trade_ids(self):
+        """沒寫進去的 user_trade_id（開倉沒寫進去的連 id 都沒有，看 result['user_trade_id'] 是不是 None）"""
+        ids = set()
+        for batch in self.failed:
+            ids.update(order["user_trade_id"] for order in batch.orders)
+            ids.update(batch.trade_updates)
+        return ids
+
+    def close(self):
+        """停掉背景 flush，並把剩下的資料寫完"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[TradeWriter] 背景 flush 例外：{e}")
+
+    @staticmethod
+    def _assign_ids(assigned):
+        """commit 成功後才把 user_trade_id 回填給呼叫端"""
+        for result, user_trade_id in assigned:
+            result["user_trade_id"] = user_trade_id
+
+    @staticmethod
+    def _write(db, batch):
+        orders = list(batch.orders)
+        responses = list(batch.responses)
+        assigned = []
+
+        # 1. user_trades 批次 INSERT，再一次查回每個 bot 拿到的 id
+        if batch.trades:
+            max_id = query_one(db, "SELECT COALESCE(MAX(id), 0) AS max_id FROM user_trades")["max_id"]
+            execute_many(
+                db,
+                _insert_sql("user_trades", USER_TRADE_COLUMNS),
+                [tuple(trade[c] for c in USER_TRADE_COLUMNS) for trade, _, _, _ in batch.trades],
+            )
+
+            bot_ids = sorted({trade["bot_id"] for trade, _, _, _ in batch.trades})
+            placeholders = ", ".join(["%s"] * len(bot_ids))
+            rows = query_all(
+                db,
+                f"""
+                SELECT id, strategy_trade_id, bot_id FROM user_trades
+                WHERE id > %s AND bot_id IN ({placeholders})
+                ORDER BY id
+                """,
+                (max_id, *bot_ids),
+            )
+            ids = defaultdict(deque)
+            for row in rows:
+                ids[(row["strategy_trade_id"], row["bot_id"])].append(row["id"])
+
+            for trade, order, result, response in batch.trades:
+                user_trade_id = ids[(trade["strategy_trade_id"], trade["bot_id"])].popleft()
+                assigned.append((result, user_trade_id))
+                orders.append(dict(order, user_trade_id=user_trade_id))
+                if response:
+                    responses.append(dict(response, user_trade_id=user_trade_id))
+
+        # 2. user_trade_orders 批次 INSERT
+        execute_many(
+            db,
+            _insert_sql("user_trade_orders", USER_TRADE_ORDER_COLUMNS),
+            [tuple(order[c] for c in USER_TRADE_ORDER_COLUMNS) for order in orders],
+        )
+
+        # 3. 完整回應另存（壓縮過的 blob，不佔 user_trade_orders 的空間）
+        execute_many(
+            db,
+            _insert_sql("user_trade_order_responses", USER_TRADE_ORDER_RESPONSE_COLUMNS),
+            [tuple(response[c] for c in USER_TRADE_ORDER_RESPONSE_COLUMNS) for response in responses],
+        )
+
+        # 4. 批次 UPDATE（同一組欄位的合成一句 CASE）
+        for table, updates in (
+            ("user_trade_orders", batch.order_updates),
+            ("user_trades", batch.trade_updates),
+        ):
+            groups = defaultdict(list)
+            for row_id, fields in updates.items():
+                groups[tuple(sorted(fields))].append(dict(fields, id=row_id))
+            for rows in groups.values():
+                bulk_update(db, table, rows)
+
+        return assigned
+
+
+def _dead_letter(batch, error):
+    try:
+        # datetime / Decimal 轉成字串（MySQL 照樣收），壓縮過的完整回應轉 base64
+        item = json.dumps({"batch": _batch_to_json(batch), "error": str(error), "failed_at": now()}, default=str)
+        redis_conn.rpush(DEAD_LETTER_KEY, item)
+    except Exception as e:
+        print(f"[TradeWriter] 放進 dead-letter 也失敗，只剩上面的 log：{e}")
+
+
+def _batch_to_json(batch):
+    return {
+        "trades": [[trade, order, _response_to_json(response)] for trade, order, _, response in batch.trades],
+        "orders": batch.orders,
+        "responses": [_response_to_json(response) for response in batch.responses],
+        "order_updates": list(batch.order_updates.items()),
+        "trade_updates": list(batch.trade_updates.items()),
+    }
+
+
+def _batch_from_json(data):
+    batch = _Batch()
+    # 補寫時沒有人在等 result，給一個空 dict 就好
+    batch.trades = [(trade, order, {}, _response_from_json(response)) for trade, order, response in data["trades"]]
+    batch.orders = data["orders"]
+    batch.responses = [_response_from_json(response) for response in data["responses"]]
+    batch.order_updates = dict(data["order_updates"])
+    batch.trade_updates = dict(data["trade_updates"])
+    return batch
+
+
+def _response_to_json(response):
+    if not response:
+        return response
+    return dict(response, body=base64.b64encode(response["body"]).decode())
+
+
+def _response_from_json(response):
+    if not response:
+        return response
+    return dict(response, body=base64.b64decode(response["body"]))
+
+
+def replay_dead_letters():
+    """
+    把 dead-letter 裡的資料一筆一筆補寫（每筆都是 split 過的單筆 batch）
+    這一輪最多看一圈：寫不進去的放回隊尾，下一輪再試，不會卡住後面的
+    回傳 (補寫成功, 還是失敗)
+    """
+    written = 0
+    failed = 0
+    for _ in range(redis_conn.llen(DEAD_LETTER_KEY)):
+        raw = redis_conn.lpop(DEAD_LETTER_KEY)
+        if raw is None:
+            break
+        try:
+            item = json.loads(raw)
+            batch = _batch_from_json(item["batch"])
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"[TradeWriter] dead-letter 有一筆讀不懂，搬到 {DEAD_LETTER_UNREADABLE_KEY} 等人工處理：{e}")
+            redis_conn.rpush(DEAD_LETTER_UNREADABLE_KEY, raw)
+            failed += 1
+            continue
+        try:
+            with metrics.span("db_write"), get_db() as db, transaction(db):
+                TradeWriter._write(db, batch)
+            written += 1
+        except Exception as e:
+            print(f"[TradeWriter] dead-letter 補寫失敗（{item['failed_at']} 進來的）：{e}")
+            redis_conn.rpush(DEAD_LETTER_KEY, raw)
+            failed += 1
+    if written or failed:
+        print(f"[TradeWriter] dead-letter 補寫 {written} 筆，還有 {failed} 筆寫不進去")
+    return written, failed
+
+
+@contextmanager
+def writer_scope(writer=None):
+    """有傳 writer 就沿用（等呼叫端統一 flush）；沒傳就開一個用完馬上寫入"""
+    if writer is not None:
+        yield writer
+        return
+
+    writer = TradeWriter(flush_interval=None)
+    yield writer
+    writer.flush()
+    if writer.failed:
+        raise Exception(f"寫入 DB 失敗 {len(writer.failed)} 筆")
@@ -0,0 +1,88 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# 各入口 import 完的時間上限（ms），超過就算退步
+# 量的是 python -X importtime 的累計時間，取幾次裡最快的一次，減少機器忙碌造成的誤差
+STARTUP_BUDGETS_MS = {
+    "app.worker": 500,
+    "app.main_scheduler": 600,
+    "app.fill_listener": 600,
+    "app.worker_jobs": 600,
+}
+
+
+def measure(module, runs=3):
+    """回傳 (最快一次的總時間 ms, 那一次每個模組的 [(累計 ms, 自身 ms, 模組名)])"""
+    best = None
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True,
+            text=True,
+            env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+        )
+        if proc.returncode != 0:
+            raise Exception(f"import {module} 失敗：\n{proc.stderr[-2000:]}")
+
+        rows = _parse(proc.stderr)
+        total = next((cumulative for cumulative, _, name in rows if name == module), None)
+        if total is None:
+            raise Exception(f"importtime 輸出裡找不到 {module}")
+        if best is None or total < best[0]:
+            best = (total, rows)
+    return best
+
+
+def _parse(stderr):
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us) / 1000, int(self_us) / 1000, name.strip()))
+    return rows
+
+
+def check(budgets, runs=3, top=10):
+    """每個入口量一次，印出最慢的幾個 import，回傳超過預算的入口"""
+    over = []
+    for module, budget in budgets.items():
+        total, rows = measure(module, runs)
+        status = "OK" if total <= budget else "超過"
+        print(f"[StartupBudget] {module}: {total:.0f} ms / 預算 {budget:.0f} ms {status}")
+
+        slowest = sorted((row for row in rows if row[2] != module), reverse=True)[:top]
+        for cumulative, self_ms, name in slowest:
+            print(f"    {cumulative:8.1f} ms（自身 {self_ms:6.1f} ms）{name}")
+
+        if total > budget:
+            over.append(module)
+    return over
+
+
+def main():
+    parser = argparse.ArgumentParser(description="檢查各入口的 import 時間有沒有超過預算")
+    parser.add_argument("modules", nargs="*", help="只檢查這些入口（預設全部）")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="每個入口列出最慢的幾個 import")
+    parser.add_argument("--scale", type=float, default=float(os.getenv("STARTUP_BUDGET_SCALE", 1)),
+                        help="預算倍率（CI 機器比較慢時調大）")
+    args = parser.parse_args()
+
+    budgets = {
+        module: budget * args.scale
+        for module, budget in STARTUP_BUDGETS_MS.items()
+        if not args.modules or module in args.modules
+    }
+    over = check(budgets, args.runs, args.top)
+
+    if over:
+        print(f"[StartupBudget] 超過預算：{', '.join(over)}")
+        sys.exit(1)
+    print("[StartupBudget] 全部在預算內")
+
+
+if __name__ == "__main__":
+    main()
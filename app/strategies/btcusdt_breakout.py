@@ -1,24 +1,49 @@
 from app.utils.db import get_db, query_one
-import pandas_ta as ta
-
-def breakout_strategy(df):
-    look_back = 32
-    adx_period = 14
-    adx_threshold = 25
-    take_profit = 1.05
-
-    df['adx'] = ta.adx(df['high'], df['low'], df['close'], length=adx_period)[f'ADX_{adx_period}']
-    df['highest'] = df['high'].rolling(look_back).max().shift(1)
-    df['lowest'] = df['low'].rolling(look_back).min().shift(1)
-
-    adx = df['adx'].iloc[-1]
-    price = df['close'].iloc[-1]
-    highest = df['highest'].iloc[-1]
-    lowest = df['lowest'].iloc[-1]
+from app.utils.redis_client import redis_conn
+from app.strategies.indicators import BreakoutIndicators, adx_arrays, rolling_extreme_prev
+import json
+import threading
+import numpy as np
+
+# 策略參數（回測 / 調參會帶不同的值進來）
+BREAKOUT_PARAMS = {
+    "look_back": 32,
+    "adx_period": 14,
+    "adx_threshold": 25,
+    "take_profit": 1.05,
+}
+
+_indicators = {}  # checkpoint key -> BreakoutIndicators
+_indicators_lock = threading.Lock()
+
+# open_trade 沒帶的時候策略自己查 DB
+NOT_LOADED = object()
+
+
+def breakout_strategy(df, strategy_id=1, params=None, open_trade=NOT_LOADED):
+    """
+    open_trade：這個策略還沒出場的 strategy_trades（scheduler 一次查好所有策略的，沒有就是 None）
+    """
+    params = {**BREAKOUT_PARAMS, **(params or {})}
+    look_back = params["look_back"]
+    adx_period = params["adx_period"]
+    adx_threshold = params["adx_threshold"]
+    take_profit = params["take_profit"]
+
+    # 指標逐根更新，只處理上個 tick 之後新收盤的 K 線
+    values = update_breakout_indicators(df, f"strategy:{strategy_id}", look_back, adx_period)
+
+    adx = values['adx']
+    price = values['price']
+    highest = values['highest']
+    lowest = values['lowest']
     regime = adx > adx_threshold
 
-    with get_db() as db:
-        last_order = query_one(db, "SELECT * FROM strategy_trades WHERE strategy_id=1 AND exit_at is null")
+    if open_trade is NOT_LOADED:
+        with get_db() as db:
+            open_trade = query_one(
+                db, "SELECT * FROM strategy_trades WHERE strategy_id=%s AND exit_at is null", (strategy_id,))
+    last_order = open_trade
 
     # 停利條件
     if last_order and price > float(last_order['entry_price']) * take_profit:
@@ -37,3 +62,67 @@ def breakout_strategy(df):
     else:
         print(f'BTCUSDT Breakout 盤整不動作(ADX < {adx_threshold}) 價格：{price} HIGHEST={highest:.2f}, LOWEST={lowest:.2f} ADX={adx:.2f}')
         return None
+
+
+def breakout_signals(high, low, close, look_back=32, adx_period=14, adx_threshold=25, take_profit=1.05):
+    """
+    回測用：整段 K 線一次算出每根的進出場條件（規則跟 breakout_strategy 一樣）
+    - entries：趨勢盤（ADX > 門檻）且收盤突破前 look_back 根最高
+    - exits：趨勢盤且收盤跌破前 look_back 根最低
+    - 停利（收盤 > 進場價 * take_profit）跟進場價有關，交給回測引擎處理
+    """
+    adx = adx_arrays(high, low, close, adx_period)["adx"]
+    highest = rolling_extreme_prev(high, look_back, "max")
+    lowest = rolling_extreme_prev(low, look_back, "min")
+    close = np.asarray(close, dtype=float)
+
+    with np.errstate(invalid="ignore"):
+        regime = adx > adx_threshold
+        return {
+            "entries": regime & (close > highest),
+            "exits": regime & (close < lowest),
+            "take_profit": take_profit,
+        }
+
+
+def update_breakout_indicators(df, checkpoint_key, look_back, adx_period):
+    """
+    從 process 裡的指標狀態接著算；process 剛啟動就從 Redis 的 checkpoint 接回來
+    算完把狀態存回 Redis，重啟也不用重新暖機
+    """
+    timestamps = df['timestamp'].dt.as_unit('ms').to_numpy(dtype='int64')
+    high = df['high'].to_numpy(dtype=float)
+    low = df['low'].to_numpy(dtype=float)
+    close = df['close'].to_numpy(dtype=float)
+
+    with _indicators_lock:
+        indicators = _indicators.get(checkpoint_key)
+        if indicators is None or (indicators.look_back, indicators.adx_period) != (look_back, adx_period):
+            indicators = BreakoutIndicators(look_back, adx_period)
+            _load_checkpoint(indicators, checkpoint_key)
+            _indicators[checkpoint_key] = indicators
+
+        values = indicators.update(timestamps, high, low, close)
+        _save_checkpoint(indicators, checkpoint_key)
+
+    return values
+
+
+def _checkpoint_redis_key(checkpoint_key):
+    return f"strade:indicators:{checkpoint_key}"
+
+
+def _load_checkpoint(indicators, checkpoint_key):
+    try:
+        raw = redis_conn.get(_checkpoint_redis_key(checkpoint_key))
+        if raw:
+            indicators.load_state_dict(json.loads(raw))
+    except Exception as e:
+        print(f"[Indicators] 讀取 {checkpoint_key} checkpoint 失敗，從頭計算：{e}")
+
+
+def _save_checkpoint(indicators, checkpoint_key):
+    try:
+        redis_conn.set(_checkpoint_redis_key(checkpoint_key), json.dumps(indicators.state_dict()))
+    except Exception as e:
+        print(f"[Indicators] 寫入 {checkpoint_key} checkpoint 失敗：{e}")
@@ -0,0 +1,291 @@
+from collections import deque
+from numpy.lib.stride_tricks import sliding_window_view
+import math
+import numpy as np
+import pandas as pd
+
+NAN = float("nan")
+
+
+class Ewm:
+    """
+    逐筆更新的指數移動平均，算法跟 pandas 的 ewm(alpha=..., min_periods=..., adjust=True).mean() 一樣
+    pandas_ta 的 rma（Wilder 平滑）就是 ewm(alpha=1/length, min_periods=length)
+    """
+
+    def __init__(self, alpha, min_periods=0):
+        self.alpha = alpha
+        self.min_periods = min_periods
+        self.weighted = NAN
+        self.old_wt = 1.0
+        self.nobs = 0
+
+    def peek(self, value):
+        """如果再進一筆 value 會得到的值（不改狀態）"""
+        return self._step(value, commit=False)
+
+    def update(self, value):
+        return self._step(value, commit=True)
+
+    def _step(self, value, commit):
+        weighted, old_wt, nobs = self.weighted, self.old_wt, self.nobs
+        is_observation = not math.isnan(value)
+        nobs += is_observation
+
+        if not math.isnan(weighted):
+            old_wt *= 1 - self.alpha
+            if is_observation:
+                if weighted != value:
+                    weighted = (old_wt * weighted + value) / (old_wt + 1)
+                old_wt += 1
+        elif is_observation:
+            weighted = value
+
+        if commit:
+            self.weighted, self.old_wt, self.nobs = weighted, old_wt, nobs
+        return weighted if nobs >= self.min_periods else NAN
+
+    def state_dict(self):
+        return {"weighted": _dump(self.weighted), "old_wt": self.old_wt, "nobs": self.nobs}
+
+    def load_state_dict(self, state):
+        self.weighted = _load(state["weighted"])
+        self.old_wt = state["old_wt"]
+        self.nobs = state["nobs"]
+
+
+class RollingExtreme:
+    """
+    滾動最高 / 最低（等同 rolling(window).max() / min()），單調 deque 每筆 O(1) 攤提
+    值放在長度 window 的 NumPy ring buffer，deque 只存絕對位置
+    """
+
+    def __init__(self, window, mode="max"):
+        self.window = window
+        self.mode = mode
+        self.values = np.full(window, np.nan)
+        self.positions = deque()
+        self.count = 0
+
+    def current(self):
+        """最近 window 筆的極值，不滿 window 筆就是 NaN"""
+        if self.count < self.window:
+            return NAN
+        return float(self.values[self.positions[0] % self.window])
+
+    def update(self, value):
+        position = self.count
+        self.values[position % self.window] = value
+        while self.positions and not self._keeps(self.values[self.positions[-1] % self.window], value):
+            self.positions.pop()
+        self.positions.append(position)
+        self.count += 1
+        while self.positions[0] <= self.count - 1 - self.window:
+            self.positions.popleft()
+        return self.current()
+
+    def _keeps(self, older, newer):
+        return older > newer if self.mode == "max" else older < newer
+
+    def state_dict(self):
+        return {
+            "values": [_dump(v) for v in self.values.tolist()],
+            "positions": list(self.positions),
+            "count": self.count,
+        }
+
+    def load_state_dict(self, state):
+        self.values = np.array([_load(v) for v in state["values"]], dtype=float)
+        self.positions = deque(state["positions"])
+        self.count = state["count"]
+
+
+class AdxState:
+    """
+    ATR / +DI / -DI / DX / ADX 逐根更新，公式跟 pandas_ta.adx（mamode=rma, drift=1）一樣
+    - TR 用前一根收盤，第一根沒有前一根所以是 NaN
+    - ATR、+DM、-DM、DX 都是 rma
+    """
+
+    def __init__(self, length=14, scalar=100):
+        self.length = length
+        self.scalar = scalar
+        alpha = 1 / length
+        self.atr = Ewm(alpha, length)
+        self.dm_plus = Ewm(alpha, length)
+        self.dm_minus = Ewm(alpha, length)
+        self.adx = Ewm(alpha, length)
+        self.prev = None  # 前一根 (high, low, close)
+
+    def peek(self, high, low, close):
+        return self._step(high, low, close, commit=False)
+
+    def update(self, high, low, close):
+        return self._step(high, low, close, commit=True)
+
+    def _step(self, high, low, close, commit):
+        if self.prev is None:
+            tr = up = down = NAN
+        else:
+            prev_high, prev_low, prev_close = self.prev
+            tr = max(high - low, abs(high - prev_close), abs(prev_close - low))
+            up = high - prev_high
+            down = prev_low - low
+
+        pos = up if (up > down and up > 0) else (NAN if math.isnan(up) else 0.0)
+        neg = down if (down > up and down > 0) else (NAN if math.isnan(down) else 0.0)
+
+        step = (lambda ewm, v: ewm.update(v)) if commit else (lambda ewm, v: ewm.peek(v))
+        atr = step(self.atr, tr)
+        k = self.scalar / atr if atr else NAN
+        dmp = k * step(self.dm_plus, pos)
+        dmn = k * step(self.dm_minus, neg)
+        total = dmp + dmn
+        dx = self.scalar * abs(dmp - dmn) / total if total else NAN
+        adx = step(self.adx, dx)
+
+        if commit:
+            self.prev = (high, low, close)
+        return {"atr": atr, "dmp": dmp, "dmn": dmn, "dx": dx, "adx": adx}
+
+    def state_dict(self):
+        return {
+            "atr": self.atr.state_dict(),
+            "dm_plus": self.dm_plus.state_dict(),
+            "dm_minus": self.dm_minus.state_dict(),
+            "adx": self.adx.state_dict(),
+            "prev": list(self.prev) if self.prev else None,
+        }
+
+    def load_state_dict(self, state):
+        self.atr.load_state_dict(state["atr"])
+        self.dm_plus.load_state_dict(state["dm_plus"])
+        self.dm_minus.load_state_dict(state["dm_minus"])
+        self.adx.load_state_dict(state["adx"])
+        self.prev = tuple(state["prev"]) if state["prev"] else None
+
+
+class BreakoutIndicators:
+    """
+    breakout_strategy 用的指標：ADX + 前 look_back 根（不含當根）的最高 / 最低
+    - 已收盤的 K 線 commit 進狀態，最後一根（還沒收完）只 peek
+    - 每個 tick 只處理新收盤的 K 線，state_dict 存起來重啟後不用重新暖機
+    - ADX 是從第一根開始平滑，歷史比 DataFrame 長時數值會跟只拿 100 根算的 pandas_ta 有極小差異
+    """
+
+    def __init__(self, look_back=32, adx_period=14):
+        self.look_back = look_back
+        self.adx_period = adx_period
+        self.reset()
+
+    def reset(self):
+        self.adx = AdxState(self.adx_period)
+        self.highest = RollingExtreme(self.look_back, "max")
+        self.lowest = RollingExtreme(self.look_back, "min")
+        self.last_ts = None
+
+    def update(self, timestamps, high, low, close):
+        """
+        timestamps / high / low / close：由舊到新，最後一根視為還沒收盤
+        回傳最後一根的 {"adx", "highest", "lowest", "price"}
+        """
+        closed = len(timestamps) - 1
+        start = self._resume_index(timestamps, closed)
+
+        for i in range(start, closed):
+            self._commit(timestamps[i], high[i], low[i], close[i])
+
+        return {
+            "adx": self.adx.peek(float(high[-1]), float(low[-1]), float(close[-1]))["adx"],
+            "highest": self.highest.current(),
+            "lowest": self.lowest.current(),
+            "price": float(close[-1]),
+        }
+
+    def _resume_index(self, timestamps, closed):
+        """從哪一根開始 commit；上次最後一根不在這批資料裡（斷太久）就整個重算"""
+        if self.last_ts is not None:
+            index = int(np.searchsorted(timestamps[:closed], self.last_ts))
+            if index < closed and int(timestamps[index]) == self.last_ts:
+                return index + 1
+        self.reset()
+        return 0
+
+    def _commit(self, ts, high, low, close):
+        high, low, close = float(high), float(low), float(close)
+        self.adx.update(high, low, close)
+        self.highest.update(high)
+        self.lowest.update(low)
+        self.last_ts = int(ts)
+
+    def state_dict(self):
+        return {
+            "look_back": self.look_back,
+            "adx_period": self.adx_period,
+            "last_ts": self.last_ts,
+            "adx": self.adx.state_dict(),
+            "highest": self.highest.state_dict(),
+            "lowest": self.lowest.state_dict(),
+        }
+
+    def load_state_dict(self, state):
+        """參數不同的舊 checkpoint 直接丟掉"""
+        if state.get("look_back") != self.look_back or state.get("adx_period") != self.adx_period:
+            self.reset()
+            return False
+        self.adx.load_state_dict(state["adx"])
+        self.highest.load_state_dict(state["highest"])
+        self.lowest.load_state_dict(state["lowest"])
+        self.last_ts = state["last_ts"]
+        return True
+
+
+def _dump(value):
+    """JSON 沒有 NaN，存成 None"""
+    return None if value is None or math.isnan(value) else value
+
+
+def _load(value):
+    return NAN if value is None else value
+
+
+# ---------- 整段陣列一次算（回測用），公式跟上面逐根更新的版本一樣 ----------
+
+def rma(values, length):
+    """Wilder 平滑：pandas ewm(alpha=1/length, min_periods=length, adjust=True)"""
+    return pd.Series(values).ewm(alpha=1 / length, min_periods=length).mean().to_numpy()
+
+
+def adx_arrays(high, low, close, length=14, scalar=100):
+    """回傳 {"atr", "dmp", "dmn", "dx", "adx"}，每個都是跟輸入等長的 ndarray"""
+    high = np.asarray(high, dtype=float)
+    low = np.asarray(low, dtype=float)
+    close = np.asarray(close, dtype=float)
+
+    prev_close = np.concatenate(([np.nan], close[:-1]))
+    tr = np.nanmax(np.abs(np.vstack((high - low, high - prev_close, prev_close - low))), axis=0)
+    tr[0] = np.nan
+
+    up = np.concatenate(([np.nan], high[1:] - high[:-1]))
+    down = np.concatenate(([np.nan], low[:-1] - low[1:]))
+    pos = np.where((up > down) & (up > 0), up, 0.0)
+    neg = np.where((down > up) & (down > 0), down, 0.0)
+    pos[0] = neg[0] = np.nan
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        atr = rma(tr, length)
+        k = scalar / atr
+        dmp = k * rma(pos, length)
+        dmn = k * rma(neg, length)
+        dx = scalar * np.abs(dmp - dmn) / (dmp + dmn)
+    return {"atr": atr, "dmp": dmp, "dmn": dmn, "dx": dx, "adx": rma(dx, length)}
+
+
+def rolling_extreme_prev(values, window, mode="max"):
+    """前 window 根（不含當根）的最高 / 最低，等同 rolling(window).max().shift(1)"""
+    values = np.asarray(values, dtype=float)
+    result = np.full(len(values), np.nan)
+    if len(values) > window:
+        windows = sliding_window_view(values[:-1], window)
+        result[window:] = windows.max(axis=1) if mode == "max" else windows.min(axis=1)
+    return result
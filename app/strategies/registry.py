@@ -0,0 +1,26 @@
+import importlib
+import threading
+
+# strategies.code -> "模組:函式"，函式簽名 fn(df, strategy_id, params, open_trade)，回傳訊號或 None
+# 用到才 import（策略模組會帶進 numpy / pandas）
+STRATEGIES = {
+    "btcusdt_breakout": "app.strategies.btcusdt_breakout:breakout_strategy",
+}
+
+# strategies 沒有 code 欄位（或是空的）就用這個
+DEFAULT_STRATEGY = "btcusdt_breakout"
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def get_strategy(code=None):
+    code = code or DEFAULT_STRATEGY
+    if code not in STRATEGIES:
+        raise Exception(f"不支援的策略: {code}")
+
+    with _lock:
+        if code not in _loaded:
+            module_name, func_name = STRATEGIES[code].split(":")
+            _loaded[code] = getattr(importlib.import_module(module_name), func_name)
+        return _loaded[code]
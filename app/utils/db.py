@@ -1,36 +1,232 @@
 import pymysql
+from pymysql.constants import SERVER_STATUS
 from pymysql.cursors import DictCursor
 import os
-from dotenv import load_dotenv
+import threading
+import time
+from contextlib import contextmanager
+from app.config import load_config
+
+load_config()
+
+# 連線池設定
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 20))
+DB_POOL_MAX_LIFETIME = int(os.getenv("DB_POOL_MAX_LIFETIME", 3600))  # 秒，超過就關掉重開
+DB_POOL_WAIT_TIMEOUT = float(os.getenv("DB_POOL_WAIT_TIMEOUT", 10))  # 秒，池子滿了最多等多久
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", 5))  # 秒，閒置超過就先 ping 再借出（0 = 每次都 ping）
+
+
+class PoolTimeout(Exception):
+    """等不到可用的連線"""
+
+
+def connect(database=None):
+    """開一條新連線（連線池、migration 都用這個）；database 不給就連 DB_NAME"""
+    return pymysql.connect(
+        host=os.getenv("DB_HOST", "127.0.0.1"),
+        port=int(os.getenv("DB_PORT", "3306")),
+        user=os.getenv("DB_USERNAME", "root"),
+        password=os.getenv("DB_PASSWORD", ""),
+        database=database or os.getenv("DB_NAME", "strade"),
+        cursorclass=DictCursor,
+        autocommit=True,
+    )
+
+
+class ConnectionPool:
+    """
+    有上限、thread-safe 的 MySQL 連線池
+    - 借出前閒置太久會先 ping，死掉就換一條
+    - 連線活超過 max_lifetime 就關掉重開
+    - 池子滿了最多等 wait_timeout 秒，等不到丟 PoolTimeout
+    """
+
+    def __init__(
+        self,
+        connect=connect,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        max_lifetime=DB_POOL_MAX_LIFETIME,
+        wait_timeout=DB_POOL_WAIT_TIMEOUT,
+        ping_after=DB_POOL_PING_AFTER,
+    ):
+        self._connect = connect
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.wait_timeout = wait_timeout
+        self.ping_after = ping_after
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, created_at, released_at)]，後進先出
+        self._created_at = {}  # id(conn) -> created_at
+        self._size = 0  # 已開的連線數（閒置 + 借出）
+
+    def fill(self):
+        """先開好 min_size 條連線"""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append((conn, self._created_at[id(conn)], time.monotonic()))
+                self._cond.notify()
+
+    def acquire(self):
+        deadline = time.monotonic() + self.wait_timeout
+
+        while True:
+            entry = None
+            with self._cond:
+                while True:
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(
+                            f"等待 DB 連線逾時（{self.wait_timeout}s，max_size={self.max_size}）"
+                        )
+                    self._cond.wait(remaining)
+
+            if entry is None:
+                try:
+                    return self._open()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            conn, created_at, released_at = entry
+            if self._is_usable(conn, created_at, released_at):
+                return conn
+
+            # 壞掉或太老的連線丟掉，再借一次
+            self._discard(conn)
+
+    def release(self, conn, broken=False):
+        created_at = self._created_at.get(id(conn))
+        if created_at is None:
+            # 不是這個池子開的連線，直接關掉
+            self._close_quietly(conn)
+            return
+
+        if not broken and conn.open and conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            # 借用者沒收尾的交易要 rollback，不然下一個人會接到半套資料
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+
+        expired = time.monotonic() - created_at > self.max_lifetime
+        if broken or expired or not conn.open:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {"size": self._size, "idle": len(self._idle), "max_size": self.max_size}
+
+    def _open(self):
+        conn = self._connect()
+        self._created_at[id(conn)] = time.monotonic()
+        return conn
+
+    def _is_usable(self, conn, created_at, released_at):
+        if not conn.open:
+            return False
+        if time.monotonic() - created_at > self.max_lifetime:
+            return False
+        if time.monotonic() - released_at >= self.ping_after:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def _discard(self, conn):
+        self._created_at.pop(id(conn), None)
+        self._close_quietly(conn)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except:
+            pass
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """每個 process 一個池子（RQ fork 出來的子行程不能沿用父行程的連線）"""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                pool = ConnectionPool()
+                try:
+                    pool.fill()
+                except Exception as e:
+                    print(f"[DB] 預先建立連線失敗，改成用到時再連：{e}")
+                _pool, _pool_pid = pool, pid
+    return _pool
+
+
+def install_pool(pool):
+    """換掉這個 process 的連線池（benchmark 接 sqlite 替身用）"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        _pool, _pool_pid = pool, os.getpid()
 
-load_dotenv()
 
 class DatabaseConnection:
-    """讓你可以用 with get_db() as db 取得自動關閉的 MySQL 連線"""
+    """讓你可以用 with get_db() as db 從連線池借一條 MySQL 連線，用完自動還回去"""
 
     def __init__(self):
-        self.conn = pymysql.connect(
-            host=os.getenv("DB_HOST", "127.0.0.1"),
-            port=int(os.getenv("DB_PORT", "3306")),
-            user=os.getenv("DB_USERNAME", "root"),
-            password=os.getenv("DB_PASSWORD", ""),
-            database=os.getenv("DB_NAME", "strade"),
-            cursorclass=DictCursor,
-            autocommit=True,
-        )
+        self.pool = get_pool()
+        self.conn = self.pool.acquire()
 
     def __enter__(self):
         return self.conn
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        try:
-            self.conn.close()
-        except:
-            pass
+        broken = exc_type is not None and issubclass(
+            exc_type, (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+        )
+        self.pool.release(self.conn, broken=broken)
 
 
 def get_db():
-    """用 with 自動 close connection"""
+    """用 with 自動歸還 connection"""
     return DatabaseConnection()
 
 
@@ -59,3 +255,46 @@ def insert_and_get_id(db, sql, params=None):
     with db.cursor() as cursor:
         cursor.execute(sql, params)
         return cursor.lastrowid
+
+
+def execute_many(db, sql, seq_params):
+    """批次執行同一句 INSERT（pymysql 會合併成一句 multi-row INSERT）"""
+    if not seq_params:
+        return 0
+    with db.cursor() as cursor:
+        return cursor.executemany(sql, seq_params)
+
+
+def bulk_update(db, table, rows, key="id"):
+    """
+    用 CASE 一次更新多筆，rows = [{key: ..., 欄位: 值, ...}]
+    每筆要更新的欄位要一樣（不一樣的請先分組）
+    """
+    if not rows:
+        return
+    columns = [c for c in rows[0] if c != key]
+    params = []
+    set_parts = []
+    for column in columns:
+        cases = []
+        for row in rows:
+            cases.append("WHEN %s THEN %s")
+            params.extend([row[key], row[column]])
+        set_parts.append(f"{column} = CASE {key} {' '.join(cases)} END")
+    placeholders = ", ".join(["%s"] * len(rows))
+    params.extend(row[key] for row in rows)
+    sql = f"UPDATE {table} SET {', '.join(set_parts)} WHERE {key} IN ({placeholders})"
+    execute(db, sql, params)
+
+
+@contextmanager
+def transaction(db):
+    """with transaction(db): 裡面的語句一起 commit，出錯就 rollback"""
+    db.begin()
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    else:
+        db.commit()
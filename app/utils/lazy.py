@@ -0,0 +1,21 @@
+import importlib
+
+
+class LazyModule:
+    """
+    第一次用到屬性時才真的 import（pandas / ccxt 這種很重、又不是每個入口都用得到的模組）
+    用法：pd = LazyModule("pandas")，之後照常 pd.DataFrame(...)
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
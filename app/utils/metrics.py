@@ -0,0 +1,309 @@
+from app.logger import current_log_context
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import contextvars
+import json
+import os
+import threading
+import time
+from app.config import load_config
+
+load_config()
+
+# /metrics 的 port，0 = 不開
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+
+# RQ work horse 每個 job 跑完把 histogram 累加到這個 Redis hash，scheduler 的 /metrics 一起輸出
+WORKER_METRICS_KEY = "strade:metrics:workers"
+
+# histogram 的分界（秒），從 DB 查詢（幾 ms）到交易所下單逾時（10 秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# 每個 stage 一律帶 exchange label（從 log_context 拿，沒有就空字串）
+STAGE_METRIC = "strade_stage_seconds"
+BOT_METRIC = "strade_bot_signal_to_order_seconds"
+
+HELP = {
+    STAGE_METRIC: "Tick pipeline stage latency",
+    BOT_METRIC: "Seconds from strategy signal to exchange order acknowledgement, per bot",
+}
+
+_recorder = contextvars.ContextVar("tick_recorder", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最後一格是 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class TickRecorder:
+    """一個 tick 裡所有 span 的原始耗時，tick 結束算 p50 / p95 / p99"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}  # (stage, exchange) -> [seconds]
+
+    def add(self, stage, exchange, seconds):
+        with self._lock:
+            self.samples.setdefault((stage, exchange), []).append(seconds)
+
+    def summary(self):
+        """{"stages": {stage: 分位數}, "exchanges": {exchange: {stage: 分位數}}}，單位 ms"""
+        with self._lock:
+            samples = {key: list(values) for key, values in self.samples.items()}
+
+        by_stage = {}
+        by_exchange = {}
+        for (stage, exchange), values in samples.items():
+            by_stage.setdefault(stage, []).extend(values)
+            if exchange:
+                by_exchange.setdefault(exchange, {})[stage] = _percentiles(values)
+
+        return {
+            "stages": {stage: _percentiles(values) for stage, values in by_stage.items()},
+            "exchanges": by_exchange,
+        }
+
+
+class MetricsRegistry:
+    """
+    process 內的 histogram 彙總，輸出 Prometheus text format
+    - span(stage)：量一段程式的耗時，exchange / bot_id 從 log_context 帶
+    - 有 record_tick() 的話同一份耗時也會記到那個 tick 的 summary
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (name, labels tuple) -> Histogram
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def observe_stage(self, stage, seconds, exchange=None):
+        if exchange is None:
+            exchange = current_log_context().get("exchange", "")
+        self.observe(STAGE_METRIC, seconds, stage=stage, exchange=exchange)
+
+        recorder = _recorder.get()
+        if recorder is not None:
+            recorder.add(stage, exchange, seconds)
+
+    @contextmanager
+    def span(self, stage, exchange=None):
+        """
+        with metrics.span("create_order"):
+            client.create_order(...)
+        例外一樣會記（失敗的請求也花了時間）
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - started, exchange)
+
+    def observe_signal_to_order(self, signal):
+        """下單成功時呼叫：從策略發出訊號到交易所回應的時間，記在 bot 的 histogram"""
+        emitted_at = signal.get("emitted_at")
+        if not emitted_at:
+            return
+        context = current_log_context()
+        seconds = time.time() - emitted_at
+        self.observe(BOT_METRIC, seconds, bot_id=context.get("bot_id", ""), exchange=context.get("exchange", ""))
+        self.observe_stage("signal_to_order", seconds)
+
+    def render(self, extra=None):
+        """
+        Prometheus text format（0.0.4）
+        extra：{(name, labels): Histogram}，跟這個 process 的加在一起輸出（RQ worker 推到 Redis 的那份）
+        """
+        with self._lock:
+            merged = {key: _copy(h) for key, h in self._histograms.items()}
+        for key, h in (extra or {}).items():
+            if key in merged:
+                _add(merged[key], h)
+            else:
+                merged[key] = h
+        items = sorted((key, h.counts, h.sum, h.count, h.buckets) for key, h in merged.items())
+
+        lines = []
+        current = None
+        for (name, labels), counts, total, count, buckets in items:
+            if name != current:
+                current = name
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def drain(self):
+        """拿走目前所有 histogram 並清空（推到 Redis 用，同一份不會推兩次）"""
+        with self._lock:
+            histograms, self._histograms = self._histograms, {}
+        return histograms
+
+
+metrics = MetricsRegistry()
+
+
+@contextmanager
+def record_tick():
+    """
+    這個區塊（含裡面 copy_context 出去的 thread / coroutine）的 span 另外收一份，給 tick summary 用
+    with record_tick() as recorder:
+        ...
+    recorder.summary()
+    """
+    recorder = TickRecorder()
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+
+
+def push_worker_metrics(conn=None):
+    """
+    RQ work horse 是每個 job fork 一個、跑完就 os._exit，histogram 跟著不見
+    job 結束前把這段時間的 histogram 累加進 Redis（HINCRBY，多個 worker 同時推也不會蓋掉）
+    """
+    histograms = metrics.drain()
+    if not histograms:
+        return
+    if conn is None:
+        # metrics 到處都有 import，用到才載 redis
+        from app.utils.redis_client import redis_conn as conn
+
+    pipe = conn.pipeline(transaction=False)
+    for (name, labels), histogram in histograms.items():
+        field = json.dumps([name, labels])
+        for i, count in enumerate(histogram.counts):
+            if count:
+                pipe.hincrby(WORKER_METRICS_KEY, f"{field}\t{i}", count)
+        pipe.hincrbyfloat(WORKER_METRICS_KEY, f"{field}\tsum", histogram.sum)
+        pipe.hincrby(WORKER_METRICS_KEY, f"{field}\tcount", histogram.count)
+    pipe.execute()
+
+
+def load_worker_metrics(conn=None):
+    """push_worker_metrics 累加在 Redis 的 histogram，{(name, labels): Histogram}"""
+    if conn is None:
+        from app.utils.redis_client import redis_conn as conn
+
+    histograms = {}
+    for field, value in conn.hgetall(WORKER_METRICS_KEY).items():
+        field = field.decode() if isinstance(field, bytes) else field
+        key, part = field.rsplit("\t", 1)
+        name, labels = json.loads(key)
+        histogram = histograms.setdefault((name, tuple(tuple(pair) for pair in labels)), Histogram())
+        if part == "sum":
+            histogram.sum = float(value)
+        elif part == "count":
+            histogram.count = int(value)
+        else:
+            histogram.counts[int(part)] = int(value)
+    return histograms
+
+
+def start_metrics_server(port=METRICS_PORT, include_workers=False):
+    """
+    背景 thread 開 HTTP /metrics 給 Prometheus 抓；port=0 就不開
+    include_workers：連 RQ worker 推到 Redis 的 histogram 一起輸出（只讓一個 process 開，不然會重複算）
+    """
+    if not port:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            extra = None
+            if include_workers:
+                try:
+                    extra = load_worker_metrics()
+                except Exception as e:
+                    print(f"[Metrics] 讀 worker 的 histogram 失敗，這次只輸出本機的：{e}")
+            body = metrics.render(extra).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Prometheus 每幾秒抓一次，不要洗 log
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"[Metrics] /metrics 開在 port {port}")
+    return server
+
+
+def _copy(histogram):
+    copy = Histogram(histogram.buckets)
+    _add(copy, histogram)
+    return copy
+
+
+def _add(target, histogram):
+    target.counts = [a + b for a, b in zip(target.counts, histogram.counts)]
+    target.sum += histogram.sum
+    target.count += histogram.count
+
+
+def _percentiles(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": round(_quantile(values, 0.5) * 1000, 1),
+        "p95": round(_quantile(values, 0.95) * 1000, 1),
+        "p99": round(_quantile(values, 0.99) * 1000, 1),
+        "max": round(values[-1] * 1000, 1),
+    }
+
+
+def _quantile(values, q):
+    """已排序的 values 線性內插"""
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + [(k, v) for k, v in extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -1,8 +1,8 @@
 import redis
 import os
-from dotenv import load_dotenv
+from app.config import load_config
 
-load_dotenv()
+load_config()
 
 redis_conn = redis.Redis(
     host=os.getenv("REDIS_HOST", "127.0.0.1"),
@@ -1,12 +1,47 @@
 from rq import Worker, Queue
+from app.logger import flush_logs
+from app.utils.metrics import push_worker_metrics
 from app.utils.redis_client import redis_conn
+from app.config import load_config
+import importlib
+import os
+
+load_config()
+
+# worker 主程式先 import 好 job 會用到的模組，fork 出來的 work horse 直接繼承，不用每個 job 重新 import
+WORKER_PRELOAD = os.getenv("WORKER_PRELOAD", "app.worker_jobs")
+
+
+def preload():
+    for name in filter(None, (n.strip() for n in WORKER_PRELOAD.split(","))):
+        importlib.import_module(name)
+
+
+class FlushingWorker(Worker):
+    """
+    work horse 跑完 job 會直接 os._exit，結束前：
+    - 等背景 thread 把 log 寫完
+    - 這個 job 的 histogram 推到 Redis（scheduler 的 /metrics 會一起輸出）
+    """
+
+    def perform_job(self, job, queue):
+        try:
+            return super().perform_job(job, queue)
+        finally:
+            try:
+                push_worker_metrics()
+            except Exception as e:
+                print(f"[Metrics] 推 job 的 histogram 到 Redis 失敗：{e}")
+            flush_logs()
 
 
 def main():
+    preload()
+
     queue = Queue("default", connection=redis_conn)
 
     # 建 worker
-    worker = Worker([queue], connection=redis_conn)
+    worker = FlushingWorker([queue], connection=redis_conn)
 
     # 關鍵：with_scheduler=True，讓 worker 順便處理 enqueue_in / enqueue_at 的排程
     worker.work(with_scheduler=True)
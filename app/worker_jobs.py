@@ -1,33 +1,79 @@
+from app.exchange.rate_limiter import rate_limiter
 from app.services.strategy_service import run_strategy
-from app.services.bot_service import get_bots_for_strategy
-from app.services.trade_service import run_bot_trade, check_order_status, close_bot_position
+from app.services.bot_service import get_bot_contexts_for_strategy
+from app.exchange.exchange_factory import get_ccxt_client
+from app.services.trade_service import (
+    run_bot_trade,
+    run_bot_trades_batch,
+    check_order_status,
+    close_bot_position,
+    close_bot_positions_batch,
+    get_open_user_trades_for_bots,
+)
+from app.services.order_submitter import supports_batch_orders
+from app.services.trade_writer import TradeWriter, replay_dead_letters
+from app.services.leverage_cache import prefetch_leverage
+from app.services.async_trade_service import run_fan_out_async
+from app.services.reconcile_service import reconcile_pending_orders
+from app.services.raw_response_store import purge_raw_responses
+from app.logger import log_context
 from app.utils.db import execute, get_db, query_one
+from app.utils.metrics import TickRecorder, metrics, record_tick
 from app.utils.now import now
+from app.utils.redis_client import redis_conn
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, Any
+from contextlib import nullcontext
+from datetime import timedelta
+from rq import Queue
+from typing import Dict, Any, Optional
+import contextvars
 import json
 import os
 import time
-from dotenv import load_dotenv
+import uuid
+from app.config import load_config
 
-load_dotenv()
+load_config()
 
 # 可以用環境變數調整最大執行緒數
 MAX_WORKERS = int(os.getenv("WORKER_MAX_THREADS", 10))
 executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
 
+# fan-out 執行模式：threads（預設，ThreadPoolExecutor）/ async（ccxt.async_support + asyncio）
+EXECUTION_MODE = os.getenv("WORKER_EXECUTION_MODE", "threads").lower()
 
-def run_strategy_tick_job(strategy_id: int) -> Dict[str, Any]:
+# 下單後等幾秒開始對帳，之後沒進展就指數退避，最多等 RECONCILE_MAX_DELAY 秒、重試 RECONCILE_MAX_ATTEMPTS 輪
+ORDER_CHECK_DELAY = float(os.getenv("ORDER_CHECK_DELAY", 1))
+RECONCILE_MAX_DELAY = float(os.getenv("RECONCILE_MAX_DELAY", 60))
+RECONCILE_MAX_ATTEMPTS = int(os.getenv("RECONCILE_MAX_ATTEMPTS", 12))
+
+# bot 超過這個數量就切成多包丟給 RQ worker 分著跑（0 = 全部在這個 process 跑）
+TICK_SHARD_SIZE = int(os.getenv("TICK_SHARD_SIZE", 0))
+# shard 結果在 Redis 最多留多久（秒），有 shard 掛掉沒跑完也會自己清掉
+TICK_SHARD_TTL = int(os.getenv("TICK_SHARD_TTL", 86400))
+TICK_KEY_PREFIX = "strade:tick"
+
+queue = Queue("default", connection=redis_conn)
+
+
+def run_strategy_tick_job(strategy_id: int, signal: Optional[dict] = None) -> Dict[str, Any]:
     """
     策略排程入口：給 FastAPI / Cloud Run 呼叫用
-    - 先跑策略拿訊號
+    - 先跑策略拿訊號（scheduler 已經跑過的話直接帶 signal 進來）
     - 找出該策略底下所有 RUNNING 的 bots
     - 依 action (OPEN / CLOSE...) 多執行緒去跑 bot 下單 / 平倉
     """
+    with log_context(strategy_id=strategy_id, strategy_trade_id=(signal or {}).get("trade_id")), \
+            record_tick() as recorder:
+        return _run_strategy_tick(strategy_id, signal, recorder)
+
+
+def _run_strategy_tick(strategy_id, signal, recorder):
     print("=== 開始跑策略 Tick ===")
 
     # 呼叫策略服務，拿到訊號（可能是 OPEN / CLOSE / None）
-    signal = run_strategy(strategy_id)
+    if signal is None:
+        signal = run_strategy(strategy_id)
 
     if not signal:
         print("沒有訊號，結束。")
@@ -40,9 +86,9 @@ def run_strategy_tick_job(strategy_id: int) -> Dict[str, Any]:
     print(
         f"策略產生訊號：action={action}, side={signal.get('position_side')}, price={signal.get('price')}")
 
-    # 抓這個策略底下所有 RUNNING 的 bots
-    bots = get_bots_for_strategy(strategy_id)
-    bot_count = len(bots)
+    # 抓這個策略底下所有 RUNNING 的 bots（連同帳號 / 交易所，一次查詢、有快取）
+    contexts = get_bot_contexts_for_strategy(strategy_id)
+    bot_count = len(contexts)
     print(f"共 {bot_count} 個 bot 要處理")
 
     if bot_count == 0:
@@ -53,26 +99,28 @@ def run_strategy_tick_job(strategy_id: int) -> Dict[str, Any]:
             "action": action,
         }
 
-    futures = []
+    open_trades = None
+    skipped_count = 0  # 沒有部位可平的 bot，跟以前一樣算在 fail
 
     # 依照 action 分流：OPEN → 開倉、CLOSE → 平倉
     if action == "OPEN":
         print("執行：OPEN 訊號，準備幫所有 bot 開倉")
-
-        for bot in bots:
-            bot_id = bot["id"]
-            print(f"丟 bot 開倉 job（多執行緒）: bot_id={bot_id}")
-            future = executor.submit(run_bot_trade_task, bot_id, signal)
-            futures.append(future)
+        targets = contexts
 
     elif action in ("CLOSE", "TP_CLOSE", "SL_CLOSE"):
         print("執行：CLOSE 訊號，準備幫所有 bot 平倉")
 
-        for bot in bots:
-            bot_id = bot["id"]
-            print(f"丟 bot 平倉 job（多執行緒）: bot_id={bot_id}")
-            future = executor.submit(run_bot_close_trade_task, bot_id, signal)
-            futures.append(future)
+        # 一次查出所有 bot 的 OPEN 部位
+        open_trades = get_open_user_trades_for_bots([c["bot"]["id"] for c in contexts])
+
+        targets = []
+        for context in contexts:
+            bot_id = context["bot"]["id"]
+            if bot_id not in open_trades:
+                print(f"[Bot {bot_id}] 沒有 OPEN 部位，略過平倉")
+                skipped_count += 1
+                continue
+            targets.append(context)
 
     else:
         print(f"不支援的策略動作 action={action}，不處理。")
@@ -82,27 +130,78 @@ def run_strategy_tick_job(strategy_id: int) -> Dict[str, Any]:
             "action": action,
         }
 
-    # 等所有 thread 跑完再回應（這樣 Cloud Run 這次 request 會確定跑完）
-    success_count = 0
-    fail_count = 0
+    if TICK_SHARD_SIZE and len(targets) > TICK_SHARD_SIZE:
+        return _enqueue_shards(strategy_id, action, signal, targets, bot_count, skipped_count)
 
-    for future in as_completed(futures):
-        try:
-            ok = future.result()
-            if ok:
-                success_count += 1
-            else:
-                fail_count += 1
-        except Exception as e:
-            print(f"[run_strategy_tick_job] 有 bot job 發生例外: {e}")
-            fail_count += 1
+    success_count, fail_count = _fan_out(action, targets, signal, open_trades)
+    fail_count += skipped_count
 
     print(
         f"=== 完成策略 Tick: strategy_id={strategy_id}, "
         f"bots={bot_count}, success={success_count}, fail={fail_count} ==="
     )
+    if rate_limiter is not None:
+        rate_limiter.print_stats()
+
+    latency = recorder.summary()
+    _print_latency(latency)
+    _write_tick_summary(signal, success_count, fail_count, latency)
+
+    return {
+        "status": "completed",
+        "strategy_id": strategy_id,
+        "action": action,
+        "bot_count": bot_count,
+        "success_count": success_count,
+        "fail_count": fail_count,
+    }
 
-    with get_db() as db:
+
+def _fan_out(action, targets, signal, open_trades=None):
+    """幫 targets 這些 bot 下單 / 平倉，寫完 DB、排好對帳才回傳 (success_count, fail_count)"""
+    # 所有 bot 的 DB 寫入都丟給同一個 writer 批次寫，下單的 thread / coroutine 不用等 DB
+    writer = TradeWriter()
+
+    # 開倉前一次 MGET 所有 bot 的槓桿快取，已經設好的 bot 直接下單
+    leverage_scope = prefetch_leverage(targets) if action == "OPEN" else nullcontext()
+
+    try:
+        # 等所有 bot 跑完再回應（這樣 Cloud Run 這次 request 會確定跑完）
+        with leverage_scope:
+            if EXECUTION_MODE == "async":
+                print(f"執行模式：async，共 {len(targets)} 個 bot 同時送單")
+                success_count, fail_count, results = run_fan_out_async(
+                    action, targets, signal, writer, open_trades)
+            else:
+                success_count, fail_count, results = _fan_out_threads(
+                    action, targets, signal, writer, open_trades)
+
+    finally:
+        # 回報完成前確定所有寫入都已落地（也才拿得到 user_trade_id）
+        writer.close()
+
+    # 交易所收了但 DB 沒寫進去的 bot 算失敗（資料在 dead-letter，replay_dead_letters_job 會補寫）
+    lost = writer.failed_user_trade_ids()
+    written = [r for r in results if r.get("user_trade_id") and r["user_trade_id"] not in lost]
+    if len(written) < len(results):
+        print(
+            f"[run_strategy_tick_job] 有 {len(results) - len(written)} 個 bot 下單成功但 DB 沒寫進去，"
+            f"算失敗，已放進 dead-letter 等補寫"
+        )
+        success_count -= len(results) - len(written)
+        fail_count += len(results) - len(written)
+
+    # 查單交給 RQ 延遲 job 批次對帳，這裡不佔 thread 等
+    user_trade_ids = [r["user_trade_id"] for r in written]
+    if user_trade_ids:
+        schedule_reconcile(user_trade_ids)
+
+    return success_count, fail_count
+
+
+def _write_tick_summary(signal, success_count, fail_count, latency):
+    """tick 的成功 / 失敗數跟延遲寫進 strategy_trades.extra（一個 tick 只寫一次）"""
+    with metrics.span("db_write"), get_db() as db:
         strategy_trade = query_one(
             db, "SELECT * FROM strategy_trades WHERE id=%s", (signal["trade_id"]))
         if strategy_trade['status'] == 'OPEN':
@@ -118,6 +217,7 @@ def run_strategy_tick_job(strategy_id: int) -> Dict[str, Any]:
             except json.JSONDecodeError:
                 extra = {}
         extra.update(update_data)
+        extra["latency"] = latency
         execute(
             db,
             """
@@ -128,52 +228,357 @@ def run_strategy_tick_job(strategy_id: int) -> Dict[str, Any]:
             (json.dumps(extra), now(), signal["trade_id"]),
         )
 
+
+def _tick_key(tick_id):
+    return f"{TICK_KEY_PREFIX}:{tick_id}"
+
+
+def _enqueue_shards(strategy_id, action, signal, targets, bot_count, skipped_count):
+    """
+    bot 太多時切成每 TICK_SHARD_SIZE 個一包，各自丟成 RQ job 給所有 worker 分著跑
+    成功 / 失敗數在 Redis 用 HINCRBY 累加，最後一包跑完的 shard 再丟 finalize_tick_job 寫一次 summary
+    """
+    bot_ids = [context["bot"]["id"] for context in targets]
+    shards = [bot_ids[i:i + TICK_SHARD_SIZE] for i in range(0, len(bot_ids), TICK_SHARD_SIZE)]
+    tick_id = uuid.uuid4().hex
+    key = _tick_key(tick_id)
+
+    pipe = redis_conn.pipeline()
+    pipe.hset(key, mapping={
+        "shards_total": len(shards),
+        "shards_done": 0,
+        "success": 0,
+        "fail": skipped_count,
+        "bot_count": bot_count,
+    })
+    pipe.expire(key, TICK_SHARD_TTL)
+    pipe.execute()
+
+    for index, shard in enumerate(shards):
+        queue.enqueue(run_tick_shard_job, strategy_id, signal, tick_id, index, shard)
+
+    print(f"[Shard] {len(bot_ids)} 個 bot 切成 {len(shards)} 包丟給 worker：tick={tick_id}")
     return {
-        "status": "completed",
+        "status": "sharded",
         "strategy_id": strategy_id,
         "action": action,
         "bot_count": bot_count,
-        "success_count": success_count,
-        "fail_count": fail_count,
+        "shards": len(shards),
+        "tick_id": tick_id,
     }
 
 
-def run_bot_trade_task(bot_id: int, signal: dict) -> bool:
-    """單一 bot 執行開倉邏輯（在 thread 裡跑）"""
-    print(f"[Bot {bot_id}] 開始執行下單邏輯")
-    result = run_bot_trade(bot_id, signal)
+def run_tick_shard_job(strategy_id: int, signal: dict, tick_id: str, shard_index: int, bot_ids: list):
+    """
+    RQ job：跑一包 bot（帳號金鑰不放進 job，這裡自己查 context）
+    結果累加到 Redis，最後一包負責排 finalize
+    """
+    with log_context(strategy_id=strategy_id, strategy_trade_id=signal.get("trade_id"), shard=shard_index), \
+            record_tick() as recorder:
+        action = (signal.get("action") or "").upper()
+        print(f"[Shard] 開始第 {shard_index + 1} 包：{len(bot_ids)} 個 bot, action={action}")
 
-    if not result:
-        print(f"[Bot {bot_id}] 下單失敗或被略過")
-        return False
+        success_count = 0
+        try:
+            wanted = set(bot_ids)
+            targets = [c for c in get_bot_contexts_for_strategy(strategy_id) if c["bot"]["id"] in wanted]
+            open_trades = None
+            if action != "OPEN":
+                open_trades = get_open_user_trades_for_bots([c["bot"]["id"] for c in targets])
+                targets = [c for c in targets if c["bot"]["id"] in open_trades]
+            success_count, _ = _fan_out(action, targets, signal, open_trades)
+        except Exception as e:
+            print(f"[Shard] 第 {shard_index + 1} 包執行失敗：{e}")
+
+        # 中途停掉 / 平掉的 bot、整包失敗的都算 fail，總數才對得起來
+        fail_count = len(bot_ids) - success_count
+        print(f"[Shard] 第 {shard_index + 1} 包完成：success={success_count}, fail={fail_count}")
+        if rate_limiter is not None:
+            rate_limiter.print_stats()
+
+        samples = [[stage, exchange, values] for (stage, exchange), values in recorder.samples.items()]
+
+    key = _tick_key(tick_id)
+    pipe = redis_conn.pipeline()
+    pipe.hincrby(key, "success", success_count)
+    pipe.hincrby(key, "fail", fail_count)
+    pipe.rpush(f"{key}:samples", json.dumps(samples))
+    pipe.expire(f"{key}:samples", TICK_SHARD_TTL)
+    pipe.hincrby(key, "shards_done", 1)
+    pipe.hget(key, "shards_total")
+    *_, shards_done, shards_total = pipe.execute()
+
+    # MULTI 裡的 HINCRBY 是原子的，只有一包會剛好看到 done == total
+    if shards_total is not None and shards_done == int(shards_total):
+        try:
+            queue.enqueue(finalize_tick_job, strategy_id, signal, tick_id)
+        except Exception as e:
+            print(f"[Shard] 排 finalize 失敗，直接寫 summary：{e}")
+            finalize_tick_job(strategy_id, signal, tick_id)
+
+    return {"tick_id": tick_id, "shard": shard_index, "success_count": success_count, "fail_count": fail_count}
+
+
+def finalize_tick_job(strategy_id: int, signal: dict, tick_id: str):
+    """RQ job：所有 shard 都跑完後，把 Redis 裡累加的結果寫進 strategy_trades.extra 一次"""
+    key = _tick_key(tick_id)
+    pipe = redis_conn.pipeline()
+    pipe.hgetall(key)
+    pipe.lrange(f"{key}:samples", 0, -1)
+    totals, shard_samples = pipe.execute()
+    if not totals:
+        print(f"[Shard] tick={tick_id} 的結果已經不在 Redis（過期或已寫過），略過")
+        return {"status": "missing", "tick_id": tick_id}
+
+    totals = {k.decode(): int(v) for k, v in totals.items()}
+    recorder = TickRecorder()
+    for samples in shard_samples:
+        for stage, exchange, values in json.loads(samples):
+            for seconds in values:
+                recorder.add(stage, exchange, seconds)
+
+    with log_context(strategy_id=strategy_id, strategy_trade_id=signal.get("trade_id")):
+        print(
+            f"=== 完成策略 Tick: strategy_id={strategy_id}, bots={totals['bot_count']}, "
+            f"shards={totals['shards_total']}, success={totals['success']}, fail={totals['fail']} ==="
+        )
+        latency = recorder.summary()
+        _print_latency(latency)
+        _write_tick_summary(signal, totals["success"], totals["fail"], latency)
 
-    user_trade_id = result["user_trade_id"]
-    exchange_order_id = result["exchange_order_id"]
+    redis_conn.delete(key, f"{key}:samples")
+    return {
+        "status": "completed",
+        "strategy_id": strategy_id,
+        "tick_id": tick_id,
+        "bot_count": totals["bot_count"],
+        "success_count": totals["success"],
+        "fail_count": totals["fail"],
+    }
+
+
+def _print_latency(latency):
+    """tick 結束印出最慢的 stage / 交易所（p95）"""
+    stages = sorted(latency["stages"].items(), key=lambda item: item[1]["p95"], reverse=True)
+    if not stages:
+        return
+    print("[Metrics] 各 stage p95：" + "、".join(f"{stage} {p['p95']:.0f} ms" for stage, p in stages))
+
+    orders = {
+        exchange: by_stage["create_order"]
+        for exchange, by_stage in latency["exchanges"].items()
+        if "create_order" in by_stage
+    }
+    if orders:
+        exchange, p = max(orders.items(), key=lambda item: item[1]["p95"])
+        print(f"[Metrics] 下單最慢的交易所：{exchange} create_order p95={p['p95']:.0f} ms p99={p['p99']:.0f} ms")
+
+
+def _fan_out_threads(action, contexts, signal, writer, open_trades=None):
+    """
+    thread pool 版 fan-out，回傳 (success_count, fail_count, results)
+    同一個帳號有好幾個 bot、交易所支援批次下單的，整組丟一個 job 用 create_orders 一次送
+    """
+    batches, singles = _group_batches(action, contexts, open_trades or {})
+    futures = {}  # future -> 這個 job 有幾個 bot
+
+    for group in batches:
+        print(f"丟批次下單 job（多執行緒）: exchange_account_id={group[0]['exchange_account_id']}，{len(group)} 個 bot")
+        future = executor.submit(
+            contextvars.copy_context().run, run_batch_trade_task, action, group, signal, writer, open_trades)
+        futures[future] = len(group)
+
+    for context in singles:
+        bot_id = context["bot"]["id"]
+        if action == "OPEN":
+            print(f"丟 bot 開倉 job（多執行緒）: bot_id={bot_id}")
+            future = executor.submit(
+                contextvars.copy_context().run, run_bot_trade_task, bot_id, signal, context, writer)
+        else:
+            print(f"丟 bot 平倉 job（多執行緒）: bot_id={bot_id}")
+            future = executor.submit(
+                contextvars.copy_context().run,
+                run_bot_close_trade_task, bot_id, signal, context, open_trades[bot_id], writer)
+        futures[future] = 1
+
+    success_count = 0
+    fail_count = 0
+    results = []
+
+    for future in as_completed(futures):
+        try:
+            outcome = future.result()
+        except Exception as e:
+            print(f"[run_strategy_tick_job] 有 bot job 發生例外: {e}")
+            fail_count += futures[future]
+            continue
+        for result in outcome if isinstance(outcome, list) else [outcome]:
+            if result:
+                success_count += 1
+                results.append(result)
+            else:
+                fail_count += 1
+
+    return success_count, fail_count, results
+
+
+def _group_batches(action, contexts, open_trades):
+    """
+    回傳 (批次下單的組, 一個一個送的 bot)
+    同一個帳號 2 個以上 bot、交易所支援 createOrders 才成一組；平倉看的是部位開在哪個帳號
+    """
+    groups = {}
+    for context in contexts:
+        account_id = context["exchange_account_id"]
+        if action != "OPEN":
+            user_trade = open_trades.get(context["bot"]["id"])
+            if not user_trade or user_trade["exchange_account_id"] != account_id:
+                account_id = None  # 沒有部位 / 部位在別的帳號，走原本一個一個的流程
+        groups.setdefault(account_id, []).append(context)
+
+    singles = groups.pop(None, [])
+    batches = []
+    for group in groups.values():
+        if len(group) > 1 and _supports_batch(group[0]):
+            batches.append(group)
+        else:
+            singles.extend(group)
+    return batches, singles
+
+
+def _supports_batch(context):
+    try:
+        client = get_ccxt_client(context["exchange_account_id"], context["exchange_code"], context["params"])
+    except Exception:
+        return False  # client 建不起來就交給單筆流程處理 / 記錯
+    return supports_batch_orders(client)
+
+
+def run_batch_trade_task(action, contexts, signal, writer, open_trades=None):
+    """同一個帳號的一組 bot 一起開倉 / 平倉（在 thread 裡跑），回傳每個 bot 的結果"""
+    first = contexts[0]
+    with log_context(exchange_account_id=first["exchange_account_id"], exchange=first["exchange_code"]):
+        with metrics.span("client_build", first["exchange_code"]):
+            client = get_ccxt_client(first["exchange_account_id"], first["exchange_code"], first["params"])
+        if action == "OPEN":
+            return run_bot_trades_batch(contexts, signal, client, writer)
+        user_trades = [open_trades[context["bot"]["id"]] for context in contexts]
+        return close_bot_positions_batch(user_trades, signal, client, first["exchange_code"], writer)
+
+
+def _bot_log_context(bot_id, signal, context=None):
+    # fan-out 會把 tick 的 context 帶進 thread，這裡再補上這個 bot 的欄位
+    return log_context(
+        bot_id=bot_id,
+        strategy_trade_id=signal.get("trade_id"),
+        exchange=context["exchange_code"] if context else None,
+    )
+
+
+def run_bot_trade_task(
+    bot_id: int, signal: dict, context: dict = None, writer: TradeWriter = None
+) -> Optional[dict]:
+    """
+    單一 bot 執行開倉邏輯（在 thread 裡跑）
+    有 writer 時只負責下單，寫 DB / 查單由 tick 統一處理
+    """
+    with _bot_log_context(bot_id, signal, context):
+        print(f"[Bot {bot_id}] 開始執行下單邏輯")
+        result = run_bot_trade(bot_id, signal, context=context, writer=writer)
+
+        if not result:
+            print(f"[Bot {bot_id}] 下單失敗或被略過")
+            return None
+
+        if writer is not None:
+            return result
+
+        user_trade_id = result["user_trade_id"]
+        exchange_order_id = result["exchange_order_id"]
 
-    print(f"[Bot {bot_id}] 已建立 user_trade {user_trade_id}，等待 1 秒後檢查訂單狀態")
-    time.sleep(1)
-    check_order_status_task(user_trade_id, exchange_order_id)
-    return True
+        print(f"[Bot {bot_id}] 已建立 user_trade {user_trade_id}，排程對帳 order={exchange_order_id}")
+        schedule_reconcile([user_trade_id])
+        return result
 
 
-def run_bot_close_trade_task(bot_id: int, signal: dict) -> bool:
+def run_bot_close_trade_task(
+    bot_id: int,
+    signal: dict,
+    context: dict = None,
+    user_trade: dict = None,
+    writer: TradeWriter = None,
+) -> Optional[dict]:
     """單一 bot 平倉 job（在 thread 裡跑）"""
-    print(f"[Bot {bot_id}] 開始執行平倉邏輯")
-    result = close_bot_position(bot_id, signal)
+    with _bot_log_context(bot_id, signal, context):
+        print(f"[Bot {bot_id}] 開始執行平倉邏輯")
+        result = close_bot_position(
+            bot_id, signal, context=context, user_trade=user_trade, writer=writer)
 
-    if not result:
-        print(f"[Bot {bot_id}] 平倉失敗或沒有部位")
-        return False
+        if not result:
+            print(f"[Bot {bot_id}] 平倉失敗或沒有部位")
+            return None
 
-    user_trade_id = result["user_trade_id"]
-    exchange_order_id = result["exchange_order_id"]
+        if writer is not None:
+            return result
 
-    print(f"[Bot {bot_id}] 已建立平倉訂單，等待 1 秒後檢查訂單狀態 (CLOSE)")
-    time.sleep(1)
-    check_order_status_task(user_trade_id, exchange_order_id)
-    return True
+        user_trade_id = result["user_trade_id"]
+        exchange_order_id = result["exchange_order_id"]
 
+        print(f"[Bot {bot_id}] 已建立平倉訂單，排程對帳 (CLOSE) order={exchange_order_id}")
+        schedule_reconcile([user_trade_id])
+        return result
 
-def check_order_status_task(user_trade_id: int, exchange_order_id: str):
+
+def check_order_status_task(user_trade_id: int, exchange_order_id: str, writer: TradeWriter = None):
     """從交易所查訂單狀態，並更新 user_trade_orders & user_trades"""
-    return check_order_status(user_trade_id, exchange_order_id)
+    return check_order_status(user_trade_id, exchange_order_id, writer=writer)
+
+
+def schedule_reconcile(user_trade_ids=None, attempt: int = 0):
+    """
+    用 RQ enqueue_in 排一輪對帳（worker 要開 with_scheduler=True）
+    第 0 輪等 ORDER_CHECK_DELAY 秒，之後每輪沒進展就加倍，最多 RECONCILE_MAX_DELAY 秒
+    """
+    delay = min(ORDER_CHECK_DELAY * (2 ** attempt), RECONCILE_MAX_DELAY)
+    try:
+        queue.enqueue_in(timedelta(seconds=delay), reconcile_orders_job, user_trade_ids, attempt)
+    except Exception as e:
+        # Redis 掛了就退回同步查一次，至少不要漏掉
+        print(f"[Reconcile] 排程對帳失敗，改成直接對帳：{e}")
+        time.sleep(delay)
+        reconcile_pending_orders(user_trade_ids)
+
+
+def reconcile_orders_job(user_trade_ids=None, attempt: int = 0):
+    """
+    RQ job：對帳還沒結束的訂單；user_trade_ids=None 代表全部掃一次
+    還有沒結束的就再排下一輪（有進展就維持同樣間隔，沒進展才退避）
+    """
+    print(f"[Reconcile] 第 {attempt + 1} 輪對帳 user_trade_ids={user_trade_ids or 'ALL'}")
+    pending, progressed = reconcile_pending_orders(user_trade_ids)
+
+    if not pending:
+        return {"status": "done", "attempt": attempt}
+
+    if user_trade_ids is None:
+        # 全量掃描只跑一輪，下一輪交給 scheduler 定期排
+        return {"status": "swept", "pending": pending}
+
+    next_attempt = attempt if progressed else attempt + 1
+    if next_attempt >= RECONCILE_MAX_ATTEMPTS:
+        print(f"[Reconcile] 超過 {RECONCILE_MAX_ATTEMPTS} 輪仍未完成：{pending}，留給定期掃描")
+        return {"status": "gave_up", "pending": pending}
+
+    schedule_reconcile(pending, next_attempt)
+    return {"status": "rescheduled", "pending": pending, "attempt": next_attempt}
+
+
+def purge_raw_responses_job():
+    """RQ job：清掉（或封存後清掉）超過保留天數的完整交易所回應"""
+    return {"purged": purge_raw_responses()}
+
+
+def replay_dead_letters_job():
+    """RQ job：補寫 TradeWriter 寫不進去的資料（補完的訂單交給定期對帳）"""
+    written, failed = replay_dead_letters()
+    return {"written": written, "failed": failed}
@@ -0,0 +1,97 @@
+from app.exchange.fill_event_sources import LocalFillEventSource
+from app.services import fill_event_service
+from app.services.fill_event_service import FillEventService
+import time
+
+
+class StubWriter:
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _row(order_id):
+    return {
+        "id": int(order_id), "user_trade_id": int(order_id), "exchange_order_id": order_id, "client_order_id": None,
+        "type": "OPEN", "price": 100, "filled_qty": 0, "raw_response": None, "open_order_fee": 0,
+        "entry_price": 100, "quantity": 1, "position_side": "LONG", "leverage": 1,
+    }
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_unmatched_event_survives_other_events_until_retry(monkeypatch):
+    monkeypatch.setattr(fill_event_service, "FILL_EVENT_RETRY_INTERVAL", 0.5)
+    monkeypatch.setattr(fill_event_service, "FILL_EVENT_UNMATCHED_TTL", 30)
+
+    written = set()  # DB 裡已經有的 exchange_order_id（模擬 write-behind 還沒 flush）
+    applied = []
+    monkeypatch.setattr(
+        fill_event_service, "get_pending_orders",
+        lambda exchange_account_id, exchange_order_ids, client_order_ids: [
+            _row(i) for i in exchange_order_ids if i in written],
+    )
+    monkeypatch.setattr(
+        fill_event_service, "apply_order_update",
+        lambda user_trade, row, order, writer, open_order_fee=None: applied.append(order["id"]),
+    )
+
+    source = LocalFillEventSource()
+    service = FillEventService(source, writer=StubWriter())
+    service.start()
+    source.watch_account({"exchange_account_id": 1})
+    try:
+        # A 推得比 DB 寫入快，找不到訂單
+        source.emit(1, {"id": "1", "status": "closed"})
+        assert _wait_for(lambda: (1, "1") in service._unmatched)
+
+        # 0.2 秒後 B 進來觸發一輪處理，A 還沒到重試時間，不能被丟掉
+        time.sleep(0.2)
+        written.add("2")
+        source.emit(1, {"id": "2", "status": "closed"})
+        assert _wait_for(lambda: "2" in applied)
+        assert (1, "1") in service._unmatched
+        assert service.dropped == 0
+
+        # A 的訂單寫進 DB 之後，下一次重試就會套用
+        written.add("1")
+        assert _wait_for(lambda: "1" in applied)
+        assert service.dropped == 0
+        assert not service._unmatched
+    finally:
+        service.stop()
+
+
+def test_event_matches_unconfirmed_order_by_client_order_id(monkeypatch):
+    # 下單結果不明的 PENDING 單還沒有 exchange_order_id，只有 clientOrderId
+    pending = {**_row("7"), "exchange_order_id": None, "client_order_id": "sb1b7o"}
+    lookups = []
+    applied = []
+
+    def get_pending_orders(exchange_account_id, exchange_order_ids, client_order_ids):
+        lookups.append((exchange_order_ids, client_order_ids))
+        return [pending] if "sb1b7o" in client_order_ids else []
+
+    monkeypatch.setattr(fill_event_service, "get_pending_orders", get_pending_orders)
+    monkeypatch.setattr(
+        fill_event_service, "apply_order_update",
+        lambda user_trade, row, order, writer, open_order_fee=None: applied.append((row["id"], order["id"])),
+    )
+
+    service = FillEventService(LocalFillEventSource(), writer=StubWriter())
+    service._on_order(1, {"id": "900", "clientOrderId": "sb1b7o", "status": "closed"})
+    service._on_order(1, {"id": "901", "clientOrderId": "manual", "status": "closed"})
+    service.process_pending()
+
+    assert sorted(lookups[0][1]) == ["manual", "sb1b7o"]
+    assert applied == [(7, "900")]
+    assert (1, "901") in service._unmatched